@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+
+# This file is part of mlog
+#
+# mlog is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# mlog is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mlog.  If not, see <http://www.gnu.org/licenses/>.
+"""Generates a synthetic mlog database for the benchmarks.
+
+   Messages are made of pseudo words drawn from a fixed vocabulary, with a
+   log-normally distributed length. Every log gets between zero and
+   --tags-per-log tags, frequent tags being much more common than rare ones.
+   Dates are spread evenly over --days days ending now. The output only
+   depends on the options, so two databases generated with the same options
+   are identical (apart from the dates)
+
+   usage: generate.py [options] DATABASE
+
+"""
+import os
+import sys
+import math
+import random
+import sqlite3
+import argparse
+import datetime
+import subprocess
+
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                   os.pardir, 'src')
+MLOG = os.path.join(SRC, 'mlog.py')
+
+sys.path.insert(0, os.path.join(SRC, 'core'))
+from common import messageHash
+from compression import compressMessage, registerFunctions
+
+VOCABULARY_SIZE = 5000
+
+
+def vocabulary(rng):
+    """Returns a list of pseudo words"""
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    words = set()
+    while len(words) < VOCABULARY_SIZE:
+        length = rng.randint(2, 10)
+        words.add(''.join(rng.choice(letters) for i in range(length)))
+    return sorted(words)
+
+
+def message(rng, words, meanLength, sigma):
+    """Returns a message of about meanLength characters on average"""
+    # the mean of a log-normal distribution is exp(mu + sigma^2 / 2)
+    mu = math.log(meanLength) - sigma * sigma / 2
+    length = max(1, int(rng.lognormvariate(mu, sigma)))
+    text = []
+    size = 0
+    while size < length:
+        word = words[int(len(words) * rng.random() ** 3)]
+        text.append(word)
+        size += len(word) + 1
+    return ' '.join(text)
+
+
+def createSchema(dbPath):
+    """Lets mlog create an empty database with the current schema"""
+    with open(os.devnull, 'w') as devnull:
+        subprocess.check_call((sys.executable, MLOG, '-d', dbPath, 'tags'),
+                              stdout=devnull)
+
+
+def generate(args):
+    rng = random.Random(args.seed)
+    words = vocabulary(rng)
+
+    createSchema(args.database)
+    connection = sqlite3.connect(args.database)
+    connection.execute('PRAGMA synchronous = off')
+    # used by the full text index triggers
+    registerFunctions(connection)
+
+    with connection:
+        connection.executemany('INSERT INTO tags (id, name) VALUES (?, ?)',
+                               [(i + 1, 'tag%05d' % i)
+                                for i in range(args.tags)])
+
+    end = datetime.datetime.now()
+    start = end - datetime.timedelta(days=args.days)
+    step = (end - start).total_seconds() / max(1, args.logs)
+
+    logId = 0
+    while logId < args.logs:
+        logRows = []
+        tagRows = []
+        for i in range(min(args.batch_size, args.logs - logId)):
+            logId += 1
+            date = start + datetime.timedelta(seconds=logId * step)
+            text = message(rng, words, args.message_length,
+                           args.message_sigma)
+            logRows.append((logId, date.strftime('%Y-%m-%d %H:%M:%S.%f'),
+                            compressMessage(text), messageHash(text)))
+            count = rng.randint(0, args.tags_per_log)
+            tags = set(1 + int(args.tags * rng.random() ** 2)
+                       for t in range(count))
+            tagRows.extend((logId, tagId) for tagId in tags)
+        with connection:
+            connection.executemany('INSERT INTO logs (id, date, message, '
+                                   'hash) VALUES (?, ?, ?, ?)', logRows)
+            connection.executemany('INSERT INTO "logTags" (log_id, tag_id) '
+                                   'VALUES (?, ?)', tagRows)
+        sys.stderr.write('\r%d/%d logs' % (logId, args.logs))
+    sys.stderr.write('\n')
+
+    connection.execute('ANALYZE')
+    connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic mlog '
+                                                 'database')
+    parser.add_argument('database', help='Database file to create')
+    parser.add_argument('-n', '--logs', type=int, default=100000,
+                        help='Number of logs (default 100000)')
+    parser.add_argument('-t', '--tags', type=int, default=200,
+                        help='Number of tags (default 200)')
+    parser.add_argument('-k', '--tags-per-log', type=int, default=3,
+                        help='Maximum number of tags per log (default 3)')
+    parser.add_argument('-l', '--message-length', type=int, default=200,
+                        help='Mean message length in characters '
+                             '(default 200)')
+    parser.add_argument('--message-sigma', type=float, default=1.0,
+                        help='Spread of the log-normal message length '
+                             'distribution (default 1.0)')
+    parser.add_argument('--days', type=int, default=3650,
+                        help='Days covered by the logs (default 3650)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Random seed (default 0)')
+    parser.add_argument('--batch-size', type=int, default=50000,
+                        help='Logs inserted per transaction (default 50000)')
+    args = parser.parse_args()
+
+    if os.path.exists(args.database):
+        parser.error('%s already exists' % args.database)
+    generate(args)
+
+
+if __name__ == '__main__':
+    main()
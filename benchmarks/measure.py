@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+# This file is part of mlog
+#
+# mlog is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# mlog is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mlog.  If not, see <http://www.gnu.org/licenses/>.
+"""Runs a single mlog command and writes its measurements, as a JSON object,
+   to STATS_FILE: the time spent in mlog's main function, the peak resident
+   set size of the process and the number of SQL statements executed.
+
+   Statements are counted at the sqlite3 module level, so both the SQLAlchemy
+   code paths and the ones using sqlite3 directly are counted. Command output
+   is discarded. Used by run.py
+
+   usage: measure.py STATS_FILE MLOG_ARGUMENTS...
+
+"""
+import os
+import sys
+import json
+import time
+import sqlite3
+import sqlite3.dbapi2
+import resource
+
+
+statements = [0]
+
+
+class CountingCursor(sqlite3.Cursor):
+    def execute(self, *args):
+        statements[0] += 1
+        return sqlite3.Cursor.execute(self, *args)
+
+    def executemany(self, *args):
+        statements[0] += 1
+        return sqlite3.Cursor.executemany(self, *args)
+
+
+class CountingConnection(sqlite3.Connection):
+    def cursor(self, factory=CountingCursor):
+        return sqlite3.Connection.cursor(self, factory)
+
+    def execute(self, *args):
+        return self.cursor().execute(*args)
+
+    def executemany(self, *args):
+        return self.cursor().executemany(*args)
+
+
+def countingConnect(*args, **kwargs):
+    kwargs.setdefault('factory', CountingConnection)
+    return connect(*args, **kwargs)
+
+
+connect = sqlite3.connect
+sqlite3.connect = sqlite3.dbapi2.connect = countingConnect
+
+
+def main():
+    statsFile = sys.argv[1]
+    sys.argv = ['mlog'] + sys.argv[2:]
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                    os.pardir, 'src'))
+
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    start = time.time()
+    status = 0
+    try:
+        import mlog
+        status = mlog.main() or 0
+    except SystemExit as exit:
+        status = exit.code or 0
+    except Exception as error:
+        sys.stderr.write('%s\n' % error)
+        status = 1
+    elapsed = time.time() - start
+    sys.stdout = stdout
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    with open(statsFile, 'w') as fd:
+        json.dump({'time': elapsed,
+                   # kilobytes on Linux
+                   'maxrss': usage.ru_maxrss,
+                   'statements': statements[0],
+                   'status': status}, fd)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+
+# This file is part of mlog
+#
+# mlog is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# mlog is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mlog.  If not, see <http://www.gnu.org/licenses/>.
+"""Runs timed mlog scenarios against a database made by generate.py
+
+   Every scenario is run --repeat times, each time in a fresh process, and
+   reports its wall time (interpreter startup included), the time spent in
+   mlog itself, the peak RSS and the number of SQL statements. Results are
+   saved as JSON and can be compared with an earlier run using --compare.
+   The add, edit and delete scenarios modify the database slightly: adds and
+   deletes balance out, edits append a line to the newest log
+
+   usage: run.py [options] DATABASE
+
+"""
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import tempfile
+import datetime
+import platform
+import subprocess
+
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+MEASURE = os.path.join(BENCHMARKS, 'measure.py')
+
+
+def sample(dbPath):
+    """Picks the tags, keyword and dates the scenarios filter on"""
+    connection = sqlite3.connect(dbPath)
+    try:
+        tags = [row[0] for row in connection.execute(
+                    'SELECT tags.name FROM tags JOIN "logTags" '
+                    'ON "logTags".tag_id = tags.id '
+                    'GROUP BY tags.id ORDER BY count(*) DESC')]
+        first, last = connection.execute(
+            'SELECT min(date), max(date) FROM logs').fetchone()
+        message, = connection.execute(
+            "SELECT message FROM logs WHERE typeof(message) = 'text' "
+            'ORDER BY id LIMIT 1').fetchone()
+        logs, = connection.execute('SELECT count(*) FROM logs').fetchone()
+    finally:
+        connection.close()
+
+    if not tags or not first:
+        raise SystemExit('%s holds no tagged logs, create it with '
+                         'generate.py' % dbPath)
+    first = datetime.datetime.strptime(first[:10], '%Y-%m-%d')
+    last = datetime.datetime.strptime(last[:10], '%Y-%m-%d')
+    middle = first + (last - first) // 2
+    return {'logs': logs,
+            'commonTag': tags[0],
+            'rareTag': tags[-1],
+            'keyword': message.split()[0],
+            'after': middle.strftime('%Y-%m-%dT%H:%M:%S'),
+            'before': (middle + datetime.timedelta(days=2))
+                      .strftime('%Y-%m-%dT%H:%M:%S')}
+
+
+def scenarios(values, editor):
+    """Returns (name, mlog arguments, environment) tuples"""
+    noFastPath = {'MLOG_NO_FASTPATH': '1'}
+    add = ['add', '-t', values['commonTag'], 'benchmark',
+           '--', 'benchmark message']
+    listLogs = ['list', '--no-pager']
+    return (
+        ('add', add, {}),
+        ('add (ORM)', add, noFastPath),
+        ('list latest', listLogs + ['-n', '50'], {}),
+        ('list common tag', listLogs + ['-n', '1000',
+                                        '-t', values['commonTag']], {}),
+        ('list rare tag', listLogs + ['-t', values['rareTag']], {}),
+        ('list keyword', listLogs + ['-n', '1000', values['keyword']], {}),
+        ('list keyword rank', listLogs + ['-n', '1000', '--rank',
+                                          values['keyword']], {}),
+        ('list dates', listLogs + ['-a', values['after'],
+                                   '-b', values['before']], {}),
+        ('tags', ['tags'], {}),
+        ('edit', ['edit', 'LAST', '-t', values['commonTag']],
+         {'EDITOR': editor}),
+        # removes the logs added by the add scenarios
+        ('delete', ['delete', 'LAST'], {}),
+    )
+
+
+def lastLogId(dbPath):
+    connection = sqlite3.connect(dbPath)
+    try:
+        return connection.execute('SELECT max(id) FROM logs').fetchone()[0]
+    finally:
+        connection.close()
+
+
+def measure(dbPath, arguments, env):
+    """Runs one mlog command in a new process and returns its measurements"""
+    arguments = [str(lastLogId(dbPath)) if a == 'LAST' else a
+                 for a in arguments]
+    fd, statsFile = tempfile.mkstemp(prefix='mlog-bench-')
+    os.close(fd)
+    try:
+        start = time.time()
+        subprocess.check_call([sys.executable, MEASURE, statsFile,
+                               '-d', dbPath] + arguments, env=env)
+        wall = time.time() - start
+        with open(statsFile) as fd:
+            stats = json.load(fd)
+    finally:
+        os.unlink(statsFile)
+    if stats['status']:
+        raise SystemExit('mlog %s failed' % ' '.join(arguments))
+    stats['wall'] = wall
+    return stats
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def run(args):
+    values = sample(args.database)
+    # a non interactive "editor" for the edit scenario
+    fd, editor = tempfile.mkstemp(prefix='mlog-bench-')
+    os.write(fd, b'#!/bin/sh\necho edited >> "$1"\n')
+    os.close(fd)
+    os.chmod(editor, 0o755)
+
+    env = dict(os.environ)
+    # the scenarios measure the command itself, not a running daemon
+    env['MLOG_NO_DAEMON'] = '1'
+    results = []
+    try:
+        for name, arguments, extraEnv in scenarios(values, editor):
+            if args.scenarios and name not in args.scenarios:
+                continue
+            scenarioEnv = dict(env, **extraEnv)
+            runs = [measure(args.database, arguments, scenarioEnv)
+                    for i in range(args.repeat)]
+            result = {'name': name,
+                      'arguments': arguments,
+                      'wall': median([r['wall'] for r in runs]),
+                      'time': median([r['time'] for r in runs]),
+                      'maxrss': max(r['maxrss'] for r in runs),
+                      'statements': median([r['statements'] for r in runs])}
+            results.append(result)
+            report(result)
+    finally:
+        os.unlink(editor)
+
+    return {'commit': commitId(),
+            'date': datetime.datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'database': {'path': os.path.abspath(args.database),
+                         'logs': values['logs'],
+                         'size': os.path.getsize(args.database)},
+            'repeat': args.repeat,
+            'scenarios': results}
+
+
+def commitId():
+    try:
+        with open(os.devnull, 'w') as devnull:
+            output = subprocess.check_output(
+                ('git', 'rev-parse', '--short', 'HEAD'),
+                cwd=BENCHMARKS, stderr=devnull)
+        return output.decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def report(result):
+    print('%-20s wall %8.1f ms   mlog %8.1f ms   rss %7.1f MB   %5d statements'
+          % (result['name'], result['wall'] * 1000, result['time'] * 1000,
+             result['maxrss'] / 1024.0, result['statements']))
+
+
+def compare(old, new):
+    """Prints the relative change of every scenario between two runs"""
+    print('%s (%s) -> %s (%s)' % (old['commit'], old['date'],
+                                  new['commit'], new['date']))
+    previous = dict((r['name'], r) for r in old['scenarios'])
+    for result in new['scenarios']:
+        before = previous.get(result['name'])
+        if before is None:
+            continue
+        print('%-20s wall %+7.1f%%   mlog %+7.1f%%   rss %+7.1f%%   '
+              'statements %+d'
+              % (result['name'],
+                 change(before['wall'], result['wall']),
+                 change(before['time'], result['time']),
+                 change(before['maxrss'], result['maxrss']),
+                 result['statements'] - before['statements']))
+
+
+def change(before, after):
+    return (after - before) * 100.0 / before if before else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='mlog benchmark scenarios')
+    parser.add_argument('database', nargs='?',
+                        help='Database created by generate.py')
+    parser.add_argument('-n', '--repeat', type=int, default=5,
+                        help='Runs per scenario (default 5)')
+    parser.add_argument('-s', '--scenario', dest='scenarios',
+                        action='append',
+                        help='Only run the given scenario (repeatable)')
+    parser.add_argument('-o', '--output',
+                        help='Save the results to the given JSON file')
+    parser.add_argument('--compare', nargs='+', metavar='RESULTS',
+                        help='Compare with an earlier results file; given '
+                             'two files, compare them without running')
+    args = parser.parse_args()
+
+    if args.compare and len(args.compare) > 2:
+        parser.error('--compare takes one or two results files')
+    if args.compare and len(args.compare) == 2:
+        with open(args.compare[0]) as old, open(args.compare[1]) as new:
+            compare(json.load(old), json.load(new))
+        return
+    if not args.database:
+        parser.error('a database is required')
+
+    results = run(args)
+    if args.output:
+        with open(args.output, 'w') as fd:
+            json.dump(results, fd, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare[0]) as fd:
+            compare(json.load(fd), results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+# This file is part of mlog
+#
+# mlog is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# mlog is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mlog.  If not, see <http://www.gnu.org/licenses/>.
+"""Measures the wall time of "mlog add" invocations, with and without the
+   fast path that skips SQLAlchemy, on a temporary database
+
+   usage: startup.py [-n RUNS]
+
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+
+MLOG = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                    os.pardir, 'src', 'mlog.py')
+
+
+def timeAdd(dbPath, runs, env):
+    """Returns the wall times of runs "mlog add" invocations"""
+    times = []
+    for i in range(runs):
+        start = time.time()
+        subprocess.check_call((sys.executable, MLOG, '-d', dbPath, 'add',
+                               '-t', 'bench', 'startup',
+                               '--', 'benchmark %d' % i), env=env)
+        times.append(time.time() - start)
+    return times
+
+
+def report(name, times):
+    times = sorted(times)
+    print('%-12s min %7.1f ms   median %7.1f ms   max %7.1f ms'
+          % (name, times[0] * 1000, times[len(times) // 2] * 1000,
+             times[-1] * 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='mlog startup benchmark')
+    parser.add_argument('-n', '--runs', type=int, default=20,
+                        help='Invocations per scenario')
+    args = parser.parse_args()
+
+    tmpDir = tempfile.mkdtemp(prefix='mlog-bench-')
+    try:
+        dbPath = os.path.join(tmpDir, 'bench.db')
+        env = dict(os.environ)
+        # first run creates the database
+        timeAdd(dbPath, 1, env)
+
+        report('fast path', timeAdd(dbPath, args.runs, env))
+        env['MLOG_NO_FASTPATH'] = '1'
+        report('ORM path', timeAdd(dbPath, args.runs, env))
+    finally:
+        shutil.rmtree(tmpDir)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,6 @@
 """Contains mlog core modules
 
 """
-__all__ = ('db', 'errors')
-
+__all__ = ('archive', 'asyncstore', 'client', 'common', 'compression',
+           'config', 'db', 'errors', 'fastpath', 'scan', 'schema', 'server',
+           'spool', 'store', 'tagquery', 'timings', 'transfer')
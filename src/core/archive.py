@@ -0,0 +1,294 @@
+# This file is part of mlog
+#
+# mlog is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# mlog is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mlog.  If not, see <http://www.gnu.org/licenses/>.
+"""Yearly archives of a log database.
+
+   The archive command moves the logs of past years out of the database into
+   one archive per year, a database file next to it named after the year
+   (~/.mlog-db.2019 for ~/.mlog-db). Archives are ordinary mlog databases and
+   the logs keep their ids in them, so the database itself stays as small as
+   the recent logs.
+
+   The database and its archives are the partitions of the logs. A query on
+   all of them (see queryPartitions) reads only the archives of the years in
+   its date range, some of them in parallel threads, and returns the records
+   partition by partition in date order
+
+"""
+import os
+import re
+import datetime
+import threading
+
+try:
+    from Queue import Queue, Full
+except ImportError:
+    from queue import Queue, Full
+
+from common import *
+from errors import *
+from store import *
+
+
+# archives read ahead at the same time by a query without a limit
+READ_AHEAD = 3
+
+# records an archive reader buffers before it waits for the query
+BUFFER_SIZE = 1000
+
+
+def archivePath(dbPath, year):
+    """Returns the path of the archive of the given year"""
+    return '%s.%04d' % (databasePath(dbPath), year)
+
+
+def archiveYears(dbPath, afterDate=None, beforeDate=None):
+    """Returns the years of the existing archives of the database, in
+       ascending order. If dates are given only the years in that range are
+       returned
+
+    """
+    path = databasePath(dbPath)
+    directory = os.path.dirname(os.path.abspath(path))
+    pattern = re.compile(re.escape(os.path.basename(path)) + r'\.(\d{4})$')
+    years = []
+    for name in os.listdir(directory):
+        match = pattern.match(name)
+        if match is None:
+            continue
+        year = int(match.group(1))
+        if afterDate is not None and year < afterDate.year:
+            continue
+        if beforeDate is not None and year > beforeDate.year:
+            continue
+        years.append(year)
+    return sorted(years)
+
+
+def archiveLogs(store, dbPath, pragmas, beforeYear):
+    """Moves the logs of the store dated before beforeYear to the archives of
+       their years, creating them if needed. Returns (year, number of logs)
+       tuples of the archived years
+
+    """
+    moved = []
+    for (period, count) in store.histogram('year'):
+        year = int(period)
+        if year >= beforeYear:
+            continue
+        path = archivePath(dbPath, year)
+        # creates the archive with the current schema
+        openEngine(path, pragmas).dispose()
+        count = store.moveLogs(path, datetime.datetime(year, 1, 1),
+                               datetime.datetime(year + 1, 1, 1))
+        moved.append((year, count))
+    return moved
+
+
+def queryPartitions(store, dbPath, pragmas, query, afterDate=None,
+                    beforeDate=None, reverse=False, limit=None,
+                    readAhead=READ_AHEAD):
+    """Returns an iterator over the records of a query on the store and the
+       archives of the years between afterDate and beforeDate. query is a
+       function running the query on a LogStore and returning an iterator
+       over the records
+
+       The archives are read from the oldest to the newest, then the store,
+       or the other way around with reverse, so the records come out in date
+       order as long as the logs imported after archiving are not older than
+       the archives. At most limit records are returned.
+
+       Without a limit the next readAhead archives are read in threads of
+       their own while the records of a partition are returned. With a limit,
+       or if readAhead is 0, the archives are read by the calling thread and
+       an archive is only opened once the previous partitions did not
+       provide enough records
+
+       Raises:
+            UnknownTagError if the query filters on a tag that exists in none
+                            of the partitions
+
+    """
+    partitions = [archivePath(dbPath, year)
+                  for year in archiveYears(dbPath, afterDate, beforeDate)]
+    # None stands for the store
+    partitions.append(None)
+    if reverse:
+        partitions.reverse()
+    if limit is not None:
+        readAhead = 0
+
+    readers = {}
+    unknownTags = []
+    count = 0
+    try:
+        for (index, path) in enumerate(partitions):
+            for ahead in range(index + 1, min(len(partitions),
+                                              index + readAhead + 1)):
+                if partitions[ahead] is not None and ahead not in readers:
+                    readers[ahead] = _ArchiveReader(partitions[ahead],
+                                                    pragmas, query)
+                    readers[ahead].start()
+
+            try:
+                if path is None:
+                    records = query(store)
+                elif index in readers:
+                    records = readers[index].records()
+                else:
+                    records = _archiveRecords(path, pragmas, query)
+                for record in records:
+                    yield record
+                    count += 1
+                    if limit is not None and count >= limit:
+                        return
+            except UnknownTagError as error:
+                # the tag exists in other partitions
+                unknownTags.append(error)
+    finally:
+        for reader in readers.values():
+            reader.cancel()
+
+    if len(unknownTags) == len(partitions):
+        raise unknownTags[0]
+
+
+def histogramPartitions(store, dbPath, pragmas, histogram, afterDate=None,
+                        beforeDate=None):
+    """Returns the rows of a histogram (see LogStore.histogram) of the store
+       and the archives of the years between afterDate and beforeDate, with
+       the counts of the same period, or period and tag, added up. histogram
+       is a function returning the rows of a LogStore
+
+       Raises:
+            UnknownTagError if the histogram filters on a tag that exists in
+                            none of the partitions
+
+    """
+    partitions = [None] + [archivePath(dbPath, year) for year
+                           in archiveYears(dbPath, afterDate, beforeDate)]
+    counts = {}
+    unknownTags = []
+    for path in partitions:
+        try:
+            if path is None:
+                rows = histogram(store)
+            else:
+                with LogStore(path, pragmas) as archive:
+                    rows = histogram(archive)
+        except UnknownTagError as error:
+            unknownTags.append(error)
+            continue
+        for row in rows:
+            counts[row[:-1]] = counts.get(row[:-1], 0) + row[-1]
+    if len(unknownTags) == len(partitions):
+        raise unknownTags[0]
+    # same order as LogStore.histogram
+    return sorted((key + (count,) for (key, count) in counts.items()),
+                  key=lambda row: (row[0], -row[-1]) + row[1:-1])
+
+
+def tagCountsPartitions(store, dbPath, pragmas, order='count', limit=None,
+                        showEmpty=False):
+    """Returns (tag name, number of logs) tuples of the store and all its
+       archives, with the counts of the same tag added up. The arguments are
+       those of LogStore.tagCounts
+
+    """
+    counts = dict(store.tagCounts(order, None, showEmpty))
+    for year in archiveYears(dbPath):
+        with LogStore(archivePath(dbPath, year), pragmas) as archive:
+            for (name, count) in archive.tagCounts(order, None, showEmpty):
+                counts[name] = counts.get(name, 0) + count
+    # same order as LogStore.tagCounts
+    if order == 'name':
+        rows = sorted(counts.items())
+    else:
+        rows = sorted(counts.items(), key=lambda row: (-row[1], row[0]))
+    return rows[:limit] if limit else rows
+
+
+def _archiveRecords(path, pragmas, query):
+    """Generates the records of a query on an archive"""
+    archive = LogStore(path, pragmas)
+    try:
+        for record in query(archive):
+            yield record
+    finally:
+        archive.close()
+
+
+class _ArchiveReader(threading.Thread):
+    def __init__(self, path, pragmas, query):
+        """Thread running a query on an archive. The records are buffered in
+           a queue until they are read by records()
+
+        """
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.__path = path
+        self.__pragmas = pragmas
+        self.__query = query
+        self.__queue = Queue(BUFFER_SIZE)
+        self.__cancelled = False
+
+
+    def run(self):
+        try:
+            store = LogStore(self.__path, self.__pragmas)
+            try:
+                for record in self.__query(store):
+                    if not self.__put(('record', record)):
+                        return
+            finally:
+                store.close()
+        except Exception as error:
+            self.__put(('error', error))
+            return
+        self.__put(('end', None))
+
+
+    def records(self):
+        """Returns an iterator over the records read by the thread
+
+           Raises:
+                the error the query raised, if any
+
+        """
+        while True:
+            (kind, value) = self.__queue.get()
+            if kind == 'end':
+                return
+            if kind == 'error':
+                raise value
+            yield value
+
+
+    def cancel(self):
+        """Stops the thread once it tries to buffer another record"""
+        self.__cancelled = True
+
+
+    def __put(self, item):
+        """Buffers an item, waiting while the queue is full. Returns False if
+           the thread was cancelled meanwhile
+
+        """
+        while not self.__cancelled:
+            try:
+                self.__queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
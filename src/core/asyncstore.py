@@ -0,0 +1,304 @@
+# This file is part of mlog
+#
+# mlog is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# mlog is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mlog.  If not, see <http://www.gnu.org/licenses/>.
+"""Non blocking access to a log database, for programs running an event loop.
+
+   Every operation of an AsyncStore is queued and run by a dedicated writer
+   thread owning the database connection, and returns a Result at once.
+   Appends waiting in the queue are written together in a single transaction,
+   so logging at high rates costs one commit per batch instead of one per log.
+   Operations run in the order they were queued, so a query sees every log
+   appended before it.
+
+   Results are completed from the writer thread. Event loops can wait for
+   them without blocking through addDoneCallback and their thread safe way of
+   scheduling a call (Twisted's reactor.callFromThread, tornado's
+   IOLoop.add_callback)::
+
+       store = AsyncStore('/var/lib/service/notes.db')
+       store.append('deployed 1.2', ['deploy'])
+       store.tagCounts().addDoneCallback(
+           lambda result: reactor.callFromThread(show, result.result()))
+       ...
+       store.close()
+
+"""
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from common import *
+from config import *
+from errors import *
+from store import *
+
+
+class Result(object):
+    """The outcome of an AsyncStore operation, available once it is done"""
+    def __init__(self):
+        self.__done = threading.Event()
+        self.__lock = threading.Lock()
+        self.__callbacks = []
+        self.__value = None
+        self.__error = None
+
+
+    def done(self):
+        """Returns True if the operation is done"""
+        return self.__done.is_set()
+
+
+    def result(self, timeout=None):
+        """Waits for the operation to be done and returns its value
+
+           Raises:
+                Error   if the operation failed or timeout seconds passed
+
+        """
+        if not self.__done.wait(timeout):
+            raise Error('Timed out waiting for the log database')
+        if self.__error is not None:
+            raise self.__error
+        return self.__value
+
+
+    def addDoneCallback(self, callback):
+        """Calls callback with this Result once the operation is done: from
+           the writer thread, or at once if it is already done
+
+        """
+        with self.__lock:
+            if not self.__done.is_set():
+                self.__callbacks.append(callback)
+                return
+        callback(self)
+
+
+    def _complete(self, value=None, error=None):
+        """Sets the outcome of the operation, called by the writer thread"""
+        with self.__lock:
+            self.__value = value
+            self.__error = error
+            self.__done.set()
+            callbacks = self.__callbacks
+            self.__callbacks = []
+        for callback in callbacks:
+            callback(self)
+
+
+class AsyncStore(object):
+    def __init__(self, dbPath=None, pragmas=None, retries=5,
+                 batchSize=10000):
+        """Starts the writer thread of the given database
+
+           Arguments:
+                dbPath      Database file, ~/.mlog-db if None
+                pragmas     SQLite pragmas, those of the configuration file
+                            if None
+                retries     Attempts of writes failing because the database
+                            is locked by another process
+                batchSize   Maximum number of appends written in a single
+                            transaction
+
+        """
+        if pragmas is None:
+            pragmas = pragmasOf(readConfig())
+        self.__dbPath = databasePath(dbPath)
+        self.__pragmas = pragmas
+        self.__retries = retries
+        self.__batchSize = batchSize
+        self.__queue = queue.Queue()
+        self.__closed = False
+        self.__thread = threading.Thread(target=self.__run,
+                                         name='mlog-writer')
+        self.__thread.daemon = True
+        self.__thread.start()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+    def append(self, message, tags=None, date=None):
+        """Queues a log. The Result of an append is its number of logs, 1,
+           once it is committed
+
+        """
+        return self.appendMany([{'message': message,
+                                 'tags': tags or [],
+                                 'date': date}])
+
+
+    def appendMany(self, records):
+        """Queues logs given as records (see core.transfer). The Result is
+           the number of logs appended once they are committed
+
+        """
+        records = [{'message': decodeText(record['message']).strip(),
+                    'tags': record['tags'],
+                    'date': record.get('date')}
+                   for record in records]
+        return self.__submit('append', records)
+
+
+    def query(self, keyword=None, tags=None, afterDate=None, beforeDate=None,
+              limit=None):
+        """Queues a search. tags is a tag query (see core.tagquery) or a list
+           of tags the logs must all have. The Result is the list of records
+           (see core.transfer) of the matching logs, in id order
+
+        """
+        values = {'keyword': keyword, 'tagQuery': tags,
+                  'afterDate': afterDate, 'beforeDate': beforeDate,
+                  'limit': limit}
+        return self.__submit('query', values)
+
+
+    def tagCounts(self, order='count', limit=None):
+        """Queues a count of logs per tag. The Result is a list of (tag name,
+           number of logs) tuples sorted by count or name
+
+        """
+        return self.__submit('tags', {'order': order, 'limit': limit})
+
+
+    def flush(self):
+        """Returns a Result done once every operation queued before is"""
+        return self.__submit('flush', None)
+
+
+    def close(self, timeout=None):
+        """Writes the queued logs and stops the writer thread
+
+           Raises:
+                Error   if the database could not be opened or the last
+                        writes failed
+
+        """
+        if self.__closed:
+            return
+        flushed = self.flush()
+        self.__closed = True
+        self.__queue.put(_STOP)
+        self.__thread.join(timeout)
+        flushed.result(0)
+
+
+    def __submit(self, operation, argument):
+        if self.__closed:
+            raise Error('The log store is closed')
+        result = Result()
+        self.__queue.put((operation, argument, result))
+        return result
+
+
+    def __run(self):
+        """Writer thread: runs the queued operations until close"""
+        try:
+            store = LogStore(self.__dbPath, self.__pragmas)
+        except Exception as error:
+            store = None
+            startError = _error(error)
+
+        pending = None
+        while True:
+            task = pending or self.__queue.get()
+            pending = None
+            operation, argument, result = task
+            if operation == 'stop':
+                break
+            if store is None:
+                result._complete(error=startError)
+                continue
+            if operation != 'append':
+                self.__runTask(store, operation, argument, result)
+                continue
+
+            # appends waiting in the queue are written in one transaction
+            appends = [task]
+            count = len(argument)
+            while count < self.__batchSize:
+                try:
+                    task = self.__queue.get_nowait()
+                except queue.Empty:
+                    break
+                if task[0] != 'append':
+                    pending = task
+                    break
+                appends.append(task)
+                count += len(task[1])
+            self.__append(store, appends)
+
+        if store is not None:
+            store.close()
+
+
+    def __append(self, store, appends):
+        """Writes the records of the given append tasks in one transaction"""
+        records = []
+        for operation, argument, result in appends:
+            records.extend(argument)
+
+        def write():
+            try:
+                store.appendMany(records)
+            except:
+                store.rollback()
+                raise
+            store.commit()
+
+        try:
+            retryLocked(write, self.__retries)
+            error = None
+        except Exception as exception:
+            error = _error(exception)
+        for operation, argument, result in appends:
+            if error is None:
+                result._complete(len([r for r in argument if r['message']]))
+            else:
+                result._complete(error=error)
+
+
+    def __runTask(self, store, operation, argument, result):
+        """Runs a flush, query or tags operation"""
+        try:
+            if operation == 'flush':
+                value = None
+            elif operation == 'query':
+                value = list(store.query(**argument))
+            else:
+                value = store.tagCounts(**argument)
+        except Exception as error:
+            result._complete(error=_error(error))
+            return
+        result._complete(value)
+
+
+# queued by close to stop the writer thread
+_STOP = ('stop', None, None)
+
+
+def _error(exception):
+    """Returns the Error to report for an exception of the writer thread"""
+    if isinstance(exception, Error):
+        return exception
+    return Error(str(exception))
@@ -0,0 +1,85 @@
+# This file is part of mlog
+#
+# mlog is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# mlog is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mlog.  If not, see <http://www.gnu.org/licenses/>.
+"""Client side of the mlog daemon protocol (see core.server). It does not
+   depend on SQLAlchemy so that commands sent to a daemon start fast
+
+"""
+import sys
+import json
+import socket
+import datetime
+
+from common import *
+from errors import *
+
+
+# seconds the daemon has to accept a request, after which the command runs
+# directly on the database
+ACCEPT_TIMEOUT = 1.0
+
+
+def runRemote(dbPath, command, options):
+    """Runs a command on the daemon serving the database. The command output
+       is written to stdout and error messages to stderr
+
+       Returns the exit status of the command, or None if no daemon is
+       running or it did not accept the request within ACCEPT_TIMEOUT
+
+    """
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    connection.settimeout(ACCEPT_TIMEOUT)
+    try:
+        connection.connect(socketPath(dbPath))
+    except socket.error:
+        connection.close()
+        return None
+
+    try:
+        values = {}
+        for name in REQUEST_OPTIONS:
+            value = getattr(options, name, None)
+            if isinstance(value, datetime.datetime):
+                value = value.isoformat()
+            values[name] = value
+        lines = connection.makefile('rb')
+        try:
+            sendFrame(connection, {'command': command, 'options': values})
+            accepted = lines.readline()
+        except socket.error:
+            # the daemon does not run requests it could not accept
+            return None
+        if len(accepted) == 0:
+            return None
+        # the command itself may take any time
+        connection.settimeout(None)
+
+        for line in lines:
+            frame = json.loads(line.decode('utf-8'))
+            if 'out' in frame:
+                sys.stdout.write(_encode(frame['out']))
+            elif 'exit' in frame:
+                if 'error' in frame:
+                    sys.stderr.write(_encode(frame['error']) + '\n')
+                return frame['exit']
+    finally:
+        connection.close()
+    raise Error('Connection to the mlog daemon was lost')
+
+
+def _encode(text):
+    """Encodes text written to python 2 files"""
+    if sys.version_info[0] < 3:
+        return text.encode('utf-8')
+    return text
@@ -0,0 +1,121 @@
+# This file is part of mlog
+#
+# mlog is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# mlog is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mlog.  If not, see <http://www.gnu.org/licenses/>.
+"""Definitions shared by the core modules. This module does not depend on
+   SQLAlchemy so that it is cheap to import
+
+"""
+import os
+import sys
+import json
+import time
+import struct
+import random
+import hashlib
+
+
+# Version of the database schema, see core.schema for the migrations
+SCHEMA_VERSION = 5
+
+# Id of the next log. Ids are not reused after logs are archived (see
+# LogStore.moveLogs), which keeps the highest id in logIdMark
+NEXT_LOG_ID = ('SELECT max(coalesce((SELECT max(id) FROM logs), 0), '
+               'coalesce((SELECT max(lastId) FROM "logIdMark"), 0)) + 1')
+
+# Periods of the stats command histograms, see LogStore.histogram
+STATS_PERIODS = ('day', 'week', 'month', 'year')
+
+
+def databasePath(dbPath=None):
+    """Returns the database file to be used, ~/.mlog-db unless dbPath is set"""
+    if dbPath is None:
+        return os.path.join(os.environ['HOME'], '.mlog-db')
+    return dbPath
+
+
+def decodeText(value):
+    """Decodes byte strings read from the command line or a file"""
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    return value
+
+
+def encodeText(value):
+    """Encodes unicode strings written to python 2 files"""
+    if sys.version_info[0] < 3 and isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+def messageHash(message):
+    """Returns the content hash of a message, stored in the hash column of
+       the logs table: the first 64 bits of the SHA-1 digest of the UTF-8
+       encoded message as a signed integer. Logs with the same hash are only
+       duplicates if their messages are equal too
+
+    """
+    digest = hashlib.sha1(message.encode('utf-8')).digest()
+    return struct.unpack('>q', digest[:8])[0]
+
+
+def socketPath(dbPath=None):
+    """Returns the path of the unix socket of the daemon serving the
+       database
+
+    """
+    return databasePath(dbPath) + '.sock'
+
+
+# Commands the daemon runs, and the options sent along with a request
+SERVED_COMMANDS = ('add', 'list', 'tags', 'delete')
+
+REQUEST_OPTIONS = ('searchKeyword', 'rankResults', 'regexPattern', 'fuzzyTerm',
+                   'maxErrors', 'limit', 'reverse', 'sinceId', 'listFormat',
+                   'colour', 'beforeDate', 'afterDate', 'tags', 'tagQuery',
+                   'tagsOrder', 'tagsLimit', 'showEmptyTags', 'message',
+                   'logId', 'dedupe', 'useArchives')
+
+
+def sendFrame(connection, frame):
+    """Sends a message, a JSON object on a single line, through a socket"""
+    connection.sendall((json.dumps(frame) + '\n').encode('utf-8'))
+
+
+def isLockedError(error):
+    """Returns True if error was raised because another process holds a lock
+       on the database
+
+    """
+    message = str(error)
+    # FTS5 reports a locked database as a failure to read its configuration
+    return ('database is locked' in message or 'database is busy' in message
+            or 'vtable constructor failed' in message)
+
+
+def retryLocked(function, retries, delay=0.1):
+    """Calls function and returns its result. While it fails because the
+       database is locked it is called again, up to retries more times, with
+       exponential backoff
+
+    """
+    attempt = 0
+    while True:
+        try:
+            return function()
+        except Exception as error:
+            if attempt >= retries or not isLockedError(error):
+                raise
+        # random jitter keeps competing processes from retrying in lockstep
+        time.sleep(delay * (2 ** attempt) * random.uniform(0.5, 1.5))
+        attempt += 1
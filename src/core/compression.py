@@ -0,0 +1,80 @@
+# This file is part of mlog
+#
+# mlog is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# mlog is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mlog.  If not, see <http://www.gnu.org/licenses/>.
+"""Compression of large log messages.
+
+   Messages longer than COMPRESS_THRESHOLD bytes are stored as zlib
+   compressed BLOBs in the message column of the logs table, shorter ones as
+   TEXT, so the type of the stored value tells whether it is compressed.
+   Messages are only decompressed when they are read. The full text index
+   triggers read them through the mlog_inflate SQL function, which
+   registerFunctions adds to a connection and which must be available to
+   every connection writing logs
+
+"""
+import zlib
+import sqlite3
+
+
+# messages up to this size in bytes are stored uncompressed
+COMPRESS_THRESHOLD = 4096
+
+COMPRESS_LEVEL = 6
+
+
+def compressMessage(message):
+    """Returns the value stored for a message: a BLOB with the compressed
+       UTF-8 encoded message if it is longer than COMPRESS_THRESHOLD bytes
+       and compresses well, the message itself otherwise
+
+    """
+    if message is None or len(message) * 4 <= COMPRESS_THRESHOLD:
+        return message
+    encoded = message.encode('utf-8')
+    if len(encoded) <= COMPRESS_THRESHOLD:
+        return message
+    compressed = zlib.compress(encoded, COMPRESS_LEVEL)
+    if len(compressed) >= len(encoded):
+        return message
+    return sqlite3.Binary(compressed)
+
+
+def decompressMessage(value):
+    """Returns the message of a stored value, see compressMessage"""
+    if value is None or isinstance(value, type(u'')):
+        return value
+    if isinstance(value, bytes) and bytes is str:
+        # python 2 byte strings are stored as TEXT
+        return value.decode('utf-8')
+    return zlib.decompress(bytes(value)).decode('utf-8')
+
+
+def registerFunctions(dbapiConnection):
+    """Adds the mlog_inflate(value) and mlog_deflate(message) SQL functions,
+       the SQL counterparts of decompressMessage and compressMessage, to a
+       sqlite3 connection
+
+    """
+    dbapiConnection.create_function('mlog_inflate', 1, decompressMessage)
+    dbapiConnection.create_function('mlog_deflate', 1, _deflate)
+
+
+def _deflate(message):
+    """compressMessage for SQL text values, other values are returned as
+       they are
+
+    """
+    if isinstance(message, type(u'')):
+        return compressMessage(message)
+    return message
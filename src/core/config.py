@@ -0,0 +1,166 @@
+# This file is part of mlog
+#
+# mlog is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# mlog is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mlog.  If not, see <http://www.gnu.org/licenses/>.
+"""Configuration file handling. The configuration file (~/.mlogrc unless the
+   MLOG_CONFIG environment variable is set) is an INI file. Its [sqlite]
+   section sets the pragmas applied to every database connection and its
+   [mlog] section the remaining options:
+
+        [sqlite]
+        journal_mode = wal
+        synchronous = normal
+        mmap_size = 268435456
+        cache_size = -16000
+        temp_store = memory
+        busy_timeout = 5000
+
+        [mlog]
+        retries = 5
+        spool = no
+        dedupe = no
+
+"""
+import os
+
+try:
+    from ConfigParser import RawConfigParser, Error as ParserError
+except ImportError:
+    from configparser import RawConfigParser, Error as ParserError
+
+from errors import *
+
+
+# pragmas in the order they are applied
+PRAGMAS = ('busy_timeout', 'journal_mode', 'synchronous', 'mmap_size',
+           'cache_size', 'temp_store')
+
+# options of the [mlog] section
+SETTINGS = ('retries', 'spool', 'dedupe')
+
+DEFAULTS = {
+    # wait up to 5 seconds for other processes to release the database
+    'busy_timeout': '5000',
+    # readers do not block the writer
+    'journal_mode': 'wal',
+    # durable enough with WAL, no fsync on every commit
+    'synchronous': 'normal',
+    # 256MB of the database file is memory mapped
+    'mmap_size': '268435456',
+    # page cache of 16MB (negative values are in KiB)
+    'cache_size': '-16000',
+    'temp_store': 'memory',
+    # attempts after a "database is locked" failure
+    'retries': '5',
+    # add logs to the spool instead of the database
+    'spool': 'no',
+    # merge added logs into existing logs with the same message
+    'dedupe': 'no',
+}
+
+CHOICES = {
+    'journal_mode': ('delete', 'truncate', 'persist', 'memory', 'wal', 'off'),
+    'synchronous': ('off', 'normal', 'full', 'extra'),
+    'temp_store': ('default', 'file', 'memory'),
+}
+
+BOOLEANS = {'yes': True, 'true': True, 'on': True, '1': True,
+            'no': False, 'false': False, 'off': False, '0': False}
+
+
+def configPath():
+    """Returns the path of the configuration file"""
+    path = os.environ.get('MLOG_CONFIG')
+    if path:
+        return path
+    return os.path.join(os.environ['HOME'], '.mlogrc')
+
+
+def readConfig(fileName=None, overrides=None):
+    """Returns the configuration, a dictionary with a value for every pragma
+       and setting. Values of the configuration file override the defaults
+       and non None values of the overrides dictionary (command line options)
+       override both
+
+       Raises:
+            ConfigError     if the configuration file or a value is invalid
+
+    """
+    config = dict(DEFAULTS)
+
+    parser = RawConfigParser()
+    try:
+        found = parser.read(fileName or configPath())
+    except ParserError as error:
+        raise ConfigError('Invalid configuration file: %s' % error)
+    if fileName is not None and len(found) == 0:
+        raise ConfigError('Can not read configuration file: %s' % fileName)
+    for (section, names) in (('sqlite', PRAGMAS), ('mlog', SETTINGS)):
+        if not parser.has_section(section):
+            continue
+        for (name, value) in parser.items(section):
+            if name not in names:
+                raise ConfigError('Unknown [%s] option: %s' % (section, name))
+            config[name] = value
+
+    for (name, value) in (overrides or {}).items():
+        if value is not None:
+            config[name] = value
+
+    for name in PRAGMAS + SETTINGS:
+        config[name] = checkOption(name, config[name])
+    return config
+
+
+def checkOption(name, value):
+    """Returns the normalized value of an option: a string for pragmas, an
+       int or a bool for settings
+
+       Raises:
+            ConfigError     if the value is not valid for the option
+
+    """
+    value = str(value).strip().lower()
+    if name in CHOICES:
+        if value not in CHOICES[name]:
+            e = ("Invalid %s value: %s\n Valid values are: %s"
+                 % (name, value, ', '.join(CHOICES[name])))
+            raise ConfigError(e)
+        return value
+    if name in ('spool', 'dedupe'):
+        if value not in BOOLEANS:
+            raise ConfigError('Invalid %s value: %s' % (name, value))
+        return BOOLEANS[value]
+    try:
+        number = int(value)
+    except ValueError:
+        raise ConfigError('Invalid %s value: %s' % (name, value))
+    if name == 'retries':
+        if number < 0:
+            raise ConfigError('Invalid %s value: %s' % (name, value))
+        return number
+    return str(number)
+
+
+def pragmasOf(config):
+    """Returns the pragmas of a configuration"""
+    return dict((name, config[name]) for name in PRAGMAS if name in config)
+
+
+def applyPragmas(dbapiConnection, pragmas):
+    """Applies the pragmas to a sqlite3 connection"""
+    cursor = dbapiConnection.cursor()
+    for name in PRAGMAS:
+        if name in pragmas:
+            cursor.execute('PRAGMA %s = %s' % (name, pragmas[name]))
+    cursor.close()
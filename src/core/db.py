@@ -16,20 +16,50 @@
    module
 
 """
+import re
 import datetime
+import unicodedata
 
 from sqlalchemy import *
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relation, sessionmaker, relationship, backref
+from sqlalchemy.types import TypeDecorator
+
+from common import messageHash
+from compression import *
 
 
 Base = declarative_base()
 
 
+class Message(TypeDecorator):
+    """Text of a log message, compressed when it is stored if it is large.
+       See core.compression
+
+    """
+    impl = String
+
+    def process_bind_param(self, value, dialect):
+        return compressMessage(value)
+
+    def process_result_value(self, value, dialect):
+        return decompressMessage(value)
+
+
 # association table
 logTags = Table('logTags', Base.metadata,
-                Column('log_id', Integer, ForeignKey('logs.id')),
-                Column('tag_id', Integer, ForeignKey('tags.id'))
+                Column('log_id', Integer, ForeignKey('logs.id'),
+                       primary_key=True),
+                Column('tag_id', Integer, ForeignKey('tags.id'),
+                       primary_key=True),
+                # reverse index, used by tag filtered queries
+                Index('ix_logTags_tag_id', 'tag_id', 'log_id')
+)
+
+
+# highest log id ever assigned, kept when the logs are archived
+logIdMark = Table('logIdMark', Base.metadata,
+                  Column('lastId', Integer, nullable=False)
 )
 
 
@@ -44,8 +74,10 @@ class Log(Base):
     __tablename__ = 'logs'
 
     id = Column(Integer, primary_key=True)
-    date = Column(DateTime)
-    message = Column(String)
+    date = Column(DateTime, index=True)
+    message = Column(Message)
+    # content hash of the message, see common.messageHash
+    hash = Column(Integer, index=True)
 
     tags = relationship('Tag', secondary=logTags, backref='logs')
 
@@ -54,6 +86,7 @@ class Log(Base):
         if date is None:
             self.date = datetime.datetime.now()
         self.message = msg
+        self.hash = messageHash(msg)
 
     def __repr__(self):
         return "<Log(%s, %s, %s)>" % (str(self.date), self.message,
@@ -73,3 +106,179 @@ class Tag(Base):
     def __repr__(self):
         return "<Tag(%s)>" % (str(self.name))
 
+
+
+# Full text index of the log messages. It is an external content FTS5 table
+# that is kept in sync with the logs table by triggers. Compressed messages
+# are indexed through mlog_inflate (see core.compression), which is also why
+# the index is rebuilt from the logs rather than with the FTS5 'rebuild'
+# command
+logsFts = table('logs_fts',
+                column('rowid'), column('logs_fts'), column('rank'))
+
+# Ids of the logs matched by the last scan of a connection (see core.scan)
+MATCHED_LOGS_DDL = ("CREATE TEMPORARY TABLE IF NOT EXISTS matched_logs "
+                    "(id INTEGER PRIMARY KEY)")
+
+matchedLogs = table('matched_logs', column('id'))
+
+FTS_TRIGGERS = ("logs_fts_ai", "logs_fts_ad", "logs_fts_au")
+
+FTS_TRIGGERS_DDL = (
+    "CREATE TRIGGER logs_fts_ai AFTER INSERT ON logs BEGIN "
+    "INSERT INTO logs_fts(rowid, message) "
+    "VALUES (new.id, mlog_inflate(new.message)); END",
+    "CREATE TRIGGER logs_fts_ad AFTER DELETE ON logs BEGIN "
+    "INSERT INTO logs_fts(logs_fts, rowid, message) "
+    "VALUES ('delete', old.id, mlog_inflate(old.message)); END",
+    "CREATE TRIGGER logs_fts_au AFTER UPDATE OF message ON logs BEGIN "
+    "INSERT INTO logs_fts(logs_fts, rowid, message) "
+    "VALUES ('delete', old.id, mlog_inflate(old.message)); "
+    "INSERT INTO logs_fts(rowid, message) "
+    "VALUES (new.id, mlog_inflate(new.message)); END",
+)
+
+FTS_DDL = (
+    "CREATE VIRTUAL TABLE logs_fts USING fts5(message, content='logs', "
+    "content_rowid='id')",
+) + FTS_TRIGGERS_DDL
+
+
+def hasFullTextIndex(connection):
+    """Returns True if the full text index exists in the database"""
+    result = connection.execute("SELECT 1 FROM sqlite_master "
+                                "WHERE type = 'table' AND name = 'logs_fts'")
+    return result.scalar() is not None
+
+
+def fullTextSupported(connection):
+    """Returns True if SQLite was built with FTS5 support"""
+    options = connection.execute('PRAGMA compile_options')
+    return 'ENABLE_FTS5' in [row[0] for row in options]
+
+
+def createFullTextIndex(connection):
+    """Creates the full text index and its triggers and indexes the existing
+       logs
+
+    """
+    for statement in FTS_DDL:
+        connection.execute(statement)
+    rebuildFullTextIndex(connection)
+
+
+def rebuildFullTextIndex(connection):
+    """Reindexes all log messages"""
+    connection.execute("INSERT INTO logs_fts(logs_fts) VALUES ('delete-all')")
+    connection.execute("INSERT INTO logs_fts(rowid, message) "
+                       "SELECT id, mlog_inflate(message) FROM logs")
+
+
+# Trigram index of the log messages, pruning the logs scanned by regular
+# expression and fuzzy searches (see core.scan). It is optional, created by
+# 'mlog reindex --trigram', and kept in sync like the full text index
+TRIGRAM_DDL = (
+    "CREATE VIRTUAL TABLE logs_trigram USING fts5(message, content='logs', "
+    "content_rowid='id', tokenize='trigram')",
+    "CREATE TRIGGER logs_trigram_ai AFTER INSERT ON logs BEGIN "
+    "INSERT INTO logs_trigram(rowid, message) "
+    "VALUES (new.id, mlog_inflate(new.message)); END",
+    "CREATE TRIGGER logs_trigram_ad AFTER DELETE ON logs BEGIN "
+    "INSERT INTO logs_trigram(logs_trigram, rowid, message) "
+    "VALUES ('delete', old.id, mlog_inflate(old.message)); END",
+    "CREATE TRIGGER logs_trigram_au AFTER UPDATE OF message ON logs BEGIN "
+    "INSERT INTO logs_trigram(logs_trigram, rowid, message) "
+    "VALUES ('delete', old.id, mlog_inflate(old.message)); "
+    "INSERT INTO logs_trigram(rowid, message) "
+    "VALUES (new.id, mlog_inflate(new.message)); END",
+)
+
+
+def hasTrigramIndex(connection):
+    """Returns True if the trigram index exists in the database"""
+    result = connection.execute("SELECT 1 FROM sqlite_master "
+                                "WHERE type = 'table' "
+                                "AND name = 'logs_trigram'")
+    return result.scalar() is not None
+
+
+def trigramSupported(connection):
+    """Returns True if SQLite has the FTS5 trigram tokenizer (3.34.0)"""
+    version = connection.execute('SELECT sqlite_version()').scalar()
+    return (fullTextSupported(connection) and
+            tuple(int(part) for part in version.split('.')) >= (3, 34, 0))
+
+
+def createTrigramIndex(connection):
+    """Creates the trigram index and its triggers and indexes the existing
+       logs
+
+    """
+    for statement in TRIGRAM_DDL:
+        connection.execute(statement)
+    rebuildTrigramIndex(connection)
+
+
+def rebuildTrigramIndex(connection):
+    """Reindexes the trigrams of all log messages"""
+    connection.execute("INSERT INTO logs_trigram(logs_trigram) "
+                       "VALUES ('delete-all')")
+    connection.execute("INSERT INTO logs_trigram(rowid, message) "
+                       "SELECT id, mlog_inflate(message) FROM logs")
+
+
+def keywordTerms(keyword):
+    """Returns the terms of a search keyword as lists of words: one list per
+       double quoted phrase or per other word of the keyword. Words are
+       made of letters and digits, anything else separates them, as in the
+       full text index
+
+    """
+    terms = []
+    for term in re.findall(r'"[^"]*"?|[^\s"]+', keyword):
+        words = _WORD.findall(term)
+        if len(words) > 0:
+            terms.append(words)
+    return terms
+
+
+def fullTextQuery(keyword):
+    """Converts a search keyword to an FTS5 query string. Every term of the
+       keyword (see keywordTerms) must be found in the message, each word as
+       the start of a word, so that "err" matches "error". The words of a
+       phrase must be consecutive, only the last one being a prefix. A
+       trailing '*' is accepted and changes nothing
+
+    """
+    return ' '.join('"%s"*' % ' '.join(words)
+                    for words in keywordTerms(keyword))
+
+
+def matchesKeyword(message, keyword):
+    """Returns True if a message matches a search keyword like the full text
+       query of the keyword does, ignoring case and diacritics. Registered
+       as the mlog_match(message, keyword) SQL function, which searches
+       databases without a full text index
+
+    """
+    if message is None:
+        return False
+    words = [_fold(word) for word in _WORD.findall(message)]
+    for term in keywordTerms(keyword):
+        term = [_fold(word) for word in term]
+        last = len(term) - 1
+        if not any(words[start:start + last] == term[:last] and
+                   words[start + last].startswith(term[last])
+                   for start in range(len(words) - last)):
+            return False
+    return True
+
+
+# a word of the unicode61 tokenizer of the full text index
+_WORD = re.compile(r'[^\W_]+', re.UNICODE)
+
+
+def _fold(word):
+    """Lowercases a word and removes its diacritics"""
+    return u''.join(c for c in unicodedata.normalize('NFKD', word.lower())
+                    if not unicodedata.combining(c))
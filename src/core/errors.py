@@ -13,12 +13,13 @@
 # You should have received a copy of the GNU General Public License
 # along with mlog.  If not, see <http://www.gnu.org/licenses/>.
 """Error class hierarchy for mlog project"""
+from common import encodeText
 
 
 class Error(Exception):
     """Base Error class of all mlog error classses"""
     def __init__(self, msg):
-        super(Exception, self).__init__('Error: ' + str(msg))
+        super(Exception, self).__init__('Error: ' + _text(msg))
 
 
 class ConfigError(Error):
@@ -27,5 +28,22 @@ class ConfigError(Error):
 
     """
     def __init__(self, msg):
-        super(Error, self).__init__('Configuration Error: ' + str(msg))
+        super(Error, self).__init__('Configuration Error: ' + _text(msg))
 
+
+class UnknownTagError(Error):
+    """Error raised when a tag a query filters on does not exist"""
+    def __init__(self, tagName):
+        super(UnknownTagError, self).__init__(
+            'Tag "%s" does not exist in the database' % tagName)
+        self.tagName = tagName
+
+
+def _text(msg):
+    """Returns the text of an error message, UTF-8 encoded on python 2 so
+       that the message can be converted to str
+
+    """
+    if isinstance(msg, type(u'')):
+        return encodeText(msg)
+    return str(msg)
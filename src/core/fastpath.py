@@ -0,0 +1,97 @@
+# This file is part of mlog
+#
+# mlog is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# mlog is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mlog.  If not, see <http://www.gnu.org/licenses/>.
+"""Lean implementation of the add command on top of the sqlite3 module.
+
+   Importing SQLAlchemy and setting up the ORM takes much longer than
+   appending a log, so logs are appended directly when the database schema
+   is known to be current. Anything else (new or old databases) is left to
+   core.logger.Logger
+
+"""
+import os
+import sqlite3
+import datetime
+
+from common import *
+from config import applyPragmas
+from compression import compressMessage, decompressMessage, \
+                        registerFunctions
+
+
+def appendLog(dbPath, message, tags, pragmas=None, retries=0, dedupe=False):
+    """Appends a log with the given tags. Returns False, without writing
+       anything, if the database does not exist or its schema is not current.
+       The insert is retried up to retries times while the database is locked.
+       With dedupe, the tags are added to an existing log with the same
+       message if there is one
+
+    """
+    now = datetime.datetime.now()
+    message = decodeText(message).strip()
+    tags = sorted(set(decodeText(t) for t in tags))
+    return retryLocked(lambda: _appendLog(dbPath, now, message, tags,
+                                          pragmas or {}, dedupe),
+                       retries)
+
+
+def _appendLog(dbPath, date, message, tags, pragmas, dedupe):
+    """Inserts a log and its tags in a single transaction"""
+    if not os.path.exists(databasePath(dbPath)):
+        # new databases are created by openEngine
+        return False
+    connection = sqlite3.connect(databasePath(dbPath))
+    try:
+        applyPragmas(connection, pragmas)
+        registerFunctions(connection)
+        version = connection.execute('PRAGMA user_version').fetchone()[0]
+        if version != SCHEMA_VERSION:
+            return False
+
+        with connection:
+            contentHash = messageHash(message)
+            logId = None
+            if dedupe:
+                logId = _duplicateId(connection, message, contentHash)
+            if logId is None:
+                # same date format as the SQLAlchemy DateTime type
+                cursor = connection.execute(
+                            'INSERT INTO logs (id, date, message, hash) '
+                            'VALUES ((' + NEXT_LOG_ID + '), ?, ?, ?)',
+                            (date.strftime('%Y-%m-%d %H:%M:%S.%f'),
+                             compressMessage(message), contentHash))
+                logId = cursor.lastrowid
+            for tag in tags:
+                connection.execute('INSERT OR IGNORE INTO tags (name) '
+                                   'VALUES (?)', (tag,))
+                connection.execute('INSERT OR IGNORE INTO "logTags" '
+                                   '(log_id, tag_id) '
+                                   'SELECT ?, id FROM tags WHERE name = ?',
+                                   (logId, tag))
+    finally:
+        connection.close()
+    return True
+
+
+def _duplicateId(connection, message, contentHash):
+    """Returns the id of the oldest log with the given message and content
+       hash, None if there is none
+
+    """
+    rows = connection.execute('SELECT id, message FROM logs WHERE hash = ? '
+                              'ORDER BY id', (contentHash,))
+    for (logId, value) in rows:
+        if decompressMessage(value) == message:
+            return logId
+    return None
@@ -18,191 +18,301 @@ import datetime
 import tempfile
 import subprocess
 
-from db import *
+from itertools import islice
+
+from common import *
 from errors import *
+from store import *
+from archive import *
+from scan import searchPattern
+from transfer import listWriter, OutputBuffer
 
-from sqlalchemy.orm import relation, sessionmaker, relationship, backref
 
 class Logger(object):
-    def __init__(self, options):
-        """Creates a Logger options with the given configuration
+    def __init__(self, options, engine=None):
+        """Creates a Logger options with the given configuration. The
+           database is accessed through a LogStore, the Logger runs the
+           commands of the command line interface with it
 
            Arguments:
                 options    An initialized ProgramOptions object
+                engine     An engine returned by openEngine, a new one is
+                           opened if None
 
         """
-        self.__session = None
-
-        if options.dbPath is None:
-            self.__logFilePath = os.path.join(os.environ['HOME'], '.mlog-db')
-        else:
-            self.__logFilePath = options.dbPath
+        self.__store = None
 
         self.__searchKeyword = options.searchKeyword
+        self.__rankResults = options.rankResults
+        self.__searchPattern = searchPattern(options.regexPattern,
+                                             options.fuzzyTerm,
+                                             options.maxErrors)
+        self.__limit = options.limit
+        self.__reverse = options.reverse
+        self.__listFormat = options.listFormat
+        self.__colour = options.colour
+        self.__sinceId = options.sinceId
         self.__beforeDate = self.__recreateDate(options.beforeDate)
         self.__afterDate = self.__recreateDate(options.afterDate)
 
         self.__appliedTags = options.tags
+        self.__tagQuery = options.tagQuery
+        self.__dedupe = options.dedupe
+        self.__useArchives = options.useArchives
+        self.__dbPath = options.dbPath
+        self.__pragmas = options.pragmas
+
+        self.__statsPeriod = options.statsPeriod
+        self.__statsByTag = options.statsByTag
+        self.__statsFormat = options.statsFormat
 
-        self.__startDBSession()
+        self.__tagsOrder = options.tagsOrder
+        self.__tagsLimit = options.tagsLimit
+        self.__showEmptyTags = options.showEmptyTags
+
+        self.__store = LogStore(options.dbPath, options.pragmas or {}, engine,
+                                options.timings)
 
 
     def __del__(self):
         """Makes sure database is "closed" - changes are submited"""
-        self.__closeDBSession()
+        try:
+            self.__closeStore()
+        except Error as error:
+            sys.stderr.write(str(error) + '\n')
+
+
+    def close(self):
+        """Commits changes to the database and closes the store
+
+           Raises:
+                Error   if the changes could not be written. They are rolled
+                        back and the command can be run again
+
+        """
+        self.__closeStore()
 
 
     def printLogs(self):
         """Print all logs matching the given(if any) search criteria and tags
+           in the list format. Output goes through a single buffered writer
 
         """
-        logs = []
-        if self.__appliedTags is not None and len(self.__appliedTags) > 0:
-            tList = []
-            for tag in self.__appliedTags:
-                # find tag
-                t = self.__session.query(Tag).filter(Tag.name == tag).all()
-                if len(t) == 1:
-                    tList.append(t[0])
-                else:
-                    # all given tags must exist in the database
-                    e = "Tag \"%s\" does not exist in the database" % tag
-                    raise Error(e)
-            clauses = and_(* [Log.tags.contains(x) for x in tList])
-            logs = self.__session.query(Log).filter(clauses)
-        else:
-            logs = self.__session.query(Log)
-
-        for log in logs:
-            if self.__logMatches(log):
-                self.__printLog(log)
+        output = OutputBuffer(sys.stdout)
+        writer = listWriter(output, self.__listFormat, self.__colour)
+        for record in self.__query(rank=self.__rankResults,
+                                   reverse=self.__reverse,
+                                   sinceId=self.__sinceId,
+                                   limit=self.__limit, chunkSize=200):
+            writer.write(record)
+        writer.close()
+        output.flush()
 
 
     def listTags(self):
-        """Prints on stdout available tags and logs per tags count for each"""
-        tags = self.__session.query(Tag).join(logTags).all();
-        for tag in tags:
-            logsPerTag = len(tag.logs)
-            tagName = tag.name
-            print("%6d: %s" % (logsPerTag, tagName))
+        """Prints on stdout available tags and logs per tags count for each.
+           Counts are aggregated by the database in a single query
 
+        """
+        for (tagName, count) in self.tagCounts():
+            print("%6d: %s" % (count, tagName))
 
-    def appendLog(self, message):
-        """Appends a log to the database"""
-        log = Log(message.strip())
 
-        if self.__appliedTags is not None:
-            for t in self.__appliedTags:
-                tag = self.__getOrCreateTag(t)
-                log.tags.append(tag)
-        self.__session.add(log)
+    def tagCounts(self):
+        """Returns (tag name, number of logs) tuples in the tags order, at
+           most tagsLimit of them. Logs of the archives are counted too
+           unless useArchives is off
 
+        """
+        if self.__useArchives:
+            return tagCountsPartitions(self.__store, self.__dbPath,
+                                       self.__pragmas, self.__tagsOrder,
+                                       self.__tagsLimit, self.__showEmptyTags)
+        return self.__store.tagCounts(self.__tagsOrder, self.__tagsLimit,
+                                      self.__showEmptyTags)
 
-    def deleteLogWithId(self, logId):
-        """Delete the log with the provided log id"""
-        log = self.__session.query(Log).get(logId)
-        if log:
-            self.__session.delete(log)
+
+    def printStats(self):
+        """Prints the number of logs matching the search criteria and tags
+           per period, and per tag if requested, as a text histogram or tab
+           separated values
+
+        """
+        histogram = lambda store: store.histogram(self.__statsPeriod,
+                                                  self.__searchKeyword,
+                                                  self.__tagQuery,
+                                                  self.__afterDate,
+                                                  self.__beforeDate,
+                                                  self.__statsByTag)
+        if self.__useArchives:
+            rows = histogramPartitions(self.__store, self.__dbPath,
+                                       self.__pragmas, histogram,
+                                       self.__afterDate, self.__beforeDate)
         else:
-            e = ("Log with id: " + str(logId) \
-                 + " was not found in the database\n")
-            raise Error(e)
+            rows = histogram(self.__store)
+        output = OutputBuffer(sys.stdout)
+        if self.__statsFormat == 'tsv':
+            for row in rows:
+                output.write('\t'.join(str(value) for value in row) + '\n')
+            output.flush()
+            return
+
+        counts = [row[-1] for row in rows]
+        width = 50.0 / max(counts) if counts else 0
+        lastPeriod = None
+        for row in rows:
+            period, count = row[0], row[-1]
+            label = period if period != lastPeriod else ''
+            lastPeriod = period
+            if self.__statsByTag:
+                text = '%-10s %8d  %s\n' % (label, count, row[1])
+            else:
+                text = '%-10s %8d  %s\n' % (label, count,
+                                             '#' * max(1, int(count * width)))
+            output.write(encodeText(text))
+        if not self.__statsByTag:
+            plural = 's' if len(rows) != 1 else ''
+            output.write('%-10s %8d  logs in %d %s%s\n'
+                         % ('total', sum(counts), len(rows),
+                            self.__statsPeriod, plural))
+        output.flush()
 
 
-    def editLogWithId(self, logId):
-        """Launches users default editor to edit the contents of the log with
-           the provided id. If a tag list is provided it is used to replace
-           current tags
+    def appendLog(self, message):
+        """Appends a log to the database"""
+        self.__store.append(decodeText(message).strip(), self.__appliedTags,
+                            dedupe=self.__dedupe)
+
+
+    def exportLogs(self, chunkSize=500):
+        """Returns an iterator over the records (see core.transfer) of the logs
+           matching the given search criteria and tags, in id order, those of
+           the archives first
+
+           Logs are read in chunks of chunkSize and are not kept in memory,
+           so memory use does not grow with the number of exported logs
 
         """
-        # find log in the database
-        log = self.__session.query(Log).get(logId)
-        if not log:
-            e = ("Log with id: " + str(logId) \
-                 + " was not found in the database\n")
-            raise Error(e)
-        # edit log message and replace the original
-        log.message = self.__editMessageInExternalEditor(log.message)
+        return self.__query(chunkSize=chunkSize)
+
 
-        # change tags
-        if self.__appliedTags is not None:
-            tagList = []
-            for tag in self.__appliedTags:
-                tagList.append(self.__getOrCreateTag(tag))
-            log.tags = tagList
+    def importLogs(self, records, batchSize=10000):
+        """Inserts logs from an iterable of records (see core.transfer) to the
+           database. Logs are inserted in batches of batchSize, each batch in
+           a single transaction. Applied tags are added to every log
 
+           Returns the number of imported logs, which does not include the
+           logs merged into existing ones when deduplicating
 
-    def __printLog(self, log):
-        """Print a log to stdout, also print the tags associated with this log
+        """
+        count = 0
+        records = iter(records)
+        while True:
+            batch = list(islice(records, batchSize))
+            if len(batch) == 0:
+                return count
+            try:
+                count += self.__store.appendMany(batch, self.__appliedTags,
+                                                 batchSize, self.__dedupe)
+            except:
+                # leave the store usable, the batch can be inserted again
+                self.__store.rollback()
+                raise
+            self.__store.commit()
+
+
+    def rebuildIndex(self, trigram=False):
+        """Rebuilds the full text index of the log messages. The index is
+           created if it is missing, the trigram index too with trigram
 
         """
-        message = log.message
-        date = log.date
-        id = log.id
-        tags = [x.name for x in log.tags]
-        dashes = 40 * '-'
-        print("\033[1m>%6d :: [%s] %s\033[0m" % (id, date, dashes))
-        print(message)
-        print('\n<%s>\n' % (', '.join([x.name for x in log.tags])))
+        self.__store.rebuildIndex(trigram)
 
 
-    def __getOrCreateTag(self, tagName):
-        """Searches db for a tag with the given name. If none is found it
-           creates one
+    def collectGarbage(self, full=False):
+        """Deletes unused tags, compacts the database file and refreshes the
+           query planner statistics, then prints what was reclaimed
 
         """
-        dbTag = self.__session.query(Tag).filter(Tag.name == tagName)
-        if(len(dbTag.all()) != 1):
-            tag = Tag(tagName)
-            self.__session.add(tag)
+        result = self.__store.collectGarbage(full)
+        print('Deleted %d unused tags and %d dangling tag associations'
+              % (result['tags'], result['logTags']))
+        reclaimed = max(0, result['sizeBefore'] - result['sizeAfter'])
+        print('Database size %s, %s reclaimed'
+              % (_formatSize(result['sizeAfter']), _formatSize(reclaimed)))
+
+
+    def collapseDuplicates(self, dryRun=False):
+        """Merges logs with the same message and prints how many were merged"""
+        (merged, kept) = self.__store.collapseDuplicates(dryRun)
+        if dryRun:
+            print('Found %d duplicates of %d logs' % (merged, kept))
         else:
-            tag = dbTag[0]
+            print('Merged %d duplicates into %d logs' % (merged, kept))
 
-        return tag
 
+    def deleteLogWithId(self, logId):
+        """Delete the log with the provided log id"""
+        self.__store.delete(logId)
 
-    def __logMatches(self, log):
-        """Check if a log matches the current date and keyword criteria"""
-        matchSearch = False
-        if self.__searchKeyword != 0:
-            if self.__searchKeyword.lower() in log.message.lower():
-                matchSearch = True
-        else:
-            matchSearch = True
 
-        matchBefore = True
-        matchAfter = True
+    def editLogWithId(self, logId):
+        """Launches users default editor to edit the contents of the log with
+           the provided id. If a tag list is provided it is used to replace
+           current tags
 
-        if self.__beforeDate:
-            if log.date > self.__beforeDate:
-                matchBefore = False
+        """
+        # find log in the database
+        record = self.__store.get(logId)
+        # edit log message and replace the original
+        message = self.__editMessageInExternalEditor(record['message'])
+        self.__store.update(logId, message, self.__appliedTags)
 
-        if self.__afterDate:
-            if log.date < self.__afterDate:
-                matchAfter = False
 
-        return (matchSearch and matchBefore and matchAfter)
+    def archiveLogs(self, beforeYear):
+        """Moves the logs dated before beforeYear to yearly archives and
+           prints how many logs each archive received
 
+        """
+        for (year, count) in archiveLogs(self.__store, self.__dbPath,
+                                         self.__pragmas, beforeYear):
+            path = archivePath(self.__dbPath, year)
+            print('Archived %d logs to %s' % (count, path))
 
-    def __startDBSession(self):
-        """Initializes database connection and starts a db session"""
-        engine = create_engine('sqlite:///' + self.__logFilePath)
-        #engine.echo = True
-        Base.metadata.create_all(engine)
-        Session = sessionmaker(bind=engine)
-        self.__session = Session()
 
+    def __query(self, **arguments):
+        """Returns an iterator over the records of the logs matching the
+           search criteria and tags, read from the database and its archives
+           unless useArchives is off. The arguments are passed to
+           LogStore.query
 
-    def __closeDBSession(self):
-        """Commits changes to the database"""
-        if self.__session is None:
+        """
+        query = lambda store: store.query(self.__searchKeyword,
+                                          self.__tagQuery,
+                                          self.__afterDate, self.__beforeDate,
+                                          pattern=self.__searchPattern,
+                                          **arguments)
+        if not self.__useArchives:
+            return query(self.__store)
+        # pattern scans start processes, which are not forked from threads
+        readAhead = 0 if self.__searchPattern is not None else READ_AHEAD
+        return queryPartitions(self.__store, self.__dbPath, self.__pragmas,
+                               query, self.__afterDate, self.__beforeDate,
+                               arguments.get('reverse', False),
+                               arguments.get('limit'), readAhead)
+
+
+    def __closeStore(self):
+        """Commits changes to the database and closes the store"""
+        if self.__store is None:
            return
 
+        store = self.__store
+        self.__store = None
         try:
-            self.__session.commit()
-        except Exception as error:
-            sys.stderr.write('Failed to write log: ' + str(error) + '\n')
-            self.__session.rollback()
+            store.commit()
+        finally:
+            store.close()
 
 
     def __recreateDate(self, dateString):
@@ -270,3 +380,12 @@ class Logger(object):
             userEditor = editor
         return userEditor
 
+
+def _formatSize(size):
+    """Returns a human readable size given in bytes"""
+    for unit in ('bytes', 'KiB', 'MiB'):
+        if size < 1024:
+            return '%d %s' % (size, unit) if unit == 'bytes' \
+                   else '%.1f %s' % (size, unit)
+        size /= 1024.0
+    return '%.1f GiB' % size
@@ -0,0 +1,299 @@
+# This file is part of mlog
+#
+# mlog is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# mlog is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mlog.  If not, see <http://www.gnu.org/licenses/>.
+"""Regular expression and fuzzy searches of the log messages.
+
+   SQLite can not evaluate these searches, so the messages are read and
+   matched in Python. scanLogIds splits the logs into id ranges that are
+   matched by a pool of processes, each reading its ranges with a connection
+   of its own.
+
+   If the database has a trigram index (see db.TRIGRAM_DDL) only the logs
+   containing the literal parts of the search are read: the substrings of
+   three characters or more a regular expression can not match without, or
+   for a fuzzy search at least one of the parts of the term that are left
+   intact by the allowed number of errors. The index is only a filter, every
+   candidate is still matched
+
+"""
+import re
+import sqlite3
+import sre_parse
+import sre_constants
+import multiprocessing
+
+from compression import decompressMessage
+from errors import *
+
+try:
+    _unichr = unichr
+except NameError:
+    _unichr = chr
+
+
+# logs matched by a process at a time
+RANGE_SIZE = 5000
+
+# length of the substrings indexed by the trigram index
+TRIGRAM_LENGTH = 3
+
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+
+def searchPattern(regex=None, fuzzy=None, maxErrors=1):
+    """Returns the matcher of a regular expression or of a fuzzy search
+       term, or None if neither is given
+
+       Raises:
+            ConfigError if the regular expression is not valid
+
+    """
+    if regex:
+        return RegexMatcher(regex)
+    if fuzzy:
+        return FuzzyMatcher(fuzzy, maxErrors)
+    return None
+
+
+class RegexMatcher(object):
+    def __init__(self, pattern):
+        """Matches the messages containing a match of a regular expression.
+           Matching is case sensitive unless the expression starts with (?i)
+
+           Raises:
+                ConfigError if the expression is not valid
+
+        """
+        try:
+            self.__regex = re.compile(pattern, re.UNICODE | re.MULTILINE)
+        except re.error as error:
+            raise ConfigError('Invalid regular expression "%s": %s'
+                              % (pattern, error))
+        self.__pattern = pattern
+
+
+    def matches(self, message):
+        """Returns True if the message contains a match"""
+        return self.__regex.search(message) is not None
+
+
+    def trigramQuery(self):
+        """Returns the trigram index query of the logs that may match, or
+           None if every log may match
+
+        """
+        try:
+            parsed = sre_parse.parse(self.__pattern, self.__regex.flags)
+        except Exception:
+            return None
+        literals = [literal for literal in _requiredLiterals(parsed)
+                    if len(literal) >= TRIGRAM_LENGTH]
+        if len(literals) == 0:
+            return None
+        return ' AND '.join(_phrase(literal) for literal in literals)
+
+
+class FuzzyMatcher(object):
+    def __init__(self, term, maxErrors=1):
+        """Matches the messages containing a substring within maxErrors
+           inserted, deleted or substituted characters of the term, ignoring
+           case
+
+           Raises:
+                ConfigError if maxErrors is negative or not smaller than the
+                            length of the term
+
+        """
+        if maxErrors < 0 or maxErrors >= len(term):
+            raise ConfigError('The number of errors must be between 0 and '
+                              'the length of the search term minus one')
+        self.__term = term.lower()
+        self.__maxErrors = maxErrors
+
+
+    def matches(self, message):
+        """Returns True if the message contains an approximate match"""
+        message = message.lower()
+        if self.__term in message:
+            return True
+        return _approximateMatch(self.__term, message, self.__maxErrors)
+
+
+    def trigramQuery(self):
+        """Returns the trigram index query of the logs that may match, or
+           None if every log may match. A match has at most maxErrors errors
+           so it contains at least one of maxErrors + 1 parts of the term
+
+        """
+        parts = _split(self.__term, self.__maxErrors + 1)
+        if min(len(part) for part in parts) < TRIGRAM_LENGTH:
+            return None
+        return ' OR '.join(_phrase(part) for part in parts)
+
+
+def scanLogIds(dbPath, matcher, afterDate=None, beforeDate=None,
+               trigram=False, processes=None):
+    """Returns the ids of the logs of a database whose message is matched by
+       matcher, in ascending order. Only the logs between afterDate and
+       beforeDate are matched and only the candidates of the trigram index if
+       trigram is True. Changes not committed yet are not seen
+
+       The logs are matched in ranges of RANGE_SIZE logs by processes
+       processes, one per CPU if None. A single range, or every range with a
+       single process, is matched by the calling process
+
+    """
+    query = matcher.trigramQuery() if trigram else None
+    connection = sqlite3.connect(dbPath)
+    try:
+        if query is not None:
+            candidates = [row[0] for row in connection.execute(
+                'SELECT rowid FROM logs_trigram WHERE logs_trigram MATCH ? '
+                'ORDER BY rowid', (query,))]
+            ranges = [(chunk[0], chunk[-1]) for chunk
+                      in (candidates[start:start + RANGE_SIZE] for start
+                          in range(0, len(candidates), RANGE_SIZE))]
+        else:
+            (first, last) = connection.execute(
+                'SELECT min(id), max(id) FROM logs').fetchone()
+            ranges = []
+            if first is not None:
+                ranges = [(start, min(start + RANGE_SIZE - 1, last))
+                          for start in range(first, last + 1, RANGE_SIZE)]
+    finally:
+        connection.close()
+
+    dates = tuple(date.strftime(DATE_FORMAT) if date is not None else None
+                  for date in (afterDate, beforeDate))
+    tasks = [(dbPath, first, last, matcher, query, dates)
+             for (first, last) in ranges]
+    processes = processes or multiprocessing.cpu_count()
+    if len(tasks) <= 1 or processes == 1:
+        results = [_scanRange(task) for task in tasks]
+    else:
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(_scanRange, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    return [logId for logIds in results for logId in logIds]
+
+
+def _scanRange(task):
+    """Returns the ids of the matching logs of an id range. Runs in the pool
+       processes, so it only gets picklable arguments
+
+    """
+    (dbPath, first, last, matcher, query, (afterDate, beforeDate)) = task
+    if query is not None:
+        statement = ('SELECT id, message FROM logs WHERE id IN '
+                     '(SELECT rowid FROM logs_trigram WHERE logs_trigram '
+                     'MATCH ? AND rowid BETWEEN ? AND ?)')
+        arguments = [query, first, last]
+    else:
+        statement = 'SELECT id, message FROM logs WHERE id BETWEEN ? AND ?'
+        arguments = [first, last]
+    if afterDate is not None:
+        statement += ' AND date >= ?'
+        arguments.append(afterDate)
+    if beforeDate is not None:
+        statement += ' AND date <= ?'
+        arguments.append(beforeDate)
+
+    connection = sqlite3.connect(dbPath)
+    try:
+        return [logId for (logId, message)
+                in connection.execute(statement + ' ORDER BY id', arguments)
+                if message is not None and
+                matcher.matches(decompressMessage(message))]
+    finally:
+        connection.close()
+
+
+def _requiredLiterals(parsed):
+    """Returns the literal substrings found in every match of a parsed
+       regular expression. Only concatenated literals, groups and repeats
+       occurring at least once are followed, other parts end a substring
+
+    """
+    literals = []
+    current = []
+    for (op, argument) in parsed:
+        if op == sre_constants.LITERAL:
+            current.append(_unichr(argument))
+            continue
+        literals.append(''.join(current))
+        current = []
+        if op == sre_constants.SUBPATTERN:
+            # the group pattern is the last item in every python version
+            literals.extend(_requiredLiterals(argument[-1]))
+        elif (op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT)
+              and argument[0] >= 1):
+            literals.extend(_requiredLiterals(argument[2]))
+    literals.append(''.join(current))
+    return [literal for literal in literals if literal]
+
+
+def _approximateMatch(term, text, maxErrors):
+    """Returns True if a substring of text is within maxErrors edits of term.
+       Myers' bit-parallel algorithm: bit i of the vectors holds the
+       difference between consecutive rows i and i + 1 of the edit distance
+       column of the current text position, so a text character costs a few
+       integer operations whatever the length of the term
+
+    """
+    mask = (1 << len(term)) - 1
+    last = 1 << (len(term) - 1)
+    peq = {}
+    for (i, c) in enumerate(term):
+        peq[c] = peq.get(c, 0) | (1 << i)
+    pv = mask
+    mv = 0
+    score = len(term)
+    for c in text:
+        eq = peq.get(c, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | ~(xh | pv)
+        mh = pv & xh
+        if ph & last:
+            score += 1
+        elif mh & last:
+            score -= 1
+        if score <= maxErrors:
+            return True
+        # a match may start anywhere, the first row stays 0
+        ph = (ph << 1) & mask
+        mh = (mh << 1) & mask
+        pv = (mh | ~(xv | ph)) & mask
+        mv = ph & xv
+    return False
+
+
+def _split(term, count):
+    """Splits a term in count parts of nearly the same length"""
+    size, extra = divmod(len(term), count)
+    parts = []
+    start = 0
+    for i in range(count):
+        end = start + size + (1 if i < extra else 0)
+        parts.append(term[start:end])
+        start = end
+    return parts
+
+
+def _phrase(text):
+    """Quotes a substring as an FTS5 phrase"""
+    return '"%s"' % text.replace('"', '""')
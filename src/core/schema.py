@@ -0,0 +1,192 @@
+# This file is part of mlog
+#
+# mlog is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# mlog is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mlog.  If not, see <http://www.gnu.org/licenses/>.
+"""Database schema versioning. The version of the schema of a database file is
+   stored in its user_version pragma. Databases created by older versions of
+   mlog are migrated in place, one version at a time
+
+"""
+from db import *
+from common import *
+from errors import *
+
+
+# auto_vacuum pragma value of new databases, see openEngine. Free pages are
+# kept in the file until they are released by PRAGMA incremental_vacuum, see
+# LogStore.collectGarbage
+AUTO_VACUUM_INCREMENTAL = 2
+
+
+def schemaVersion(connection):
+    """Returns the schema version of the database"""
+    return connection.execute('PRAGMA user_version').scalar()
+
+
+def upgradeSchema(connection):
+    """Brings the database schema up to date. A new database is created
+       directly with the latest schema
+
+       Python's sqlite3 module commits before every schema change, so a
+       migration is not atomic. Migrations are written so that they can be
+       run again on a database where they were interrupted
+
+       Raises:
+            Error   if the database was created by a newer version of mlog
+
+    """
+    version = schemaVersion(connection)
+    if version == SCHEMA_VERSION:
+        return
+    if version > SCHEMA_VERSION:
+        e = ("Database schema version %d is newer than the supported "
+             "version %d" % (version, SCHEMA_VERSION))
+        raise Error(e)
+
+    if version == 0 and not connection.dialect.has_table(connection, 'logs'):
+        trans = connection.begin()
+        Base.metadata.create_all(connection)
+        _addFullTextIndex(connection)
+        _setSchemaVersion(connection, SCHEMA_VERSION)
+        trans.commit()
+        return
+
+    for (migrationVersion, migration) in MIGRATIONS:
+        if migrationVersion <= version:
+            continue
+        trans = connection.begin()
+        migration(connection)
+        _setSchemaVersion(connection, migrationVersion)
+        trans.commit()
+
+
+def _setSchemaVersion(connection, version):
+    """Stores the schema version in the database"""
+    connection.execute('PRAGMA user_version = %d' % version)
+
+
+def _addIndexes(connection):
+    """Version 1: primary key and reverse index on the association table and
+       index on the log date
+
+       SQLite can not add a primary key to an existing table, so logTags is
+       recreated. Duplicate and incomplete associations are dropped. If an
+       earlier run was interrupted, the copy of logTags_old it left behind is
+       finished
+
+    """
+    if not _hasTable(connection, 'logTags_old'):
+        connection.execute('ALTER TABLE "logTags" RENAME TO "logTags_old"')
+    if not _hasTable(connection, 'logTags'):
+        logTags.create(connection)
+    connection.execute('CREATE INDEX IF NOT EXISTS "ix_logTags_tag_id" '
+                       'ON "logTags" (tag_id, log_id)')
+    connection.execute('INSERT OR IGNORE INTO "logTags" (log_id, tag_id) '
+                       'SELECT log_id, tag_id FROM "logTags_old" '
+                       'WHERE log_id IS NOT NULL AND tag_id IS NOT NULL')
+    connection.execute('DROP TABLE "logTags_old"')
+    connection.execute('CREATE INDEX IF NOT EXISTS ix_logs_date '
+                       'ON logs (date)')
+
+
+def _addFullTextIndex(connection):
+    """Version 2: full text index of log messages. Skipped if SQLite lacks
+       FTS5 support. An index left by an interrupted run gets its triggers
+       again and is rebuilt
+
+    """
+    if not fullTextSupported(connection):
+        return
+    if not hasFullTextIndex(connection):
+        createFullTextIndex(connection)
+        return
+    for trigger in FTS_TRIGGERS:
+        connection.execute('DROP TRIGGER IF EXISTS %s' % trigger)
+    for statement in FTS_TRIGGERS_DDL:
+        connection.execute(statement)
+    rebuildFullTextIndex(connection)
+
+
+def _compressMessages(connection):
+    """Version 3: large messages are stored compressed (see core.compression)
+       and indexed through mlog_inflate
+
+       The full text index triggers are dropped while the existing messages
+       are compressed, the indexed text does not change
+
+    """
+    fullText = hasFullTextIndex(connection)
+    for trigger in FTS_TRIGGERS:
+        connection.execute('DROP TRIGGER IF EXISTS %s' % trigger)
+    connection.execute("UPDATE logs SET message = mlog_deflate(message) "
+                       "WHERE typeof(message) = 'text' "
+                       "AND length(message) * 4 > %d" % COMPRESS_THRESHOLD)
+    if fullText:
+        for statement in FTS_TRIGGERS_DDL:
+            connection.execute(statement)
+
+
+def _addMessageHash(connection):
+    """Version 4: indexed content hash of the messages (see
+       common.messageHash), used to find duplicate logs. An interrupted run
+       is finished: only the missing hashes are written
+
+    """
+    connection.connection.create_function('mlog_hash', 1, _storedMessageHash)
+    if 'hash' not in _columnNames(connection, 'logs'):
+        connection.execute('ALTER TABLE logs ADD COLUMN hash INTEGER')
+    connection.execute('UPDATE logs SET hash = mlog_hash(message) '
+                       'WHERE hash IS NULL')
+    connection.execute('CREATE INDEX IF NOT EXISTS ix_logs_hash '
+                       'ON logs (hash)')
+
+
+def _addLogIdMark(connection):
+    """Version 5: highest log id moved to an archive, so that log ids are not
+       reused (see common.NEXT_LOG_ID)
+
+    """
+    if not _hasTable(connection, 'logIdMark'):
+        logIdMark.create(connection)
+
+
+def _hasTable(connection, name):
+    """Returns True if the database has a table with the given name"""
+    result = connection.execute("SELECT 1 FROM sqlite_master "
+                                "WHERE type = 'table' AND name = ?", name)
+    return result.scalar() is not None
+
+
+def _columnNames(connection, table):
+    """Returns the names of the columns of a table"""
+    return [row[1] for row in
+            connection.execute('PRAGMA table_info("%s")' % table)]
+
+
+def _storedMessageHash(value):
+    """Returns the content hash of a stored message, None for NULL"""
+    message = decompressMessage(value)
+    if message is None:
+        return None
+    return messageHash(message)
+
+
+# (version, migration) pairs in ascending version order, the last one must
+# be SCHEMA_VERSION
+MIGRATIONS = (
+    (1, _addIndexes),
+    (2, _addFullTextIndex),
+    (3, _compressMessages),
+    (4, _addMessageHash),
+    (5, _addLogIdMark),
+)
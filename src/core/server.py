@@ -0,0 +1,267 @@
+# This file is part of mlog
+#
+# mlog is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# mlog is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mlog.  If not, see <http://www.gnu.org/licenses/>.
+"""The mlog daemon. It keeps an engine to the database open and runs the
+   commands sent by mlog clients over a unix socket.
+
+   A request is a single message with the command name and its options.
+   The daemon replies with an 'accepted' message once it has read the
+   request, then any number of 'out' messages carrying the command output,
+   followed by an 'exit' message with the exit status of the command and an
+   error message if it failed. Every connection is served by a thread of its
+   own, so a client reading its output slowly does not hold up the others
+
+"""
+import os
+import sys
+import json
+import socket
+import threading
+import traceback
+
+from common import *
+from errors import *
+from logger import *
+from store import *
+
+
+# seconds a client has to send its request once connected
+REQUEST_TIMEOUT = 5
+
+
+class RequestOptions(object):
+    """Logger options of a request. Options not sent by the client keep the
+       defaults of ProgramOptions
+
+    """
+    dbPath = None
+    pragmas = None
+    timings = None
+    searchKeyword = None
+    rankResults = False
+    regexPattern = None
+    fuzzyTerm = None
+    maxErrors = 1
+    limit = None
+    reverse = False
+    sinceId = None
+    listFormat = 'pretty'
+    colour = False
+    beforeDate = ''
+    afterDate = ''
+    tags = None
+    tagQuery = None
+    statsPeriod = 'day'
+    statsByTag = False
+    statsFormat = 'text'
+    tagsOrder = 'count'
+    tagsLimit = None
+    showEmptyTags = False
+    message = ''
+    logId = -1
+    dedupe = False
+    useArchives = True
+
+    def __init__(self, values):
+        for name in REQUEST_OPTIONS:
+            if values.get(name) is not None:
+                setattr(self, name, values[name])
+
+
+class Server(object):
+    def __init__(self, dbPath, pragmas, retries=0):
+        """Opens the database to be served. The schema is brought up to date
+           once, when the daemon starts. Requests changing the database are
+           retried up to retries times while another process locks it
+
+        """
+        self.__dbPath = dbPath
+        self.__pragmas = pragmas
+        self.__socketPath = socketPath(dbPath)
+        self.__engine = openEngine(databasePath(dbPath), pragmas)
+        self.__retries = retries
+        self.__outputLock = threading.Lock()
+
+
+    def serve(self):
+        """Serves requests until the process is terminated"""
+        listener = self.__bind()
+        try:
+            while True:
+                (connection, address) = listener.accept()
+                thread = threading.Thread(target=self.__serveConnection,
+                                          args=(connection,))
+                thread.daemon = True
+                thread.start()
+        finally:
+            listener.close()
+            os.unlink(self.__socketPath)
+
+
+    def __serveConnection(self, connection):
+        """Runs the request of a connection, in a thread of its own"""
+        try:
+            self.__handle(connection)
+        except socket.error:
+            # the client went away, e.g. its pager was closed, or it did not
+            # send its request in time
+            pass
+        finally:
+            connection.close()
+
+
+    def __bind(self):
+        """Creates the listening socket, accessible only by the user"""
+        if os.path.exists(self.__socketPath):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.__socketPath)
+                raise Error('A daemon is already listening on %s'
+                            % self.__socketPath)
+            except socket.error:
+                # left behind by a daemon that was killed
+                os.unlink(self.__socketPath)
+            finally:
+                probe.close()
+
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        umask = os.umask(0o077)
+        try:
+            listener.bind(self.__socketPath)
+        finally:
+            os.umask(umask)
+        listener.listen(16)
+        return listener
+
+
+    def __handle(self, connection):
+        """Runs a single request. Unexpected errors are reported to the client
+           and their traceback is written to stderr, the daemon keeps serving
+
+        """
+        connection.settimeout(REQUEST_TIMEOUT)
+        line = connection.makefile('rb').readline()
+        # the output is sent at the pace of the client, e.g. of its pager
+        connection.settimeout(None)
+        if len(line) == 0:
+            return
+        # the client falls back to the database if this does not arrive
+        sendFrame(connection, {'accepted': True})
+        out = _FrameWriter(connection)
+        output = self.__threadOutput()
+        output.redirect(out)
+        try:
+            request = json.loads(line.decode('utf-8'))
+            command = request['command']
+            options = RequestOptions(request['options'])
+            # archives are read next to the served database
+            options.dbPath = self.__dbPath
+            options.pragmas = self.__pragmas
+            if command in ('add', 'delete'):
+                retryLocked(lambda: self.__run(command, options),
+                            self.__retries)
+            else:
+                self.__run(command, options)
+            out.flush()
+            sendFrame(connection, {'exit': 0})
+        except ConfigError as error:
+            out.flush()
+            sendFrame(connection, {'exit': os.EX_CONFIG, 'error': str(error)})
+        except Error as error:
+            out.flush()
+            sendFrame(connection, {'exit': os.EX_SOFTWARE,
+                                   'error': str(error)})
+        except socket.error:
+            raise
+        except Exception as error:
+            traceback.print_exc()
+            out.flush()
+            sendFrame(connection, {'exit': os.EX_SOFTWARE,
+                                   'error': str(Error(error))})
+        finally:
+            output.redirect(None)
+
+
+    def __threadOutput(self):
+        """Returns the standard output, replaced by a _ThreadOutput"""
+        with self.__outputLock:
+            if not isinstance(sys.stdout, _ThreadOutput):
+                sys.stdout = _ThreadOutput(sys.stdout)
+            return sys.stdout
+
+
+    def __run(self, command, options):
+        """Runs a command with a Logger on the shared engine"""
+        if command not in SERVED_COMMANDS:
+            raise ConfigError('Command not supported by the daemon: %s'
+                              % command)
+        logger = Logger(options, self.__engine)
+        try:
+            if command == 'add':
+                logger.appendLog(options.message)
+            elif command == 'list':
+                logger.printLogs()
+            elif command == 'tags':
+                logger.listTags()
+            elif command == 'delete':
+                logger.deleteLogWithId(options.logId)
+        finally:
+            logger.close()
+
+
+class _ThreadOutput(object):
+    """Standard output of the daemon. Each request thread redirects the text
+       it writes to its client, other threads write to the original stdout
+
+    """
+    def __init__(self, stdout):
+        self.__stdout = stdout
+        self.__local = threading.local()
+
+    def redirect(self, writer):
+        """Sends the output of the calling thread to writer, or to the
+           original stdout if writer is None
+
+        """
+        self.__local.writer = writer
+
+    def write(self, text):
+        self.__writer().write(text)
+
+    def flush(self):
+        self.__writer().flush()
+
+    def __writer(self):
+        return getattr(self.__local, 'writer', None) or self.__stdout
+
+
+class _FrameWriter(object):
+    """File like object sending the text written to it in 'out' messages"""
+    def __init__(self, connection, bufferSize=65536):
+        self.__connection = connection
+        self.__bufferSize = bufferSize
+        self.__buffer = []
+        self.__size = 0
+
+    def write(self, text):
+        self.__buffer.append(text)
+        self.__size += len(text)
+        if self.__size >= self.__bufferSize:
+            self.flush()
+
+    def flush(self):
+        if len(self.__buffer) > 0:
+            sendFrame(self.__connection, {'out': ''.join(self.__buffer)})
+            self.__buffer = []
+            self.__size = 0
@@ -0,0 +1,105 @@
+# This file is part of mlog
+#
+# mlog is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# mlog is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mlog.  If not, see <http://www.gnu.org/licenses/>.
+"""Append spool of logs waiting to be written to the database.
+
+   Appending a line to a file is much cheaper than a database transaction and
+   does not contend for the database lock, so many processes can spool logs
+   at the same time. The spool (the database file name with a .spool suffix)
+   holds one record per line in the ndjson import format, and is written to
+   the database in a single transaction by flushSpool
+
+"""
+import os
+import glob
+import json
+import fcntl
+import datetime
+
+from contextlib import closing
+
+from common import *
+from transfer import readRecords
+
+
+def spoolPath(dbPath=None):
+    """Returns the path of the spool of the database"""
+    return databasePath(dbPath) + '.spool'
+
+
+def spoolLog(dbPath, message, tags):
+    """Appends a log to the spool of the database"""
+    record = {'date': datetime.datetime.now().isoformat(),
+              'message': decodeText(message).strip(),
+              'tags': [decodeText(t) for t in tags]}
+    line = (json.dumps(record) + '\n').encode('utf-8')
+    path = spoolPath(dbPath)
+    while True:
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            # the spool may have been moved aside by a flush while waiting
+            # for the lock, in which case a new one is opened
+            if _isSameFile(fd, path):
+                os.write(fd, line)
+                return
+        finally:
+            os.close(fd)
+
+
+def flushSpool(dbPath, importRecords):
+    """Writes the spooled logs to the database. importRecords is called with
+       an iterator over the records of each spool file and must insert them in
+       a single transaction. Returns the number of flushed logs
+
+    """
+    path = spoolPath(dbPath)
+    # only one flush at a time
+    lockFd = os.open(path + '.lock', os.O_WRONLY | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(lockFd, fcntl.LOCK_EX)
+        _takeSpool(path)
+        count = 0
+        # files left by an interrupted flush are flushed too
+        for fileName in sorted(glob.glob(path + '.[0-9]*')):
+            with closing(readRecords(fileName, 'ndjson')) as records:
+                count += importRecords(records)
+            os.unlink(fileName)
+        return count
+    finally:
+        os.close(lockFd)
+
+
+def _takeSpool(path):
+    """Moves the spool aside so that new logs are spooled to a new file"""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        # nothing spooled
+        return
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        now = datetime.datetime.now()
+        os.rename(path, '%s.%s.%d' % (path, now.strftime('%Y%m%d%H%M%S%f'),
+                                      os.getpid()))
+    finally:
+        os.close(fd)
+
+
+def _isSameFile(fd, path):
+    """Returns True if the open file fd is the file currently at path"""
+    try:
+        return os.fstat(fd).st_ino == os.stat(path).st_ino
+    except OSError:
+        return False
@@ -0,0 +1,919 @@
+# This file is part of mlog
+#
+# mlog is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# mlog is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mlog.  If not, see <http://www.gnu.org/licenses/>.
+"""Storage layer of mlog, independent of the command line interface.
+
+   A LogStore reads and writes the logs of a database file within an explicit
+   transaction: changes are written by commit() and discarded by rollback()
+   or by closing the store without committing. Used as a context manager, a
+   store commits if the block succeeds and rolls back if it raises::
+
+       with LogStore('/tmp/notes.db') as store:
+           store.append('first note', ['todo'])
+           store.appendMany({'message': line, 'tags': ['import'],
+                             'date': None} for line in lines)
+
+       with LogStore('/tmp/notes.db') as store:
+           for record in store.query(tagQuery='todo', reverse=True,
+                                     limit=10):
+               print(record['id'], record['message'])
+
+   Logs are returned as records (see core.transfer): dictionaries with id,
+   date, message and tags keys. Statements are built with the SQLAlchemy
+   expression language, no ORM objects are created
+
+"""
+import os
+import datetime
+
+from itertools import islice
+
+from db import *
+from common import *
+from config import *
+from errors import *
+from scan import scanLogIds
+from schema import *
+from tagquery import *
+from timings import timed
+
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+
+
+logs = Log.__table__
+tags = Tag.__table__
+
+# strftime formats of the histogram periods
+PERIOD_FORMATS = {'day': '%Y-%m-%d',
+                  'week': '%Y-W%W',
+                  'month': '%Y-%m',
+                  'year': '%Y'}
+
+
+def openEngine(dbPath, pragmas, timings=None):
+    """Creates an engine for the given database file. The pragmas are applied
+       to every connection and the database schema is created or migrated if
+       it is not up to date. If timings is given, the statements run by the
+       engine are recorded in it
+
+    """
+    newDatabase = not os.path.exists(dbPath)
+
+    def onConnect(dbapiConnection, record):
+        if newDatabase:
+            # auto_vacuum can only be changed before the database header is
+            # written, which setting journal_mode to wal does
+            dbapiConnection.execute('PRAGMA auto_vacuum = %d'
+                                    % AUTO_VACUUM_INCREMENTAL)
+        applyPragmas(dbapiConnection, pragmas)
+        registerFunctions(dbapiConnection)
+        dbapiConnection.create_function('mlog_match', 2, matchesKeyword)
+
+    engine = create_engine('sqlite:///' + dbPath)
+    #engine.echo = True
+    if timings is not None:
+        timings.watchEngine(engine)
+    event.listen(engine, 'connect', onConnect)
+    with engine.connect() as connection:
+        upgradeSchema(connection)
+    return engine
+
+
+class LogStore(object):
+    def __init__(self, dbPath=None, pragmas=None, engine=None, timings=None):
+        """Opens a log database and starts a transaction
+
+           Arguments:
+                dbPath     Database file, ~/.mlog-db if None
+                pragmas    SQLite pragmas applied to the connections, those
+                           of the configuration file if None
+                engine     An engine returned by openEngine, shared by
+                           several stores. dbPath and pragmas are ignored if
+                           it is given
+                timings    A Timings object recording the opening of the
+                           database, the statements and the commits
+
+        """
+        self.__timings = timings
+        self.__connection = None
+        self.__transaction = None
+        # tag name to tag id cache, valid until a rollback
+        self.__tagIds = {}
+
+        with timed(timings, 'engine'):
+            if engine is None:
+                if pragmas is None:
+                    pragmas = pragmasOf(readConfig())
+                engine = openEngine(databasePath(dbPath), pragmas, timings)
+            self.__connection = engine.connect()
+            self.__transaction = self.__connection.begin()
+            self.__fullText = hasFullTextIndex(self.__connection)
+            self.__trigram = hasTrigramIndex(self.__connection)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, errorType, error, traceback):
+        try:
+            if errorType is None:
+                self.commit()
+        finally:
+            self.close()
+        return False
+
+
+    def commit(self):
+        """Writes the changes made since the last commit to the database
+
+           Raises:
+                Error   if the changes could not be written. They are rolled
+                        back, so the same changes can be made again
+
+        """
+        try:
+            with timed(self.__timings, 'commit'):
+                self.__transaction.commit()
+        except Exception as error:
+            self.rollback()
+            raise Error('Failed to write log: ' + str(error))
+        self.__transaction = self.__connection.begin()
+
+
+    def rollback(self):
+        """Discards the changes made since the last commit"""
+        if self.__transaction.is_active:
+            self.__transaction.rollback()
+        # tags created by the transaction are rolled back too
+        self.__tagIds.clear()
+        self.__transaction = self.__connection.begin()
+
+
+    def close(self):
+        """Closes the store. Changes that were not committed are discarded"""
+        if self.__connection is None:
+            return
+        connection = self.__connection
+        self.__connection = None
+        try:
+            if self.__transaction.is_active:
+                self.__transaction.rollback()
+        finally:
+            connection.close()
+
+
+    def append(self, message, tagNames=None, date=None, dedupe=False):
+        """Appends a log with the given tags, the current date if date is
+           None. Returns the id of the log
+
+           With dedupe, if a log with the same message exists the tags are
+           added to it instead and its id is returned
+
+        """
+        message = decodeText(message)
+        tagNames = [decodeText(tag) for tag in tagNames or []]
+        if dedupe:
+            logId = self.__duplicateIds([message]).get(message)
+            if logId is not None:
+                self.__mergeTags(logId, tagNames)
+                return logId
+        statement = logs.insert().values(
+                        id=literal_column('(%s)' % NEXT_LOG_ID))
+        result = self.__connection.execute(statement, {
+                    'date': date or datetime.datetime.now(),
+                    'message': message,
+                    'hash': messageHash(message)})
+        logId = result.lastrowid
+        self.__setTags(logId, tagNames)
+        return logId
+
+
+    def appendMany(self, records, tagNames=None, chunkSize=10000,
+                   dedupe=False):
+        """Appends logs from an iterable of records (see core.transfer), with
+           their tags and the given tags. Records without a message are
+           skipped. Returns the number of appended logs
+
+           Logs are inserted in chunks of chunkSize with one multi row
+           statement for the logs and one for their tag associations, all
+           in the current transaction. With dedupe, records with the message
+           of an existing log, or of an earlier record, add their tags to
+           that log instead
+
+        """
+        records = (record for record in records if record['message'])
+        tagNames = [decodeText(tag) for tag in tagNames or []]
+        count = 0
+        while True:
+            chunk = list(islice(records, chunkSize))
+            if len(chunk) == 0:
+                return count
+            count += self.__insertChunk(chunk, tagNames, dedupe)
+
+
+    def get(self, logId):
+        """Returns the record of the log with the given id
+
+           Raises:
+                Error   if there is no such log
+
+        """
+        row = self.__connection.execute(
+                select([logs.c.id, logs.c.date, logs.c.message])
+                .where(logs.c.id == logId)).fetchone()
+        if row is None:
+            raise Error(_notFound(logId))
+        return self.__records([row])[0]
+
+
+    def update(self, logId, message=None, tagNames=None):
+        """Replaces the message and/or the tags of a log, those that are not
+           None
+
+           Raises:
+                Error   if there is no such log
+
+        """
+        self.get(logId)
+        if message is not None:
+            message = decodeText(message)
+            self.__connection.execute(
+                logs.update().where(logs.c.id == logId),
+                {'message': message, 'hash': messageHash(message)})
+        if tagNames is not None:
+            self.__connection.execute(
+                logTags.delete().where(logTags.c.log_id == logId))
+            self.__setTags(logId, [decodeText(tag) for tag in tagNames])
+
+
+    def delete(self, logId):
+        """Deletes a log
+
+           Raises:
+                Error   if there is no such log
+
+        """
+        self.__connection.execute(
+            logTags.delete().where(logTags.c.log_id == logId))
+        result = self.__connection.execute(
+                    logs.delete().where(logs.c.id == logId))
+        if result.rowcount == 0:
+            raise Error(_notFound(logId))
+
+
+    def query(self, keyword=None, tagQuery=None, afterDate=None,
+              beforeDate=None, rank=False, reverse=False, sinceId=None,
+              limit=None, pattern=None, chunkSize=500):
+        """Returns an iterator over the records of the logs matching all the
+           given criteria
+
+           Arguments:
+                keyword     Full text query (see fullTextQuery), matched by
+                            mlog_match if the database has no full text index
+                tagQuery    A tag query string (see core.tagquery), or a list
+                            of tags the logs must all have
+                afterDate   Earliest date of the logs (datetime)
+                beforeDate  Latest date of the logs (datetime)
+                rank        Order logs by relevance to the keyword instead of
+                            by id
+                reverse     Newest logs first
+                sinceId     Return logs after (before if reverse) this id
+                limit       Maximum number of logs
+                pattern     A regular expression or fuzzy search matcher
+                            (see core.scan) the messages must match
+                chunkSize   Logs read per query
+
+           Logs are read in chunks, using keyset pagination on the log id, and
+           the tags of a chunk are read with one query. No more queries are
+           run once the caller stops iterating. The logs matched by pattern
+           are scanned first, when the query is called
+
+           Raises:
+                ConfigError if the tag query or the keyword is not valid
+                Error       if one of the tags does not exist
+
+        """
+        if keyword:
+            keyword = decodeText(keyword)
+        tagIds = None
+        tagQuery = self.__parseTagQuery(tagQuery)
+        if tagQuery:
+            tagIds = self.__tagIdsOf(tagQuery)
+
+        statement = self.__filter(
+                        select([logs.c.id, logs.c.date, logs.c.message]),
+                        keyword, afterDate, beforeDate)
+        if pattern is not None:
+            statement = statement.where(logs.c.id.in_(
+                self.__matchedLogIds(pattern, afterDate, beforeDate)))
+        if rank and keyword and self.__fullText:
+            # relevance order can not be paginated by id
+            if tagQuery:
+                statement = statement.where(matchesTags(tagQuery, tagIds))
+            statement = statement.order_by(logsFts.c.rank).limit(limit)
+            return self.__rankedRecords(statement, chunkSize)
+        if tagQuery and (keyword or afterDate or beforeDate or pattern):
+            # the other criteria select the logs, their tags are looked up
+            statement = statement.where(matchesTags(tagQuery, tagIds))
+            tagQuery = None
+        return self.__pagedRecords(statement, reverse, sinceId, limit,
+                                   chunkSize, tagQuery, tagIds)
+
+
+    def tagCounts(self, order='count', limit=None, showEmpty=False):
+        """Returns (tag name, number of logs) tuples ordered by count or by
+           name, at most limit of them. Tags without logs are only returned
+           if showEmpty is set. Counts are aggregated by the database in a
+           single query
+
+        """
+        logsPerTag = func.count(logTags.c.log_id)
+        if showEmpty:
+            joined = tags.outerjoin(logTags, logTags.c.tag_id == tags.c.id)
+        else:
+            joined = tags.join(logTags, logTags.c.tag_id == tags.c.id)
+        statement = select([tags.c.name, logsPerTag]).select_from(joined)
+        statement = statement.group_by(tags.c.id)
+
+        if order == 'name':
+            statement = statement.order_by(tags.c.name)
+        else:
+            statement = statement.order_by(logsPerTag.desc(), tags.c.name)
+
+        if limit:
+            statement = statement.limit(limit)
+        return [tuple(row) for row in self.__connection.execute(statement)]
+
+
+    def histogram(self, period='day', keyword=None, tagQuery=None,
+                  afterDate=None, beforeDate=None, byTag=False):
+        """Returns the number of logs matching the given criteria (see query)
+           per period, as (period, count) tuples in period order. With byTag,
+           logs are counted per period and tag, as (period, tag name, count)
+           tuples ordered by period and decreasing count
+
+           Periods are 'day' (2024-03-05), 'week' (2024-W09, weeks starting
+           on Monday), 'month' (2024-03) or 'year' (2024). Counts are
+           aggregated by the database in a single query
+
+           Raises:
+                ConfigError if the tag query or the keyword is not valid
+                Error       if one of the tags does not exist
+
+        """
+        periodColumn = func.strftime(PERIOD_FORMATS[period], logs.c.date)
+        logCount = func.count(logs.c.id)
+        if byTag:
+            statement = select([periodColumn, tags.c.name, logCount])
+        else:
+            statement = select([periodColumn, logCount])
+        statement = self.__filter(statement, keyword and decodeText(keyword),
+                                  afterDate, beforeDate)
+
+        tagQuery = self.__parseTagQuery(tagQuery)
+        if tagQuery:
+            tagIds = self.__tagIdsOf(tagQuery)
+            statement = statement.where(matchesTags(tagQuery, tagIds))
+        if byTag:
+            # Aliased so that the tag query subqueries are not correlated
+            logTag = logTags.alias('logTag')
+            statement = statement.where(and_(logTag.c.log_id == logs.c.id,
+                                             logTag.c.tag_id == tags.c.id))
+            statement = statement.group_by(periodColumn, tags.c.id)
+            statement = statement.order_by(periodColumn, logCount.desc(),
+                                           tags.c.name)
+        else:
+            statement = statement.group_by(periodColumn)
+            statement = statement.order_by(periodColumn)
+        return [tuple(row) for row in self.__execute(statement)]
+
+
+    def rebuildIndex(self, trigram=False):
+        """Rebuilds the full text index of the log messages, and the trigram
+           index if it exists. The full text index is created if it is
+           missing, the trigram index too with trigram
+
+           Raises:
+                Error   if SQLite was built without full text search or
+                        without the trigram tokenizer
+
+        """
+        if trigram and not trigramSupported(self.__connection):
+            raise Error('Trigram indexes are not supported by this SQLite '
+                        'build')
+        if self.__fullText:
+            rebuildFullTextIndex(self.__connection)
+        elif fullTextSupported(self.__connection):
+            createFullTextIndex(self.__connection)
+            self.__fullText = True
+        else:
+            raise Error('Full text search is not supported by this SQLite '
+                        'build')
+        if self.__trigram:
+            rebuildTrigramIndex(self.__connection)
+        elif trigram:
+            createTrigramIndex(self.__connection)
+            self.__trigram = True
+
+
+    def collectGarbage(self, full=False):
+        """Deletes tags no longer associated with any log and associations
+           referring to missing logs or tags, rebuilds the full text and
+           trigram indexes, refreshes the query planner statistics and returns
+           the free pages of the database file to the file system. The
+           cleanup is committed before the file is compacted
+
+           The first run on a database created without incremental vacuum
+           support, and every run with full, rewrites the whole file with
+           VACUUM. Later runs only truncate the free pages
+
+           Returns a dictionary with the number of deleted associations
+           (logTags) and tags (tags) and the size of the database file in
+           bytes before (sizeBefore) and after (sizeAfter) the collection
+
+        """
+        sizeBefore = self.__databaseSize()
+        logIds = select([logs.c.id])
+        tagIds = select([tags.c.id])
+        deletedLogTags = self.__connection.execute(logTags.delete().where(
+            or_(~logTags.c.log_id.in_(logIds),
+                ~logTags.c.tag_id.in_(tagIds)))).rowcount
+        usedTags = select([logTags.c.tag_id]).where(
+            logTags.c.tag_id == tags.c.id)
+        deletedTags = self.__connection.execute(
+            tags.delete().where(~exists(usedTags))).rowcount
+        if self.__fullText:
+            rebuildFullTextIndex(self.__connection)
+        if self.__trigram:
+            rebuildTrigramIndex(self.__connection)
+        self.commit()
+        self.__tagIds.clear()
+
+        # VACUUM and ANALYZE can not run inside a transaction
+        self.__transaction.rollback()
+        try:
+            autoVacuum = self.__connection.execute(
+                'PRAGMA auto_vacuum').scalar()
+            if full or autoVacuum != AUTO_VACUUM_INCREMENTAL:
+                self.__connection.execute('PRAGMA auto_vacuum = %d'
+                                          % AUTO_VACUUM_INCREMENTAL)
+                self.__connection.execute('VACUUM')
+            else:
+                self.__incrementalVacuum()
+            self.__connection.execute('ANALYZE')
+            self.__connection.execute('PRAGMA optimize')
+        except Exception as error:
+            raise Error('Failed to compact the database: ' + str(error))
+        finally:
+            self.__transaction = self.__connection.begin()
+        return {'logTags': deletedLogTags,
+                'tags': deletedTags,
+                'sizeBefore': sizeBefore,
+                'sizeAfter': self.__databaseSize()}
+
+
+    def collapseDuplicates(self, dryRun=False):
+        """Merges logs with the same message into the oldest of them, which
+           gets the tags of all of them. Returns the number of logs that were
+           merged into others and the number of logs they were merged into.
+           Nothing is changed with dryRun
+
+           Candidates are found by the hash index, so only logs sharing a
+           content hash are read
+
+        """
+        sharedHashes = select([logs.c.hash]).group_by(logs.c.hash) \
+                           .having(func.count(logs.c.id) > 1)
+        statement = select([logs.c.id, logs.c.hash, logs.c.message]) \
+                        .where(logs.c.hash.in_(sharedHashes)) \
+                        .order_by(logs.c.hash, logs.c.id)
+        # duplicate id to the id of the log it is merged into
+        merges = {}
+        keptIds = {}
+        for row in self.__connection.execute(statement).fetchall():
+            key = (row.hash, row.message)
+            if key in keptIds:
+                merges[row.id] = keptIds[key]
+            else:
+                keptIds[key] = row.id
+        kept = len(set(merges.values()))
+        if dryRun or len(merges) == 0:
+            return (len(merges), kept)
+
+        self.__connection.execute(
+            text('INSERT OR IGNORE INTO "logTags" (log_id, tag_id) '
+                 'SELECT :keptId, tag_id FROM "logTags" '
+                 'WHERE log_id = :duplicateId'),
+            [{'keptId': keptId, 'duplicateId': duplicateId}
+             for (duplicateId, keptId) in merges.items()])
+        duplicateIds = sorted(merges)
+        for start in range(0, len(duplicateIds), 500):
+            chunk = duplicateIds[start:start + 500]
+            self.__connection.execute(
+                logTags.delete().where(logTags.c.log_id.in_(chunk)))
+            self.__connection.execute(
+                logs.delete().where(logs.c.id.in_(chunk)))
+        return (len(merges), kept)
+
+
+    def moveLogs(self, archivePath, afterDate, beforeDate):
+        """Moves the logs dated from afterDate up to, but excluding,
+           beforeDate to the database at archivePath, which must exist, and
+           returns their number. The logs keep their ids and their tags are
+           created in the archive as needed. The highest id of the database
+           and the archive is kept in logIdMark, so the ids of the moved logs
+           are not given to new logs
+
+           The archive is attached to the connection and the logs are copied
+           and deleted with set based statements in a single transaction
+
+           Raises:
+                Error   if the logs could not be moved, e.g. because the
+                        archive holds logs with the same ids
+
+        """
+        # same format as the SQLAlchemy DateTime type
+        dates = {'after': afterDate.strftime('%Y-%m-%d %H:%M:%S.%f'),
+                 'before': beforeDate.strftime('%Y-%m-%d %H:%M:%S.%f')}
+        selected = 'l.date >= :after AND l.date < :before'
+        statements = (
+            'INSERT INTO archive.logs (id, date, message, hash) '
+            'SELECT l.id, l.date, l.message, l.hash FROM main.logs l '
+            'WHERE ' + selected,
+            'INSERT OR IGNORE INTO archive.tags (name) '
+            'SELECT DISTINCT t.name FROM main.tags t '
+            'JOIN main."logTags" lt ON lt.tag_id = t.id '
+            'JOIN main.logs l ON l.id = lt.log_id WHERE ' + selected,
+            'INSERT INTO archive."logTags" (log_id, tag_id) '
+            'SELECT lt.log_id, a.id FROM main."logTags" lt '
+            'JOIN main.tags t ON t.id = lt.tag_id '
+            'JOIN archive.tags a ON a.name = t.name '
+            'JOIN main.logs l ON l.id = lt.log_id WHERE ' + selected,
+            'INSERT INTO main."logIdMark" (lastId) '
+            'SELECT max(coalesce((SELECT max(id) FROM main.logs), 0), '
+            'coalesce((SELECT max(id) FROM archive.logs), 0))',
+            'DELETE FROM main."logIdMark" '
+            'WHERE lastId < (SELECT max(lastId) FROM main."logIdMark")',
+            'DELETE FROM main."logTags" WHERE log_id IN '
+            '(SELECT l.id FROM main.logs l WHERE ' + selected + ')')
+
+        # ATTACH and DETACH can not run inside a transaction
+        self.commit()
+        self.__transaction.rollback()
+        self.__connection.execute("ATTACH DATABASE ? AS archive", archivePath)
+        try:
+            self.__transaction = self.__connection.begin()
+            for statement in statements:
+                self.__connection.execute(text(statement), dates)
+            moved = self.__connection.execute(
+                text('DELETE FROM main.logs WHERE date >= :after '
+                     'AND date < :before'), dates).rowcount
+            self.commit()
+            self.__transaction.rollback()
+        except Exception as error:
+            self.rollback()
+            self.__transaction.rollback()
+            if isinstance(error, Error):
+                raise
+            raise Error('Failed to archive logs: ' + str(error))
+        finally:
+            self.__connection.execute('DETACH DATABASE archive')
+            self.__transaction = self.__connection.begin()
+        return moved
+
+
+    def __incrementalVacuum(self):
+        """Returns the free pages of the database file to the file system. The
+           file is rewritten with VACUUM if pages are left free
+
+        """
+        # each step of the pragma frees one page, so all its rows are read
+        # from a DBAPI cursor: a SQLAlchemy result would be closed at once
+        cursor = self.__connection.connection.cursor()
+        try:
+            cursor.execute('PRAGMA incremental_vacuum')
+            cursor.fetchall()
+        finally:
+            cursor.close()
+        if self.__connection.execute('PRAGMA freelist_count').scalar() > 0:
+            self.__connection.execute('VACUUM')
+
+
+    def __databaseSize(self):
+        """Returns the size of the database file in bytes"""
+        pageSize = self.__connection.execute('PRAGMA page_size').scalar()
+        pageCount = self.__connection.execute('PRAGMA page_count').scalar()
+        return pageSize * pageCount
+
+
+    def __insertChunk(self, records, appliedTags, dedupe):
+        """Inserts records with one multi row statement for the logs and one
+           for their tag associations. Returns the number of inserted logs
+
+        """
+        # the write lock is taken before the next log id is read, so that no
+        # other writer assigns the same ids until the transaction ends
+        self.__connection.execute('DELETE FROM "logIdMark" WHERE 0')
+        tagNames = set(appliedTags)
+        for record in records:
+            tagNames.update(decodeText(tag) for tag in record['tags'])
+        tagIds = self.__resolveTagIds(tagNames)
+
+        # message to log id of the logs duplicates are merged into
+        existingIds = {}
+        if dedupe:
+            existingIds = self.__duplicateIds(
+                            set(decodeText(record['message'])
+                                for record in records))
+
+        # ids are assigned here so that the tag associations can be inserted
+        # without reading the logs back
+        nextId = self.__connection.execute(NEXT_LOG_ID).scalar()
+        now = datetime.datetime.now()
+        logRows = []
+        tagRows = []
+        mergedRows = []
+        for record in records:
+            message = decodeText(record['message'])
+            names = set(decodeText(tag) for tag in record['tags'])
+            logId = existingIds.get(message)
+            if logId is None:
+                logId = nextId
+                nextId += 1
+                logRows.append({'id': logId,
+                                'date': record.get('date') or now,
+                                'message': message,
+                                'hash': messageHash(message)})
+                rows = tagRows
+                if dedupe:
+                    existingIds[message] = logId
+            else:
+                rows = mergedRows
+            for tagName in names.union(appliedTags):
+                rows.append({'log_id': logId, 'tag_id': tagIds[tagName]})
+
+        if len(logRows) > 0:
+            self.__connection.execute(logs.insert(), logRows)
+        if len(tagRows) > 0:
+            self.__connection.execute(logTags.insert(), tagRows)
+        if len(mergedRows) > 0:
+            self.__connection.execute(
+                logTags.insert().prefix_with('OR IGNORE'), mergedRows)
+        return len(logRows)
+
+
+    def __setTags(self, logId, tagNames):
+        """Associates a log with the given tags, creating the tags that do not
+           exist
+
+        """
+        tagIds = self.__resolveTagIds(tagNames)
+        if len(tagIds) > 0:
+            self.__connection.execute(logTags.insert(),
+                                      [{'log_id': logId, 'tag_id': tagId}
+                                       for tagId in set(tagIds.values())])
+
+
+    def __mergeTags(self, logId, tagNames):
+        """Adds the given tags to a log, creating the tags that do not exist"""
+        tagIds = self.__resolveTagIds(tagNames)
+        if len(tagIds) > 0:
+            self.__connection.execute(
+                logTags.insert().prefix_with('OR IGNORE'),
+                [{'log_id': logId, 'tag_id': tagId}
+                 for tagId in set(tagIds.values())])
+
+
+    def __duplicateIds(self, messages):
+        """Returns a dictionary mapping those of the given messages that are
+           the message of a log to the id of the oldest such log
+
+        """
+        messages = set(messages)
+        statement = select([logs.c.id, logs.c.message]) \
+                        .where(logs.c.hash.in_(set(messageHash(message)
+                                                   for message in messages))) \
+                        .order_by(logs.c.id.desc())
+        # the oldest log comes last and wins
+        return dict((row.message, row.id)
+                    for row in self.__connection.execute(statement)
+                    if row.message in messages)
+
+
+    def __resolveTagIds(self, tagNames):
+        """Returns a dictionary mapping the given tag names to tag ids. Tags
+           that do not exist are created
+
+           Ids are cached for the lifetime of the store, so only tags not
+           seen before are looked up: with one IN query, and an INSERT OR
+           IGNORE of the missing tags followed by another IN query if any
+           tag is new. Creating tags this way is safe when other processes
+           create the same tags concurrently
+
+        """
+        unknown = list(set(tagNames).difference(self.__tagIds))
+        # stay below the SQLite host parameter limit
+        for i in range(0, len(unknown), 500):
+            chunk = unknown[i:i + 500]
+            self.__tagIds.update(self.__existingTagIds(chunk))
+            missing = [name for name in chunk if name not in self.__tagIds]
+            if len(missing) > 0:
+                self.__connection.execute(
+                    tags.insert().prefix_with('OR IGNORE'),
+                    [{'name': name} for name in missing])
+                self.__tagIds.update(self.__existingTagIds(missing))
+        return dict((name, self.__tagIds[name]) for name in tagNames)
+
+
+    def __existingTagIds(self, tagNames):
+        """Returns (name, id) tuples of the given tags that exist"""
+        statement = select([tags.c.name, tags.c.id]).where(
+                        tags.c.name.in_(tagNames))
+        return self.__connection.execute(statement).fetchall()
+
+
+    def __parseTagQuery(self, tagQuery):
+        """Returns the parsed tag query, given as a string or a list of tags
+           the logs must all have, or None
+
+        """
+        if not tagQuery:
+            return None
+        if isinstance(tagQuery, (list, tuple)):
+            return andQuery([decodeText(tag) for tag in tagQuery])
+        return parseTagQuery(decodeText(tagQuery))
+
+
+    def __tagIdsOf(self, tagQuery):
+        """Returns a dictionary mapping the tag names of a parsed tag query to
+           their ids, looked up with a single query. Tags that do not exist
+           map to None, which matches no log
+
+           Raises:
+                UnknownTagError if a tag every matching log must have does not
+                                exist
+
+        """
+        tagIds = {}
+        tagNames = sorted(queryTagNames(tagQuery))
+        # stay below the SQLite host parameter limit
+        for i in range(0, len(tagNames), 500):
+            tagIds.update(self.__existingTagIds(tagNames[i:i + 500]))
+        for name in sorted(requiredTagNames(tagQuery)):
+            if name not in tagIds:
+                raise UnknownTagError(name)
+        return dict((name, tagIds.get(name)) for name in tagNames)
+
+
+    def __filter(self, statement, keyword, afterDate, beforeDate):
+        """Filters a select of logs by keyword and date range. All criteria
+           are evaluated by the database so only the matching rows are read
+
+           Raises:
+                ConfigError if the keyword has no word to search for
+
+        """
+        if keyword and len(keywordTerms(keyword)) == 0:
+            raise ConfigError('Invalid search keyword: %s' % keyword)
+        if keyword and self.__fullText:
+            statement = statement.select_from(
+                logs.join(logsFts, logsFts.c.rowid == logs.c.id))
+            statement = statement.where(
+                logsFts.c.logs_fts.match(fullTextQuery(keyword)))
+        elif keyword:
+            # compressed messages are matched once decompressed
+            message = func.mlog_inflate(logs.c.message)
+            statement = statement.where(func.mlog_match(message, keyword))
+
+        if beforeDate:
+            statement = statement.where(logs.c.date <= beforeDate)
+        if afterDate:
+            statement = statement.where(logs.c.date >= afterDate)
+        return statement
+
+
+    def __matchedLogIds(self, pattern, afterDate, beforeDate):
+        """Scans the messages of the logs between the dates with a matcher
+           and returns a select of the ids of the matching logs, which are
+           kept in a temporary table of the connection
+
+        """
+        path = self.__connection.engine.url.database
+        with timed(self.__timings, 'scan'):
+            logIds = scanLogIds(path, pattern, afterDate, beforeDate,
+                                self.__trigram)
+        self.__connection.execute(MATCHED_LOGS_DDL)
+        self.__connection.execute(matchedLogs.delete())
+        for start in range(0, len(logIds), 10000):
+            self.__connection.execute(matchedLogs.insert(),
+                [{'id': logId} for logId in logIds[start:start + 10000]])
+        return select([matchedLogs.c.id])
+
+
+    def __pagedRecords(self, statement, reverse, sinceId, limit, chunkSize,
+                       tagQuery=None, tagIds=None):
+        """Generates the records of a select of logs in id order, reading
+           them in chunks starting after sinceId until limit logs are read.
+           If a tag query is given, the ids of each chunk are selected from
+           the tag index first
+
+        """
+        if reverse:
+            statement = statement.order_by(logs.c.id.desc())
+        else:
+            statement = statement.order_by(logs.c.id)
+
+        remaining = limit
+        lastId = sinceId
+        while remaining is None or remaining > 0:
+            chunk = statement
+            if lastId is not None and reverse:
+                chunk = chunk.where(logs.c.id < lastId)
+            elif lastId is not None:
+                chunk = chunk.where(logs.c.id > lastId)
+            size = chunkSize
+            if remaining is not None:
+                size = min(chunkSize, remaining)
+                remaining -= size
+            if tagQuery is not None:
+                chunk = chunk.where(logs.c.id.in_(
+                    matchingLogIds(tagQuery, tagIds,
+                                   _idRange(lastId, reverse), reverse)
+                    .limit(size)))
+            rows = self.__execute(chunk.limit(size)).fetchall()
+            for record in self.__records(rows):
+                yield record
+            if len(rows) < size:
+                return
+            lastId = rows[-1].id
+
+
+    def __rankedRecords(self, statement, chunkSize):
+        """Generates the records of a select of logs, in its order"""
+        result = self.__execute(statement)
+        while True:
+            rows = result.fetchmany(chunkSize)
+            if len(rows) == 0:
+                return
+            for record in self.__records(rows):
+                yield record
+
+
+    def __execute(self, statement):
+        """Executes a select of logs. Full text query syntax errors are
+           raised as ConfigError
+
+        """
+        try:
+            return self.__connection.execute(statement)
+        except OperationalError as error:
+            if 'fts5' not in str(error.orig):
+                raise
+            raise ConfigError('Invalid search keyword: %s' % error.orig)
+
+
+    def __records(self, rows):
+        """Returns the records of rows of log id, date and message, reading
+           their tags with a single query
+
+        """
+        logIds = [row.id for row in rows]
+        statement = select([logTags.c.log_id, tags.c.name]).select_from(
+                        logTags.join(tags, logTags.c.tag_id == tags.c.id))
+        statement = statement.where(logTags.c.log_id.in_(logIds))
+        tagNames = dict((logId, []) for logId in logIds)
+        for (logId, name) in self.__connection.execute(statement):
+            tagNames[logId].append(name)
+        return [{'id': row.id,
+                 'date': row.date,
+                 'message': row.message,
+                 'tags': tagNames[row.id]} for row in rows]
+
+
+def _idRange(lastId, reverse):
+    """Returns a function giving the keyset pagination condition on a log id
+       column, or None
+
+    """
+    def idRange(column):
+        if lastId is None:
+            return None
+        return column < lastId if reverse else column > lastId
+    return idRange
+
+
+def _notFound(logId):
+    return "Log with id: %s was not found in the database\n" % logId
@@ -0,0 +1,233 @@
+# This file is part of mlog
+#
+# mlog is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# mlog is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mlog.  If not, see <http://www.gnu.org/licenses/>.
+"""Boolean tag queries, such as "work & (ops | oncall) & !draft".
+
+   '&' (or ',' or just a space) requires both operands, '|' either of them
+   and '!' negates its operand. '!' binds tightest and '|' loosest,
+   parentheses group. Anything else but whitespace is part of a tag name.
+
+   A parsed query is a tree of tuples: ('tag', name), ('not', node),
+   ('and', [nodes]) and ('or', [nodes]). It is compiled to SQL over the
+   association table of logs and tags in one of two forms:
+
+   - matchingLogIds: a compound select of log ids, the tags combined with
+     INTERSECT, UNION and EXCEPT. Every tag is read from the (tag_id, log_id)
+     index, and when the select is ordered SQLite merges the sorted index
+     ranges without materializing them
+   - matchesTags: a condition on the logs table, one EXISTS lookup of the
+     (log_id, tag_id) primary key per tag, for queries also filtered by other
+     criteria
+
+"""
+import re
+
+from db import *
+from errors import *
+
+from sqlalchemy.sql.expression import CompoundSelect
+
+
+def parseTagQuery(text):
+    """Parses a tag query
+
+       Raises:
+            ConfigError     if the query is not valid
+
+    """
+    return _Parser(text).parse()
+
+
+def andQuery(tagNames):
+    """Returns the query matching logs having all the given tags"""
+    return ('and', [('tag', name) for name in tagNames])
+
+
+def queryTagNames(node):
+    """Returns the set of tag names used by a query"""
+    if node[0] == 'tag':
+        return set([node[1]])
+    if node[0] == 'not':
+        return queryTagNames(node[1])
+    names = set()
+    for child in node[1]:
+        names.update(queryTagNames(child))
+    return names
+
+
+def requiredTagNames(node):
+    """Returns the set of tag names every log matching a query has: the
+       tags that are ANDed, or required by every alternative of an OR
+
+    """
+    if node[0] == 'tag':
+        return set([node[1]])
+    if node[0] == 'not':
+        return set()
+    names = [requiredTagNames(child) for child in node[1]]
+    if node[0] == 'and':
+        return set().union(*names)
+    return set.intersection(*names)
+
+
+def matchingLogIds(node, tagIds, idRange=None, descending=False):
+    """Returns a select of the ids of the logs matching a query, in
+       ascending or descending order. tagIds maps the tag names to their ids,
+       None for tags that do not exist, and idRange, if given, is a function
+       returning a condition on a log id column that is applied to every tag
+
+    """
+    statement = _logIds(node, tagIds, idRange or (lambda column: None),
+                        _order(descending))
+    return statement.order_by(_order(descending))
+
+
+def matchesTags(node, tagIds):
+    """Returns a condition on the logs table true for the logs matching a
+       query. tagIds maps the tag names to their ids, None for tags that do
+       not exist
+
+    """
+    if node[0] == 'tag':
+        return exists().where(and_(logTags.c.log_id == Log.__table__.c.id,
+                                   logTags.c.tag_id == tagIds[node[1]]))
+    if node[0] == 'not':
+        return not_(matchesTags(node[1], tagIds))
+    conditions = [matchesTags(child, tagIds) for child in node[1]]
+    if node[0] == 'and':
+        return and_(*conditions)
+    return or_(*conditions)
+
+
+def _order(descending):
+    column = literal_column('log_id')
+    return column.desc() if descending else column
+
+
+def _logIds(node, tagIds, idRange, order):
+    """Returns a select, simple or compound, of the log ids matching a
+       query. SQLite does not accept parenthesized compound selects, nested
+       ones are selected from as ordered subqueries instead
+
+    """
+    if node[0] == 'tag':
+        statement = select([logTags.c.log_id]).where(
+                        logTags.c.tag_id == tagIds[node[1]])
+        condition = idRange(logTags.c.log_id)
+    elif node[0] == 'all':
+        logs = Log.__table__
+        statement = select([logs.c.id.label('log_id')])
+        condition = idRange(logs.c.id)
+    elif node[0] == 'not':
+        return except_(_logIds(('all',), tagIds, idRange, order),
+                       _subquery(node[1], tagIds, idRange, order))
+    elif node[0] == 'or':
+        return union(*[_subquery(child, tagIds, idRange, order)
+                       for child in node[1]])
+    else:
+        included = [child for child in node[1] if child[0] != 'not']
+        excluded = [child[1] for child in node[1] if child[0] == 'not']
+        if len(included) == 0:
+            included = [('all',)]
+        if len(included) == 1:
+            statement = _subquery(included[0], tagIds, idRange, order)
+        else:
+            statement = intersect(*[_subquery(child, tagIds, idRange, order)
+                                    for child in included])
+        if len(excluded) > 0:
+            statement = except_(_nested(statement, order),
+                                _subquery(('or', excluded), tagIds, idRange,
+                                          order))
+        return statement
+
+    if condition is not None:
+        statement = statement.where(condition)
+    return statement
+
+
+def _subquery(node, tagIds, idRange, order):
+    """Returns the log ids select of a query, usable as an operand of a
+       compound select
+
+    """
+    if node[0] in ('and', 'or') and len(node[1]) == 1:
+        node = node[1][0]
+    return _nested(_logIds(node, tagIds, idRange, order), order)
+
+
+def _nested(statement, order):
+    if not isinstance(statement, CompoundSelect):
+        return statement
+    subquery = statement.order_by(order).alias()
+    return select([subquery.c.log_id])
+
+
+class _Parser(object):
+    """Recursive descent parser of tag queries"""
+    def __init__(self, text):
+        self.__text = text
+        self.__tokens = re.findall(r'[&|!(),]|[^\s&|!(),]+', text)
+        self.__position = 0
+
+
+    def parse(self):
+        node = self.__parseOr()
+        if self.__peek() is not None:
+            self.__fail('unexpected "%s"' % self.__peek())
+        return node
+
+
+    def __parseOr(self):
+        nodes = [self.__parseAnd()]
+        while self.__peek() == '|':
+            self.__position += 1
+            nodes.append(self.__parseAnd())
+        return nodes[0] if len(nodes) == 1 else ('or', nodes)
+
+
+    def __parseAnd(self):
+        nodes = [self.__parseNot()]
+        while self.__peek() not in (None, '|', ')'):
+            if self.__peek() in ('&', ','):
+                self.__position += 1
+            nodes.append(self.__parseNot())
+        return nodes[0] if len(nodes) == 1 else ('and', nodes)
+
+
+    def __parseNot(self):
+        token = self.__peek()
+        self.__position += 1
+        if token == '!':
+            return ('not', self.__parseNot())
+        if token == '(':
+            node = self.__parseOr()
+            if self.__peek() != ')':
+                self.__fail('missing ")"')
+            self.__position += 1
+            return node
+        if token is None:
+            self.__fail('unexpected end')
+        if token in ('&', '|', ',', ')'):
+            self.__fail('unexpected "%s"' % token)
+        return ('tag', token)
+
+
+    def __peek(self):
+        if self.__position < len(self.__tokens):
+            return self.__tokens[self.__position]
+        return None
+
+
+    def __fail(self, reason):
+        raise ConfigError('Invalid tag query "%s": %s' % (self.__text, reason))
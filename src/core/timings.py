@@ -0,0 +1,174 @@
+# This file is part of mlog
+#
+# mlog is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# mlog is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mlog.  If not, see <http://www.gnu.org/licenses/>.
+"""Phase and SQL statement timings of a command, printed on stderr when mlog
+   is run with --timings
+
+"""
+import re
+import sys
+import time
+
+from contextlib import contextmanager
+
+
+class Timings(object):
+    def __init__(self, started=None):
+        """Starts collecting timings. If given, the time between started and
+           now is recorded as the startup phase
+
+        """
+        now = time.time()
+        self.__started = started or now
+        # (name, seconds, SQL seconds) tuples, in the order phases ended
+        self.__phases = []
+        # [statement, seconds, rows] lists, in execution order
+        self.__statements = []
+        self.__sqlTime = 0.0
+        if started is not None:
+            self.__phases.append(('startup', now - started, 0.0))
+
+
+    @contextmanager
+    def phase(self, name):
+        """Context manager recording the duration of a phase, and how much of
+           it was spent running SQL statements
+
+        """
+        start = time.time()
+        sqlStart = self.__sqlTime
+        try:
+            yield
+        finally:
+            self.__phases.append((name, time.time() - start,
+                                  self.__sqlTime - sqlStart))
+
+
+    def watchEngine(self, engine):
+        """Records every statement run by the engine with its duration,
+           fetching the rows included, and the number of rows it returned or
+           changed
+
+        """
+        from sqlalchemy import event
+        event.listen(engine, 'before_cursor_execute', self.__beforeExecute)
+        event.listen(engine, 'after_cursor_execute', self.__afterExecute)
+
+
+    def addSqlTime(self, statement, seconds):
+        """Adds time spent running or fetching the given statement"""
+        self.__sqlTime += seconds
+        statement[1] += seconds
+
+
+    def report(self, fd=sys.stderr):
+        """Writes the phases and the statements to the given file"""
+        fd.write('%-12s %10s %10s %10s\n' % ('phase', 'total', 'sql', 'other'))
+        for name, seconds, sqlSeconds in self.__phases:
+            fd.write('%-12s %10s %10s %10s\n'
+                     % (name, _ms(seconds), _ms(sqlSeconds),
+                        _ms(seconds - sqlSeconds)))
+        fd.write('%-12s %10s %10s\n\n'
+                 % ('total', _ms(time.time() - self.__started),
+                    _ms(self.__sqlTime)))
+
+        fd.write('%d statements\n' % len(self.__statements))
+        for statement, seconds, rows in self.__statements:
+            fd.write('%10s %8s rows  %s\n'
+                     % (_ms(seconds), '?' if rows is None else rows,
+                        _shorten(statement)))
+
+
+    def __beforeExecute(self, connection, cursor, statement, parameters,
+                        context, executemany):
+        context._mlogStarted = time.time()
+
+
+    def __afterExecute(self, connection, cursor, statement, parameters,
+                       context, executemany):
+        entry = [statement, 0.0, None]
+        self.__statements.append(entry)
+        self.addSqlTime(entry, time.time() - context._mlogStarted)
+        if cursor.description is None:
+            entry[2] = cursor.rowcount if cursor.rowcount >= 0 else None
+        else:
+            # rows are counted, and fetching them timed, as they are read
+            entry[2] = 0
+            context.cursor = _CountingCursor(cursor, self, entry)
+
+
+class _CountingCursor(object):
+    """DB-API cursor wrapper counting the rows fetched and the time spent
+       fetching them. SQLite runs most of a query while its rows are fetched
+
+    """
+    def __init__(self, cursor, timings, entry):
+        self.__cursor = cursor
+        self.__timings = timings
+        self.__entry = entry
+
+    def __getattr__(self, name):
+        return getattr(self.__cursor, name)
+
+    def fetchone(self):
+        row = self.__fetch(self.__cursor.fetchone)
+        if row is not None:
+            self.__entry[2] += 1
+        return row
+
+    def fetchmany(self, *args):
+        rows = self.__fetch(self.__cursor.fetchmany, *args)
+        self.__entry[2] += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self.__fetch(self.__cursor.fetchall)
+        self.__entry[2] += len(rows)
+        return rows
+
+    def __fetch(self, fetch, *args):
+        start = time.time()
+        try:
+            return fetch(*args)
+        finally:
+            self.__timings.addSqlTime(self.__entry, time.time() - start)
+
+
+class _Untimed(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+def timed(timings, name):
+    """Returns a context manager recording the named phase in timings, which
+       may be None if the command is not being timed
+
+    """
+    if timings is None:
+        return _Untimed()
+    return timings.phase(name)
+
+
+def _ms(seconds):
+    return '%.1f ms' % (seconds * 1000)
+
+
+def _shorten(statement, width=100):
+    statement = re.sub(r'\s+', ' ', statement).strip()
+    if len(statement) > width:
+        statement = statement[:width - 3] + '...'
+    return statement
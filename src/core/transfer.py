@@ -0,0 +1,316 @@
+# This file is part of mlog
+#
+# mlog is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# mlog is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mlog.  If not, see <http://www.gnu.org/licenses/>.
+"""Readers and writers of the file formats supported by the import and export
+   commands.
+
+   Every reader yields records, dictionaries with a 'message', a 'date'
+   (datetime or None) and a 'tags' (list of tag names) key. Writers also
+   expect an 'id' key
+
+"""
+import os
+import sys
+import csv
+import json
+import datetime
+
+from errors import *
+from common import encodeText
+
+
+IMPORT_FORMATS = ('ndjson', 'csv', 'dir')
+EXPORT_FORMATS = ('ndjson', 'csv', 'text')
+LIST_FORMATS = ('pretty', 'plain', 'json', 'ndjson', 'tsv')
+
+
+def guessFormat(source):
+    """Guesses the format of an import source from its type and extension"""
+    if source != '-' and os.path.isdir(source):
+        return 'dir'
+    if source.lower().endswith('.csv'):
+        return 'csv'
+    return 'ndjson'
+
+
+def readRecords(source, format=None):
+    """Returns an iterator over the records of the given source. source is a
+       file name, a directory name or '-' for standard input. The source file
+       is closed once the records are read or the iterator is closed
+
+       Raises:
+            ConfigError     if the source can not be read
+            Error           if the source contains an invalid record
+
+    """
+    if format is None:
+        format = guessFormat(source)
+    if format == 'dir':
+        return _readDirectory(source)
+    if format == 'csv':
+        return _readCsv(_openSource(source, binary=sys.version_info[0] < 3))
+    return _readNdjson(_openSource(source))
+
+
+def parseDate(dateString):
+    """Parses an ISO date string, the format used by mlog to print dates"""
+    if not dateString:
+        return None
+    ds = dateString.strip().replace('T', ' ')
+    for fmt in ('%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d'):
+        try:
+            return datetime.datetime.strptime(ds, fmt)
+        except ValueError:
+            pass
+    raise Error('Invalid date string: %s' % dateString)
+
+
+def _openSource(source, binary=False):
+    """Opens an import source file. '-' stands for standard input"""
+    if source == '-':
+        return sys.stdin
+    try:
+        if binary:
+            return open(source, 'rb')
+        return open(source)
+    except IOError as error:
+        raise ConfigError(str(error))
+
+
+def _closeSource(fd):
+    """Closes an import source file opened by _openSource"""
+    if fd is not sys.stdin:
+        fd.close()
+
+
+def _record(message, date, tags):
+    """Creates a record, tags is either a list or a comma separated string"""
+    if isinstance(tags, (list, tuple)):
+        tags = [t.strip() for t in tags]
+    else:
+        tags = [t.strip() for t in (tags or '').split(',')]
+    return {'message': (message or '').strip(),
+            'date': parseDate(date),
+            'tags': [t for t in tags if len(t) > 0]}
+
+
+def _decode(value):
+    """Decodes byte strings read by the python 2 csv module"""
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    return value
+
+
+def _readNdjson(fd):
+    """One JSON object per line"""
+    try:
+        for (lineNo, line) in enumerate(fd, 1):
+            if len(line.strip()) == 0:
+                continue
+            try:
+                obj = json.loads(line)
+            except ValueError as error:
+                raise Error('Invalid JSON at line %d: %s' % (lineNo, error))
+            yield _record(obj.get('message'), obj.get('date'),
+                          obj.get('tags'))
+    finally:
+        _closeSource(fd)
+
+
+def _readCsv(fd):
+    """CSV with a header line, the message, date and tags columns are used"""
+    try:
+        for row in csv.DictReader(fd):
+            row = dict((_decode(k), _decode(v)) for (k, v) in row.items())
+            yield _record(row.get('message'), row.get('date'),
+                          row.get('tags'))
+    finally:
+        _closeSource(fd)
+
+
+def _readDirectory(path):
+    """Every file of the directory is a log, dated by its modification time"""
+    try:
+        names = sorted(os.listdir(path))
+    except OSError as error:
+        raise ConfigError(str(error))
+    for name in names:
+        fileName = os.path.join(path, name)
+        if not os.path.isfile(fileName):
+            continue
+        with open(fileName) as fd:
+            message = fd.read()
+        mtime = datetime.datetime.fromtimestamp(os.path.getmtime(fileName))
+        yield {'message': message.strip(), 'date': mtime, 'tags': []}
+
+
+def openOutput(fileName, format):
+    """Opens a file for writing in the given export format"""
+    if format == 'csv' and sys.version_info[0] >= 3:
+        return open(fileName, 'w', newline='')
+    return open(fileName, 'w')
+
+
+def recordWriter(fd, format):
+    """Returns a writer of records in the given format to a file object"""
+    if format == 'csv':
+        return _CsvWriter(fd)
+    if format == 'text':
+        return _TextWriter(fd)
+    return _NdjsonWriter(fd)
+
+
+def listWriter(fd, format, colour=False):
+    """Returns a writer of records in the given list format to a file object.
+       Only the pretty format uses colour, if colour is set
+
+    """
+    if format == 'plain':
+        return _TextWriter(fd)
+    if format == 'json':
+        return _JsonWriter(fd)
+    if format == 'ndjson':
+        return _NdjsonWriter(fd)
+    if format == 'tsv':
+        return _TsvWriter(fd)
+    return _PrettyWriter(fd, colour)
+
+
+class OutputBuffer(object):
+    """File like object collecting the text written to it and writing it to
+       the underlying file in large chunks
+
+    """
+    def __init__(self, fd, bufferSize=65536):
+        self.__fd = fd
+        self.__bufferSize = bufferSize
+        self.__buffer = []
+        self.__size = 0
+
+    def write(self, text):
+        self.__buffer.append(text)
+        self.__size += len(text)
+        if self.__size >= self.__bufferSize:
+            self.flush()
+
+    def flush(self):
+        if len(self.__buffer) > 0:
+            self.__fd.write(''.join(self.__buffer))
+            self.__buffer = []
+            self.__size = 0
+        self.__fd.flush()
+
+
+def _jsonRecord(record):
+    """Returns the JSON text of a record"""
+    return json.dumps({'id': record['id'],
+                       'date': record['date'].isoformat(),
+                       'message': record['message'],
+                       'tags': record['tags']}, sort_keys=True)
+
+
+class _Writer(object):
+    """Base class of the record writers"""
+    def close(self):
+        """Writes the end of the output, if the format has one"""
+        pass
+
+
+class _NdjsonWriter(_Writer):
+    """One JSON object per line, the format read by the ndjson reader"""
+    def __init__(self, fd):
+        self.__fd = fd
+
+    def write(self, record):
+        self.__fd.write(_jsonRecord(record) + '\n')
+
+
+class _JsonWriter(_Writer):
+    """A JSON array of objects, written as the records come"""
+    def __init__(self, fd):
+        self.__fd = fd
+        self.__separator = '[\n'
+
+    def write(self, record):
+        self.__fd.write(self.__separator + _jsonRecord(record))
+        self.__separator = ',\n'
+
+    def close(self):
+        if self.__separator == '[\n':
+            self.__fd.write('[]\n')
+        else:
+            self.__fd.write('\n]\n')
+
+
+class _TsvWriter(_Writer):
+    """Tab separated id, date, tags and message, one log per line. Tabs,
+       newlines and backslashes are escaped with a backslash
+
+    """
+    def __init__(self, fd):
+        self.__fd = fd
+
+    def write(self, record):
+        text = '%d\t%s\t%s\t%s\n' % (record['id'],
+                                     record['date'].isoformat(),
+                                     _escapeTsv(','.join(record['tags'])),
+                                     _escapeTsv(record['message']))
+        self.__fd.write(encodeText(text))
+
+
+def _escapeTsv(value):
+    return value.replace('\\', '\\\\').replace('\t', '\\t') \
+                .replace('\n', '\\n').replace('\r', '\\r')
+
+
+class _CsvWriter(_Writer):
+    """CSV with a header line, the format read by the csv reader"""
+    def __init__(self, fd):
+        self.__writer = csv.writer(fd)
+        self.__writer.writerow(('id', 'date', 'message', 'tags'))
+
+    def write(self, record):
+        self.__writer.writerow((record['id'],
+                                record['date'].isoformat(),
+                                encodeText(record['message']),
+                                encodeText(','.join(record['tags']))))
+
+
+class _TextWriter(_Writer):
+    """Human readable text, the plain list format"""
+    def __init__(self, fd):
+        self.__fd = fd
+
+    def write(self, record):
+        text = '>%6d :: [%s]\n%s\n\n<%s>\n\n' % (record['id'],
+                                                  record['date'],
+                                                  record['message'],
+                                                  ', '.join(record['tags']))
+        self.__fd.write(encodeText(text))
+
+
+class _PrettyWriter(_Writer):
+    """Human readable text with a separator line, the default list format"""
+    def __init__(self, fd, colour):
+        self.__fd = fd
+        if colour:
+            self.__header = '\033[1m>%6d :: [%s] %s\033[0m\n'
+        else:
+            self.__header = '>%6d :: [%s] %s\n'
+
+    def write(self, record):
+        text = self.__header % (record['id'], record['date'], 40 * '-') \
+               + '%s\n\n<%s>\n\n' % (record['message'],
+                                     ', '.join(record['tags']))
+        self.__fd.write(encodeText(text))
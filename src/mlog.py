@@ -19,23 +19,28 @@
 
 """
 
+import time
+# start of the startup phase reported by --timings
+STARTED = time.time()
+
+import io
 import os
 import sys
+import errno
+import signal
+import subprocess
 import argparse
 import re
 
-PARSEDATETIME = True
-try:
-    import parsedatetime.parsedatetime as pdt
-    import parsedatetime.parsedatetime_consts as pdc
-except:
-    PARSEDATETIME = False
-
-
 from datetime import datetime
 
+# SQLAlchemy and the other heavy modules are imported by the commands that
+# need them, so that "mlog add" starts fast
 from core.errors import Error, ConfigError
-from core.logger import Logger
+from core.transfer import IMPORT_FORMATS, EXPORT_FORMATS, LIST_FORMATS
+from core.config import readConfig, pragmasOf, PRAGMAS, SETTINGS, CHOICES
+from core.timings import timed
+from core.common import STATS_PERIODS
 
 
 class AliasedSubParsersAction(argparse._SubParsersAction):
@@ -80,6 +85,25 @@ class ProgramCommands(object):
     DELETE = 2
     EDIT = 3
     LIST_TAGS = 4
+    REINDEX = 5
+    IMPORT = 6
+    EXPORT = 7
+    SERVE = 8
+    FLUSH = 9
+    STATS = 10
+    GC = 11
+    DEDUPE = 12
+    ARCHIVE = 13
+
+
+# commands run by the mlog daemon, if one is running, and their names in the
+# daemon protocol
+REMOTE_COMMANDS = {
+    ProgramCommands.ADD: 'add',
+    ProgramCommands.LIST: 'list',
+    ProgramCommands.LIST_TAGS: 'tags',
+    ProgramCommands.DELETE: 'delete',
+}
 
 
 class ProgramOptions(object):
@@ -90,11 +114,54 @@ class ProgramOptions(object):
             inputFile       an input file name to log it's contents
             dbPath          a log file to write the database instead of the
                             standard log path
+            pragmas         SQLite pragmas applied to database connections,
+                            read from the configuration file and the
+                            command line
+            retries         Attempts of add and delete commands failing
+                            because the database is locked
+            spool           Add logs to the spool instead of the database
+            dedupe          Merge added and imported logs into existing logs
+                            with the same message
+            timings         A Timings object collecting the duration of the
+                            command phases and SQL statements, None unless
+                            --timings or MLOG_TIMINGS is set
+            profileFile     File to write cProfile statistics to
             afterDate       Search start date. Start search logs after this
                             date.
             beforeDate      Search end date. End searching logs after this date
             logId           A logId. Used for the DELETE operation
             searchKeyword   Search keyword for SEARCH operation
+            rankResults     Order search results by relevance
+            regexPattern    Regular expression the listed messages match
+            fuzzyTerm       Term the listed messages match approximately
+            maxErrors       Edits allowed in a fuzzyTerm match
+            limit           Maximum number of logs to list
+            reverse         List newest logs first
+            sinceId         List logs after (before if reverse) this log id
+            tagQuery        Tag query filtering listed and exported logs, see
+                            core.tagquery
+            usePager        Page list output through the user's pager
+            statsPeriod     Histogram period of the stats command, one of
+                            day, week, month and year
+            statsByTag      Break the stats command counts down by tag
+            statsFormat     Output format of the stats command, text or tsv
+            listFormat      Output format of the list command
+            colour          Use colours in the list output, set if standard
+                            output is a terminal and NO_COLOR is not set
+            tagsOrder       Order of listed tags, either 'count' or 'name'
+            tagsLimit       Maximum number of tags to list
+            showEmptyTags   List tags that are not associated with any log
+            importSource    File, directory or '-' (stdin) to import logs from
+            importFormat    Format of the import source, guessed if None
+            batchSize       Number of logs inserted per transaction on import
+            exportFormat    Output format of the export command
+            outputFile      File to export logs to, stdout if None
+            chunkSize       Number of logs read per query on export
+            trigramIndex    Create the trigram index on reindex
+            fullVacuum      Rewrite the whole database file on gc
+            dryRun          Only count the duplicates on dedupe
+            useArchives     Read the yearly archives of the database too
+            archiveYear     Logs dated before this year are archived
             message         Message to log
 
        Raises:
@@ -103,11 +170,45 @@ class ProgramOptions(object):
        """
     inputFile = None
     dbPath = None
+    pragmas = None
+    retries = 0
+    spool = False
+    dedupe = False
+    timings = None
+    profileFile = None
     afterDate = ''
     beforeDate = ''
     logId = ''
     searchKeaword = ''
     message = ''
+    rankResults = False
+    regexPattern = None
+    fuzzyTerm = None
+    maxErrors = 1
+    limit = None
+    reverse = False
+    sinceId = None
+    tagQuery = None
+    usePager = False
+    statsPeriod = 'day'
+    statsByTag = False
+    statsFormat = 'text'
+    listFormat = 'pretty'
+    colour = False
+    tagsOrder = 'count'
+    tagsLimit = None
+    showEmptyTags = False
+    importSource = None
+    importFormat = None
+    batchSize = 10000
+    exportFormat = 'ndjson'
+    outputFile = None
+    chunkSize = 500
+    trigramIndex = False
+    fullVacuum = False
+    dryRun = False
+    useArchives = True
+    archiveYear = None
 
     def __init__(self):
         # defaults
@@ -122,15 +223,30 @@ class ProgramOptions(object):
 
         # global options
         self.dbPath = self.__options.get('dbPath')
+        overrides = dict((name, self.__options.get(name))
+                         for name in PRAGMAS + SETTINGS)
+        config = readConfig(self.__options.get('configFile'), overrides)
+        self.pragmas = pragmasOf(config)
+        self.retries = config['retries']
+        self.spool = config['spool']
+        self.dedupe = config['dedupe']
+        if self.__options.get('timings') or os.environ.get('MLOG_TIMINGS'):
+            from core.timings import Timings
+            self.timings = Timings(STARTED)
+        self.profileFile = (self.__options.get('profileFile')
+                            or os.environ.get('MLOG_PROFILE'))
 
         self.logId = -1
 
         self.command = self.__options.get('command', ProgramCommands.LIST)
 
-        if self.command == ProgramCommands.LIST:
+        if self.command in (ProgramCommands.LIST, ProgramCommands.EXPORT,
+                            ProgramCommands.STATS):
 
             self.filterString = self.__options.get('dateFilter', None)
-            self.tags = self.__findTags(self.__options.get('tagList', []))
+            # tag lists are tag queries too: adjacent tags are ANDed
+            tagList = self.__options.get('tagList')
+            self.tagQuery = ' '.join(tagList) if tagList else None
 
             # filter dates, if no dateFilter set, fallback to explicit
             # date options
@@ -142,6 +258,31 @@ class ProgramOptions(object):
                 self.beforeDate = self.__options.get('beforeDate')
 
             self.searchKeyword = self.__options.get('searchKeyword', '')
+            self.rankResults = self.__options.get('rankResults', False)
+            self.limit = self.__options.get('limit')
+            self.reverse = self.__options.get('reverse', False)
+            self.sinceId = self.__options.get('sinceId')
+            self.usePager = self.__options.get('usePager', False)
+            self.listFormat = self.__options.get('listFormat', 'pretty')
+            # decided before the output is redirected to the pager
+            self.colour = (sys.stdout.isatty()
+                           and not os.environ.get('NO_COLOR'))
+            if self.limit is not None and self.limit < 1:
+                raise ConfigError('Invalid limit: %d' % self.limit)
+            self.regexPattern = self.__options.get('regexPattern')
+            self.fuzzyTerm = self.__options.get('fuzzyTerm')
+            self.maxErrors = self.__options.get('maxErrors', 1)
+
+            self.exportFormat = self.__options.get('exportFormat', 'ndjson')
+            self.outputFile = self.__options.get('outputFile')
+            self.chunkSize = self.__options.get('chunkSize', 500)
+            if self.chunkSize < 1:
+                raise ConfigError('Invalid chunk size: %d' % self.chunkSize)
+
+            self.useArchives = self.__options.get('useArchives', True)
+            self.statsPeriod = self.__options.get('statsPeriod', 'day')
+            self.statsByTag = self.__options.get('statsByTag', False)
+            self.statsFormat = self.__options.get('statsFormat', 'text')
 
         # parse the message for add command
         elif self.command == ProgramCommands.ADD:
@@ -154,11 +295,48 @@ class ProgramOptions(object):
             self.inputFile = self.__options.get('inputFile', None)
             self.logId = self.__options.get('entry_id')
 
+        elif self.command == ProgramCommands.IMPORT:
+            self.importSource = self.__options.get('importSource')
+            self.importFormat = self.__options.get('importFormat')
+            self.batchSize = self.__options.get('batchSize', 10000)
+            self.tags = self.__findTags(self.__options.get('tagList', None))
+            if self.batchSize < 1:
+                raise ConfigError('Invalid batch size: %d' % self.batchSize)
+
+        elif self.command == ProgramCommands.REINDEX:
+            self.trigramIndex = self.__options.get('trigramIndex', False)
+
+        elif self.command == ProgramCommands.GC:
+            self.fullVacuum = self.__options.get('fullVacuum', False)
+
+        elif self.command == ProgramCommands.DEDUPE:
+            self.dryRun = self.__options.get('dryRun', False)
+
+        elif self.command == ProgramCommands.ARCHIVE:
+            self.archiveYear = self.__options.get('archiveYear')
+            if self.archiveYear is None:
+                self.archiveYear = datetime.now().year
+
+        elif self.command == ProgramCommands.LIST_TAGS:
+            self.tagsOrder = self.__options.get('tagsOrder', 'count')
+            self.tagsLimit = self.__options.get('tagsLimit')
+            self.showEmptyTags = self.__options.get('showEmptyTags', False)
+            self.useArchives = self.__options.get('useArchives', True)
+            if self.tagsLimit is not None and self.tagsLimit < 1:
+                raise ConfigError('Invalid --top value: %d' % self.tagsLimit)
+
 
     def __parseDateFilter(self, dateString):
         """ Parse a date string using parsedatetime module.
         Returns a tuple of date objects representing a date range.
         """
+        try:
+            import parsedatetime.parsedatetime as pdt
+            import parsedatetime.parsedatetime_consts as pdc
+        except ImportError:
+            raise ConfigError('--date-filter requires the parsedatetime '
+                              'module')
+
         # thats how parsedatetime module works
         c = pdc.Constants()
         p = pdt.Calendar(c)
@@ -191,7 +369,7 @@ class ProgramOptions(object):
         inputFile = self.__options.get('inputFile')
         if inputFile is None:
             # no input file provided
-            message = ' '.join(self.__args[1:])
+            message = ' '.join(self.__options.get('message') or [])
             msg_copy = message.strip()
             if len(msg_copy) != 0:
                 return message
@@ -286,53 +464,246 @@ class ProgramOptions(object):
                           default = None,
                           help = 'File to be used as logfile',
                           metavar = 'DATABASE_PATH')
+        parser.add_argument('-c', '--config',
+                          dest = 'configFile',
+                          default = None,
+                          help = 'Configuration file (default ~/.mlogrc)',
+                          metavar = 'CONFIG_FILE')
+
+        parser.add_argument('--timings',
+                          dest = 'timings',
+                          action = 'store_true',
+                          help = 'Print the time spent in each phase of the '
+                                 'command and each SQL statement on stderr '
+                                 '(or set MLOG_TIMINGS)')
+        parser.add_argument('--profile',
+                          dest = 'profileFile',
+                          default = None,
+                          help = 'Write cProfile statistics of the command '
+                                 'to PROFILE_FILE (or set MLOG_PROFILE)',
+                          metavar = 'PROFILE_FILE')
 
-        # list parser
-        parser_list = subparsers.add_parser('list', aliases=['l','ls', 'll'],
-                                            help = 'List existing log entries',)
-        parser_list.add_argument('-a', '--after',
+        # sqlite tuning options, override the configuration file
+        parser.add_argument('--busy-timeout',
+                          dest = 'busy_timeout',
+                          default = None,
+                          type = int,
+                          help = 'Milliseconds to wait for other processes '
+                                 'to unlock the database (default 5000)',
+                          metavar = 'MS')
+        parser.add_argument('--retries',
+                          dest = 'retries',
+                          default = None,
+                          type = int,
+                          help = 'Times add and delete are retried while the '
+                                 'database is locked (default 5)',
+                          metavar = 'N')
+        parser.add_argument('--journal-mode',
+                          dest = 'journal_mode',
+                          default = None,
+                          choices = CHOICES['journal_mode'],
+                          help = 'SQLite journal mode (default wal)')
+        parser.add_argument('--synchronous',
+                          dest = 'synchronous',
+                          default = None,
+                          choices = CHOICES['synchronous'],
+                          help = 'SQLite synchronous mode (default normal)')
+        parser.add_argument('--mmap-size',
+                          dest = 'mmap_size',
+                          default = None,
+                          type = int,
+                          help = 'Bytes of the database memory mapped '
+                                 '(default 256MB)',
+                          metavar = 'BYTES')
+        parser.add_argument('--cache-size',
+                          dest = 'cache_size',
+                          default = None,
+                          type = int,
+                          help = 'SQLite page cache size, in pages or in KiB '
+                                 'if negative (default -16000)',
+                          metavar = 'SIZE')
+        parser.add_argument('--temp-store',
+                          dest = 'temp_store',
+                          default = None,
+                          choices = CHOICES['temp_store'],
+                          help = 'Where SQLite stores temporary tables '
+                                 '(default memory)')
+
+        # log filter options, shared by the list and export parsers
+        parser_filter = argparse.ArgumentParser(add_help=False)
+        parser_filter.add_argument('searchKeyword',
+                          default = '',
+                          nargs = '?',
+                          help = 'Return logs containing every word of the '
+                                 'keyword, as the start of a word ("err" '
+                                 'matches "error")',
+                          metavar = 'KEYWORD')
+        parser_filter.add_argument('-a', '--after',
                           dest = 'afterDate',
                           default = '',
                           help = 'Return logs after the given (ISO) date',
                           metavar = 'AFTER_DATE')
-        parser_list.add_argument('-b', '--before',
+        parser_filter.add_argument('-b', '--before',
                           dest = 'beforeDate',
                           default = '',
                           help = 'Return logs before the given (ISO) date',
                           metavar = 'BEFORE_DATE')
-        parser_list.add_argument('-t', '--tags',
+        parser_filter.add_argument('-t', '--tags',
                           dest = 'tagList',
                           default = None,
                           nargs = '+',
-                          help = 'List of tags to filter results',
+                          help = 'Return logs having all the given tags, or '
+                                 'matching a tag query such as '
+                                 '"work & (ops | oncall) & !draft"',
                           metavar = 'TAGS')
-        if PARSEDATETIME:
-            parser_list.add_argument('-df', '--date-filter',
-                              dest = 'dateFilter',
-                              default = '',
-                              help = 'Date filter (e.g. "2 days ago")',
-                              metavar = 'DATE_FILTER_STRING')
+        parser_filter.add_argument('--no-archives',
+                          dest = 'useArchives',
+                          action = 'store_false',
+                          help = 'Only read the database, not its yearly '
+                                 'archives')
+        parser_filter.add_argument('-df', '--date-filter',
+                          dest = 'dateFilter',
+                          default = '',
+                          help = 'Date filter (e.g. "2 days ago"), requires '
+                                 'the parsedatetime module',
+                          metavar = 'DATE_FILTER_STRING')
 
-        # add parser
-        parser_add = subparsers.add_parser('add', aliases=['a'],
-                                           help = 'Create new log entries')
-        parser_add.add_argument('-i', '--input-file',
+        # list parser
+        parser_list = subparsers.add_parser('list', aliases=['l','ls', 'll'],
+                                            help = 'List existing log entries',
+                                            parents=[parser_filter])
+        parser_list.add_argument('--rank',
+                          dest = 'rankResults',
+                          action = 'store_true',
+                          help = 'Order keyword search results by relevance')
+        parser_list.add_argument('-n', '--limit',
+                          dest = 'limit',
+                          default = None,
+                          type = int,
+                          help = 'List at most N logs',
+                          metavar = 'N')
+        parser_list.add_argument('-r', '--reverse',
+                          dest = 'reverse',
+                          action = 'store_true',
+                          help = 'List newest logs first')
+        parser_list.add_argument('--since-id',
+                          dest = 'sinceId',
+                          default = None,
+                          type = int,
+                          help = 'List logs after the log with the given id '
+                                 '(before it with --reverse)',
+                          metavar = 'LOG_ID')
+        parser_list.add_argument('--no-pager',
+                          dest = 'usePager',
+                          action = 'store_false',
+                          help = 'Do not page output through $PAGER')
+        parser_list.add_argument('-f', '--format',
+                          dest = 'listFormat',
+                          default = 'pretty',
+                          choices = LIST_FORMATS,
+                          help = 'Output format (default pretty)')
+        parser_pattern = parser_list.add_mutually_exclusive_group()
+        parser_pattern.add_argument('--regex',
+                          dest = 'regexPattern',
+                          default = None,
+                          help = 'List logs whose message contains a match '
+                                 'of a regular expression, case sensitive '
+                                 'unless it starts with (?i)',
+                          metavar = 'PATTERN')
+        parser_pattern.add_argument('--fuzzy',
+                          dest = 'fuzzyTerm',
+                          default = None,
+                          help = 'List logs whose message contains TERM '
+                                 'with at most --max-errors typos, ignoring '
+                                 'case',
+                          metavar = 'TERM')
+        parser_list.add_argument('--max-errors',
+                          dest = 'maxErrors',
+                          default = 1,
+                          type = int,
+                          help = 'Characters a --fuzzy match may insert, '
+                                 'delete or replace (default 1)',
+                          metavar = 'N')
+
+        # export parser
+        parser_export = subparsers.add_parser('export',
+                                              help = 'Export log entries',
+                                              parents=[parser_filter])
+        parser_export.add_argument('-f', '--format',
+                          dest = 'exportFormat',
+                          default = 'ndjson',
+                          choices = EXPORT_FORMATS,
+                          help = 'Output format')
+        parser_export.add_argument('-o', '--output-file',
+                          dest = 'outputFile',
+                          default = None,
+                          help = 'Write to the given file instead of '
+                                 'standard output',
+                          metavar = 'OUTPUT_FILE')
+        parser_export.add_argument('--chunk-size',
+                          dest = 'chunkSize',
+                          default = 500,
+                          type = int,
+                          help = 'Logs read from the database per query',
+                          metavar = 'N')
+
+        # log entry options, shared by the add and edit parsers
+        parser_entry = argparse.ArgumentParser(add_help=False)
+        parser_entry.add_argument('-i', '--input-file',
                           dest = 'inputFile',
                           help = 'File containing text to be logged',
                           default = None,
                           metavar = 'INPUT_FILE')
-        parser_add.add_argument('-t', '--tags',
+        parser_entry.add_argument('-t', '--tags',
                           dest = 'tagList',
                           default = None,
                           nargs = '+',
                           help = 'List of tags for the new log',
                           metavar = 'TAGS')
 
+        # add parser
+        parser_add = subparsers.add_parser('add', aliases=['a'],
+                                           help = 'Create new log entries',
+                                           parents=[parser_entry])
+        parser_add.add_argument('--spool',
+                          dest = 'spool',
+                          action = 'store_true',
+                          default = None,
+                          help = 'Append the log to the spool, to be written '
+                                 'to the database by "mlog flush"')
+        parser_add.add_argument('--dedupe',
+                          dest = 'dedupe',
+                          action = 'store_true',
+                          default = None,
+                          help = 'Add the tags to an existing log with the '
+                                 'same message instead of creating a new log')
+        parser_add.add_argument('message',
+                          nargs = '*',
+                          help = 'Message text, read from standard input if '
+                                 'not given',
+                          metavar = 'MESSAGE')
+
+        # spool flush parser
+        parser_flush = subparsers.add_parser('flush',
+                                             help = 'Write spooled log '
+                                                    'entries to the database')
+        parser_flush.add_argument('--dedupe',
+                          dest = 'dedupe',
+                          action = 'store_true',
+                          default = None,
+                          help = 'Add the tags of logs with the message of '
+                                 'an existing log to that log')
+
+        # daemon parser
+        parser_serve = subparsers.add_parser('serve',
+                                             help = 'Run a daemon serving '
+                                                    'the database to mlog '
+                                                    'commands')
+
         # edit/delete parsers
         parser_edit = subparsers.add_parser('edit', aliases=['e'],
                                             help = 'Edit existing log entries',
-                                            parents=[parser_add],
-                                            conflict_handler='resolve')
+                                            parents=[parser_entry])
         parser_edit.add_argument('entry_id', help = 'Entry to edit')
         parser_delete = subparsers.add_parser('delete',
                                               aliases = ['del', 'd'],
@@ -344,6 +715,114 @@ class ProgramOptions(object):
                                                                   'list-tags'],
                                                  help = 'List existing '
                                                         'log entries')
+        parser_list_tags.add_argument('-s', '--sort',
+                          dest = 'tagsOrder',
+                          default = 'count',
+                          choices = ('count', 'name'),
+                          help = 'Order tags by log count or by name')
+        parser_list_tags.add_argument('--top',
+                          dest = 'tagsLimit',
+                          default = None,
+                          type = int,
+                          help = 'List only the first N tags',
+                          metavar = 'N')
+        parser_list_tags.add_argument('--all',
+                          dest = 'showEmptyTags',
+                          action = 'store_true',
+                          help = 'Also list tags without any logs')
+        parser_list_tags.add_argument('--no-archives',
+                          dest = 'useArchives',
+                          action = 'store_false',
+                          help = 'Only count the logs of the database, not '
+                                 'of its yearly archives')
+        # stats parser
+        parser_stats = subparsers.add_parser('stats',
+                                             help = 'Count logs per day, '
+                                                    'week, month or year',
+                                             parents=[parser_filter])
+        parser_stats.add_argument('-p', '--period',
+                          dest = 'statsPeriod',
+                          default = 'day',
+                          choices = STATS_PERIODS,
+                          help = 'Period logs are counted by (default day)')
+        parser_stats.add_argument('--by-tag',
+                          dest = 'statsByTag',
+                          action = 'store_true',
+                          help = 'Count logs per period and tag')
+        parser_stats.add_argument('-f', '--format',
+                          dest = 'statsFormat',
+                          default = 'text',
+                          choices = ('text', 'tsv'),
+                          help = 'Output format (default text)')
+        # full text index rebuild parser
+        parser_reindex = subparsers.add_parser('reindex',
+                                               help = 'Rebuild the full text '
+                                                      'search index')
+        parser_reindex.add_argument('--trigram',
+                          dest = 'trigramIndex',
+                          action = 'store_true',
+                          help = 'Also create the trigram index used by '
+                                 'list --regex and --fuzzy')
+        # maintenance parser
+        parser_gc = subparsers.add_parser('gc',
+                                          help = 'Delete unused tags and '
+                                                 'compact the database')
+        parser_gc.add_argument('--full',
+                          dest = 'fullVacuum',
+                          action = 'store_true',
+                          help = 'Rewrite the whole database file instead '
+                                 'of only releasing its free pages')
+        # duplicate collapsing parser
+        parser_dedupe = subparsers.add_parser('dedupe',
+                                              help = 'Merge logs with the '
+                                                     'same message')
+        parser_dedupe.add_argument('-n', '--dry-run',
+                          dest = 'dryRun',
+                          action = 'store_true',
+                          help = 'Only count the duplicates')
+        # archive parser
+        parser_archive = subparsers.add_parser('archive',
+                                               help = 'Move the logs of past '
+                                                      'years to yearly '
+                                                      'archives')
+        parser_archive.add_argument('--before',
+                          dest = 'archiveYear',
+                          default = None,
+                          type = int,
+                          help = 'Archive the logs dated before this year '
+                                 '(default the current year)',
+                          metavar = 'YEAR')
+        # import parser
+        parser_import = subparsers.add_parser('import',
+                                              help = 'Import log entries in '
+                                                     'bulk')
+        parser_import.add_argument('importSource',
+                          help = 'NDJSON or CSV file ("-" for standard input) '
+                                 'or directory of text files',
+                          metavar = 'SOURCE')
+        parser_import.add_argument('-f', '--format',
+                          dest = 'importFormat',
+                          default = None,
+                          choices = IMPORT_FORMATS,
+                          help = 'Format of SOURCE, guessed if not set')
+        parser_import.add_argument('-t', '--tags',
+                          dest = 'tagList',
+                          default = None,
+                          nargs = '+',
+                          help = 'List of tags added to every imported log',
+                          metavar = 'TAGS')
+        parser_import.add_argument('--dedupe',
+                          dest = 'dedupe',
+                          action = 'store_true',
+                          default = None,
+                          help = 'Add the tags of logs with the message of '
+                                 'an existing log to that log')
+        parser_import.add_argument('--batch-size',
+                          dest = 'batchSize',
+                          default = 10000,
+                          type = int,
+                          help = 'Logs inserted per transaction',
+                          metavar = 'N')
 
         # commands
         parser_add.set_defaults(command=ProgramCommands.ADD)
@@ -351,6 +830,15 @@ class ProgramOptions(object):
         parser_edit.set_defaults(command=ProgramCommands.EDIT)
         parser_delete.set_defaults(command=ProgramCommands.DELETE)
         parser_list_tags.set_defaults(command=ProgramCommands.LIST_TAGS)
+        parser_reindex.set_defaults(command=ProgramCommands.REINDEX)
+        parser_import.set_defaults(command=ProgramCommands.IMPORT)
+        parser_export.set_defaults(command=ProgramCommands.EXPORT)
+        parser_serve.set_defaults(command=ProgramCommands.SERVE)
+        parser_flush.set_defaults(command=ProgramCommands.FLUSH)
+        parser_stats.set_defaults(command=ProgramCommands.STATS)
+        parser_gc.set_defaults(command=ProgramCommands.GC)
+        parser_dedupe.set_defaults(command=ProgramCommands.DEDUPE)
+        parser_archive.set_defaults(command=ProgramCommands.ARCHIVE)
 
         # no args, show list command
         if (len(sys.argv) < 2):
@@ -363,9 +851,84 @@ class ProgramOptions(object):
 
 
 def main():
+    """Runs the command. Returns the exit status of commands run by the mlog
+       daemon, None for commands run locally
+
+    """
     options = ProgramOptions()
+
+    if options.profileFile:
+        import cProfile
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(run, options)
+        finally:
+            profiler.dump_stats(options.profileFile)
+    return run(options)
+
+
+def run(options):
+    """Runs the command described by the given options, see main"""
+    if options.command == ProgramCommands.SERVE:
+        serve(options)
+        return None
+
+    pager = None
+    if options.command == ProgramCommands.LIST and options.usePager:
+        pager = startPager()
+    try:
+        return runCommand(options)
+    finally:
+        if pager is not None:
+            stopPager(pager)
+        if options.timings is not None:
+            options.timings.report()
+
+
+def runCommand(options):
+    """Runs the command on the mlog daemon if one is serving the database or
+       directly on the database otherwise. Timed commands always run through
+       the Logger, whose statements can be recorded
+
+    """
+    if options.command == ProgramCommands.ADD and options.spool:
+        from core.spool import spoolLog
+        spoolLog(options.dbPath, options.message, options.tags or [])
+        return None
+
+    if options.timings is None:
+        status = runRemoteCommand(options)
+        if status is not None:
+            return status
+
+        if options.command == ProgramCommands.ADD and appendLogFast(options):
+            return None
+
+    if options.command in (ProgramCommands.ADD, ProgramCommands.DELETE):
+        # nothing is written unless the command succeeds, so it is safe to
+        # run it again
+        from core.common import retryLocked
+        retryLocked(lambda: runLocalCommand(options), options.retries)
+    else:
+        runLocalCommand(options)
+    return None
+
+
+def runLocalCommand(options):
+    """Runs the command directly on the database"""
+    with timed(options.timings, 'imports'):
+        from core.logger import Logger
     logger = Logger(options)
+    try:
+        with timed(options.timings, 'command'):
+            runLoggerCommand(logger, options)
+    finally:
+        # not left to the garbage collector, which may run in another thread
+        logger.close()
 
+
+def runLoggerCommand(logger, options):
+    """Runs the command with the given Logger"""
     if options.command == ProgramCommands.LIST:
         logger.printLogs()
     elif options.command == ProgramCommands.ADD:
@@ -376,16 +939,152 @@ def main():
         logger.deleteLogWithId(options.logId)
     elif options.command == ProgramCommands.LIST_TAGS:
         logger.listTags()
+    elif options.command == ProgramCommands.REINDEX:
+        logger.rebuildIndex(options.trigramIndex)
+    elif options.command == ProgramCommands.IMPORT:
+        from contextlib import closing
+        from core.transfer import readRecords
+        with closing(readRecords(options.importSource,
+                                 options.importFormat)) as records:
+            count = logger.importLogs(records, options.batchSize)
+        print('Imported %d logs' % count)
+    elif options.command == ProgramCommands.EXPORT:
+        exportLogs(logger, options)
+    elif options.command == ProgramCommands.FLUSH:
+        flushSpooledLogs(logger, options)
+    elif options.command == ProgramCommands.STATS:
+        logger.printStats()
+    elif options.command == ProgramCommands.GC:
+        logger.collectGarbage(options.fullVacuum)
+    elif options.command == ProgramCommands.DEDUPE:
+        logger.collapseDuplicates(options.dryRun)
+    elif options.command == ProgramCommands.ARCHIVE:
+        logger.archiveLogs(options.archiveYear)
+
+
+def runRemoteCommand(options):
+    """Sends the command to the mlog daemon serving the database, if it is
+       one of the commands the daemon runs. Returns the exit status of the
+       command or None if it was not sent. Setting MLOG_NO_DAEMON disables the
+       daemon
+
+    """
+    name = REMOTE_COMMANDS.get(options.command)
+    if name is None or os.environ.get('MLOG_NO_DAEMON'):
+        return None
+    from core.client import runRemote
+    return runRemote(options.dbPath, name, options)
+
+
+def serve(options):
+    """Runs the mlog daemon until it is interrupted or terminated"""
+    from core.server import Server
+    server = Server(options.dbPath, options.pragmas, options.retries)
+    # unwind on SIGTERM so that the socket is removed
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve()
+    except KeyboardInterrupt:
+        pass
+
+
+def appendLogFast(options):
+    """Appends a log without loading SQLAlchemy if the database schema is up
+       to date. Returns False if the log was not appended, in which case the
+       Logger must be used. Setting MLOG_NO_FASTPATH disables the fast path
+
+    """
+    if os.environ.get('MLOG_NO_FASTPATH'):
+        return False
+    from core.fastpath import appendLog
+    return appendLog(options.dbPath, options.message, options.tags or [],
+                     options.pragmas, options.retries, options.dedupe)
+
+
+def flushSpooledLogs(logger, options):
+    """Writes the spooled logs to the database, each spool file in a single
+       transaction
+
+    """
+    from core.common import retryLocked
+    from core.spool import flushSpool
+
+    def importRecords(records):
+        records = list(records)
+        return retryLocked(lambda: logger.importLogs(records,
+                                                     max(1, len(records))),
+                           options.retries)
+
+    count = flushSpool(options.dbPath, importRecords)
+    print('Flushed %d logs' % count)
+
+
+def startPager():
+    """Redirects standard output to the user's pager ($PAGER, less by
+       default) if it is a terminal. Returns the pager process or None
+
+    """
+    pagerCommand = os.environ.get('PAGER', 'less')
+    if not pagerCommand or not sys.stdout.isatty():
+        return None
+    env = dict(os.environ)
+    # keep colours, exit if the output fits in a screen
+    env.setdefault('LESS', 'FRX')
+    try:
+        pager = subprocess.Popen(pagerCommand, shell=True, env=env,
+                                 stdin=subprocess.PIPE)
+    except OSError:
+        return None
+    if sys.version_info[0] < 3:
+        sys.stdout = pager.stdin
+    else:
+        sys.stdout = io.TextIOWrapper(pager.stdin)
+    return pager
+
+
+def stopPager(pager):
+    """Restores standard output and waits for the user to quit the pager"""
+    try:
+        sys.stdout.close()
+    except IOError:
+        # the pager was closed before all the output was written
+        pass
+    sys.stdout = sys.__stdout__
+    pager.wait()
+
+
+def exportLogs(logger, options):
+    """Writes the logs matching the filter options to the output file"""
+    from core.transfer import recordWriter, openOutput
+    if options.outputFile is None:
+        fd = sys.stdout
+    else:
+        try:
+            fd = openOutput(options.outputFile, options.exportFormat)
+        except IOError as error:
+            raise ConfigError(str(error))
+    try:
+        writer = recordWriter(fd, options.exportFormat)
+        for record in logger.exportLogs(options.chunkSize):
+            writer.write(record)
+        fd.flush()
+    finally:
+        if fd is not sys.stdout:
+            fd.close()
 
 
 if __name__ == '__main__':
     try:
-        main()
+        sys.exit(main())
     except ConfigError as error:
          sys.stderr.write(str(error) + '\n')
          sys.exit(os.EX_CONFIG)
     except Error as error:
          sys.stderr.write(str(error) + '\n')
          sys.exit(os.EX_SOFTWARE)
+    except IOError as error:
+         # output piped to a command that exited early
+         if error.errno != errno.EPIPE:
+             raise
 
 
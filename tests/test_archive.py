@@ -0,0 +1,61 @@
+# This file is part of mlog
+#
+# mlog is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# mlog is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mlog.  If not, see <http://www.gnu.org/licenses/>.
+import datetime
+
+from core.archive import archiveLogs, queryPartitions, tagCountsPartitions
+from core.fastpath import appendLog
+from core.store import LogStore
+
+
+def test_ids_are_not_reused_after_archiving_all_logs(tmpdir):
+    path = str(tmpdir.join('db'))
+    with LogStore(path, {}) as store:
+        store.appendMany({'message': 'old %d' % i, 'tags': ['old'],
+                          'date': datetime.datetime(2020, 1, i + 1)}
+                         for i in range(2))
+    with LogStore(path, {}) as store:
+        assert archiveLogs(store, path, {}, 2021) == [(2020, 2)]
+
+    with LogStore(path, {}) as store:
+        assert store.append('new 3') == 3
+        store.appendMany([{'message': 'new 4', 'tags': [], 'date': None}])
+    assert appendLog(path, 'new 5', [])
+
+    with LogStore(path, {}) as store:
+        records = list(queryPartitions(store, path, {},
+                                       lambda store: store.query()))
+        assert [record['id'] for record in records] == [1, 2, 3, 4, 5]
+        newest = list(queryPartitions(
+            store, path, {}, lambda store: store.query(reverse=True,
+                                                       sinceId=4),
+            reverse=True, limit=2))
+        assert [record['message'] for record in newest] == ['new 3',
+                                                            'old 1']
+
+
+def test_tag_counts_include_the_archives(tmpdir):
+    path = str(tmpdir.join('db'))
+    with LogStore(path, {}) as store:
+        store.appendMany([
+            {'message': 'old', 'tags': ['work', 'old'],
+             'date': datetime.datetime(2020, 1, 1)},
+            {'message': 'new', 'tags': ['work'], 'date': None}])
+    with LogStore(path, {}) as store:
+        archiveLogs(store, path, {}, 2021)
+        assert store.tagCounts() == [('work', 1)]
+        assert tagCountsPartitions(store, path, {}) == [('work', 2),
+                                                        ('old', 1)]
+        assert tagCountsPartitions(store, path, {}, 'name', 1) == [('old',
+                                                                     1)]
@@ -0,0 +1,77 @@
+# This file is part of mlog
+#
+# mlog is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# mlog is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mlog.  If not, see <http://www.gnu.org/licenses/>.
+import datetime
+
+import pytest
+
+from sqlalchemy import event
+
+from core.logger import Logger
+from core.server import RequestOptions
+from core.store import LogStore, openEngine
+
+
+def listStatements(dbPath, count):
+    """Lists a database of count tagged logs and returns the number of
+       statements the list command ran
+
+    """
+    engine = openEngine(dbPath, {})
+    with LogStore(engine=engine) as store:
+        store.appendMany({'message': 'log %d' % i, 'tags': ['a', 'b%d' % i],
+                          'date': None} for i in range(count))
+
+    options = RequestOptions({})
+    options.dbPath = dbPath
+    options.pragmas = {}
+    logger = Logger(options, engine)
+    statements = []
+    event.listen(engine, 'before_cursor_execute',
+                 lambda *arguments: statements.append(arguments[2]))
+    try:
+        logger.printLogs()
+    finally:
+        logger.close()
+        engine.dispose()
+    return len(statements)
+
+
+def test_list_statements_do_not_grow_with_results(tmpdir, capsys):
+    few = listStatements(str(tmpdir.join('few')), 2)
+    many = listStatements(str(tmpdir.join('many')), 30)
+    assert few == many
+    assert 'log 29' in capsys.readouterr().out
+
+
+@pytest.mark.parametrize('count, footer', [(1, 'logs in 1 day\n'),
+                                           (2, 'logs in 2 days\n')])
+def test_stats_footer_is_pluralized(tmpdir, capsys, count, footer):
+    path = str(tmpdir.join('db'))
+    engine = openEngine(path, {})
+    with LogStore(engine=engine) as store:
+        store.appendMany({'message': 'log %d' % day, 'tags': [],
+                          'date': datetime.datetime(2024, 3, day + 1)}
+                         for day in range(count))
+
+    options = RequestOptions({'useArchives': False})
+    options.dbPath = path
+    options.pragmas = {}
+    logger = Logger(options, engine)
+    try:
+        logger.printStats()
+    finally:
+        logger.close()
+        engine.dispose()
+    assert capsys.readouterr().out.endswith(footer)
@@ -0,0 +1,114 @@
+# This file is part of mlog
+#
+# mlog is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# mlog is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mlog.  If not, see <http://www.gnu.org/licenses/>.
+import random
+import sre_parse
+
+import pytest
+
+from core.errors import ConfigError
+from core.scan import (FuzzyMatcher, RegexMatcher, _approximateMatch,
+                       _requiredLiterals, scanLogIds)
+from core.store import LogStore
+
+
+def substringDistance(term, text):
+    """Returns the smallest edit distance between term and a substring of
+       text, by dynamic programming
+
+    """
+    row = [0] * (len(text) + 1)
+    for (i, c) in enumerate(term):
+        previous, row = row, [i + 1]
+        for (j, d) in enumerate(text):
+            row.append(min(previous[j] + (c != d), previous[j + 1] + 1,
+                           row[j] + 1))
+    return min(row)
+
+
+@pytest.mark.parametrize('pattern, literals', [
+    ('error', ['error']),
+    ('disk (full|empty)', ['disk ']),
+    ('time ?out', ['time', 'out']),
+    ('(?:con)+nection', ['con', 'nection']),
+    ('a*bcd', ['bcd']),
+    ('x{2,3}yz', ['x', 'yz']),
+    ('[ab]cde.fgh', ['cde', 'fgh']),
+    ('^start$', ['start']),
+])
+def test_required_literals(pattern, literals):
+    assert _requiredLiterals(sre_parse.parse(pattern)) == literals
+
+
+@pytest.mark.parametrize('term, text, maxErrors, matches', [
+    ('abcdef', 'xxabcdefxx', 0, True),
+    ('abcdef', 'xxabcxefxx', 0, False),
+    ('abcdef', 'xxabcxefxx', 1, True),
+    ('abcdef', 'xxabdefxx', 1, True),
+    ('abcdef', 'xxabcXdefxx', 1, True),
+    ('abcdef', 'xxacbdefxx', 1, False),
+    ('abcdef', 'xxacbdefxx', 2, True),
+    ('abcdef', 'bcde', 2, True),
+    ('abcdef', 'bcd', 2, False),
+    ('abcdef', '', 5, False),
+])
+def test_approximate_match_at_the_limit(term, text, maxErrors, matches):
+    assert _approximateMatch(term, text, maxErrors) == matches
+
+
+def test_approximate_match_agrees_with_edit_distance():
+    generator = random.Random(0)
+    for _ in range(2000):
+        term = ''.join(generator.choice('abc')
+                       for _ in range(generator.randint(2, 8)))
+        text = ''.join(generator.choice('abc')
+                       for _ in range(generator.randint(0, 12)))
+        distance = substringDistance(term, text)
+        for maxErrors in range(len(term)):
+            assert (_approximateMatch(term, text, maxErrors) ==
+                    (distance <= maxErrors)), (term, text, maxErrors)
+
+
+@pytest.mark.parametrize('term, maxErrors', [('ab', 2), ('ab', -1)])
+def test_fuzzy_matcher_error_bounds(term, maxErrors):
+    with pytest.raises(ConfigError):
+        FuzzyMatcher(term, maxErrors)
+
+
+def test_invalid_regular_expression():
+    with pytest.raises(ConfigError):
+        RegexMatcher('(unclosed')
+
+
+@pytest.mark.parametrize('trigram', [False, True])
+@pytest.mark.parametrize('matcher, messages', [
+    (RegexMatcher(r'time ?out'), ['timeout', 'time out']),
+    (RegexMatcher(r'(?i)DISK'), ['Disk full']),
+    (FuzzyMatcher('connection', 1), ['Conection reset', 'connection lost']),
+    (FuzzyMatcher('connection', 2), ['Conection reset', 'connection lost',
+                                     'konnektion refused']),
+])
+def test_scan(tmpdir, trigram, matcher, messages):
+    path = str(tmpdir.join('db'))
+    with LogStore(path, {}) as store:
+        store.appendMany({'message': message, 'tags': [], 'date': None}
+                         for message in ['timeout', 'time out', 'Disk full',
+                                         'Conection reset', 'connection lost',
+                                         'konnektion refused', 'unrelated'])
+        if trigram:
+            store.rebuildIndex(trigram=True)
+    with LogStore(path, {}) as store:
+        logIds = scanLogIds(path, matcher, trigram=trigram, processes=1)
+        assert [record['message'] for record in store.query()
+                if record['id'] in logIds] == messages
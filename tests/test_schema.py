@@ -0,0 +1,100 @@
+# This file is part of mlog
+#
+# mlog is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# mlog is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mlog.  If not, see <http://www.gnu.org/licenses/>.
+import sqlite3
+
+from core.common import SCHEMA_VERSION
+from core.store import LogStore, openEngine
+
+
+def createVersion0(path):
+    """Creates a database with the schema of the first mlog versions: two
+       logs, one of them with a duplicate tag association
+
+    """
+    connection = sqlite3.connect(path)
+    connection.executescript(
+        'CREATE TABLE logs (id INTEGER NOT NULL, date DATETIME, '
+        'message VARCHAR, PRIMARY KEY (id));'
+        'CREATE TABLE tags (id INTEGER NOT NULL, name VARCHAR NOT NULL, '
+        'PRIMARY KEY (id), UNIQUE (name));'
+        'CREATE TABLE "logTags" (log_id INTEGER, tag_id INTEGER, '
+        'FOREIGN KEY(log_id) REFERENCES logs (id), '
+        'FOREIGN KEY(tag_id) REFERENCES tags (id));'
+        "INSERT INTO logs VALUES (1, '2020-01-01 10:00:00.000000', 'first');"
+        "INSERT INTO logs VALUES (2, '2020-01-02 10:00:00.000000', 'second');"
+        "INSERT INTO tags VALUES (1, 'work');"
+        'INSERT INTO "logTags" VALUES (1, 1);'
+        'INSERT INTO "logTags" VALUES (1, 1);'
+        'INSERT INTO "logTags" VALUES (2, 1);')
+    connection.close()
+
+
+def readLogs(path):
+    """Returns (id, message, tags) tuples of the logs of a database"""
+    engine = openEngine(path, {})
+    try:
+        with LogStore(engine=engine) as store:
+            return [(record['id'], record['message'], record['tags'])
+                    for record in store.query()]
+    finally:
+        engine.dispose()
+
+
+def userVersion(path):
+    connection = sqlite3.connect(path)
+    try:
+        return connection.execute('PRAGMA user_version').fetchone()[0]
+    finally:
+        connection.close()
+
+
+def test_migrates_version_0(tmpdir):
+    path = str(tmpdir.join('db'))
+    createVersion0(path)
+    assert readLogs(path) == [(1, 'first', ['work']),
+                              (2, 'second', ['work'])]
+    assert userVersion(path) == SCHEMA_VERSION
+
+
+def test_finishes_interrupted_association_table_migration(tmpdir):
+    path = str(tmpdir.join('db'))
+    createVersion0(path)
+    connection = sqlite3.connect(path)
+    connection.execute('ALTER TABLE "logTags" RENAME TO "logTags_old"')
+    connection.close()
+    assert readLogs(path) == [(1, 'first', ['work']),
+                              (2, 'second', ['work'])]
+    assert userVersion(path) == SCHEMA_VERSION
+
+
+def test_finishes_interrupted_message_hash_migration(tmpdir):
+    path = str(tmpdir.join('db'))
+    createVersion0(path)
+    readLogs(path)
+    # as left by a run interrupted after the column was added
+    connection = sqlite3.connect(path)
+    with connection:
+        connection.execute('DROP INDEX ix_logs_hash')
+        connection.execute('UPDATE logs SET hash = NULL')
+        connection.execute('PRAGMA user_version = 3')
+    connection.close()
+    assert readLogs(path) == [(1, 'first', ['work']),
+                              (2, 'second', ['work'])]
+    connection = sqlite3.connect(path)
+    try:
+        assert connection.execute('SELECT count(*) FROM logs '
+                                  'WHERE hash IS NULL').fetchone()[0] == 0
+    finally:
+        connection.close()
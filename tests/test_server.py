@@ -0,0 +1,104 @@
+# This file is part of mlog
+#
+# mlog is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# mlog is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mlog.  If not, see <http://www.gnu.org/licenses/>.
+import os
+import json
+import time
+import socket
+import threading
+
+import pytest
+
+from core import client, server
+from core.common import socketPath
+from core.store import LogStore
+
+
+@pytest.fixture
+def dbPath(tmpdir, monkeypatch):
+    """Database served by a daemon running in a thread"""
+    monkeypatch.setattr(server, 'REQUEST_TIMEOUT', 0.2)
+    path = str(tmpdir.join('db'))
+    daemon = threading.Thread(target=server.Server(path, {}).serve)
+    daemon.daemon = True
+    daemon.start()
+    while not os.path.exists(socketPath(path)):
+        time.sleep(0.01)
+    return path
+
+
+def connect(dbPath):
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    connection.connect(socketPath(dbPath))
+    return connection
+
+
+def request(dbPath, frame):
+    """Sends a request and returns the frames of the reply"""
+    connection = connect(dbPath)
+    try:
+        connection.sendall((json.dumps(frame) + '\n').encode('utf-8'))
+        return [json.loads(line.decode('utf-8'))
+                for line in connection.makefile('rb')]
+    finally:
+        connection.close()
+
+
+def test_serves_after_an_unexpected_error(dbPath):
+    reply = request(dbPath, {'options': {}})
+    assert reply[-1]['exit'] == os.EX_SOFTWARE
+    reply = request(dbPath, {'command': 'tags', 'options': {}})
+    assert reply == [{'accepted': True}, {'exit': 0}]
+
+
+def test_serves_after_a_client_that_sends_nothing(dbPath):
+    idle = connect(dbPath)
+    try:
+        reply = request(dbPath, {'command': 'tags', 'options': {}})
+        assert reply == [{'accepted': True}, {'exit': 0}]
+    finally:
+        idle.close()
+
+
+def test_slow_reader_does_not_hold_up_other_clients(dbPath):
+    with LogStore(dbPath, {}) as store:
+        store.appendMany({'message': 'log %d ' % i + 'x' * 300, 'tags': [],
+                          'date': None} for i in range(3000))
+    reader = connect(dbPath)
+    try:
+        # more output than the socket buffers hold, never read
+        reader.sendall(b'{"command": "list", "options": {}}\n')
+        reader.recv(1)
+        started = time.time()
+        reply = request(dbPath, {'command': 'add',
+                                 'options': {'message': 'next'}})
+        assert reply[-1] == {'exit': 0}
+        assert time.time() - started < 2
+    finally:
+        reader.close()
+
+
+def test_client_falls_back_when_the_daemon_does_not_accept(tmpdir,
+                                                           monkeypatch):
+    monkeypatch.setattr(client, 'ACCEPT_TIMEOUT', 0.2)
+    path = str(tmpdir.join('db'))
+    # a daemon that never reads its connections
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(socketPath(path))
+    listener.listen(1)
+    try:
+        options = server.RequestOptions({})
+        assert client.runRemote(path, 'tags', options) is None
+    finally:
+        listener.close()
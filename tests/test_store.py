@@ -0,0 +1,252 @@
+# This file is part of mlog
+#
+# mlog is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# mlog is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mlog.  If not, see <http://www.gnu.org/licenses/>.
+import sqlite3
+import threading
+
+import pytest
+
+from core.compression import COMPRESS_THRESHOLD, compressMessage, \
+                             decompressMessage
+from core.errors import ConfigError, UnknownTagError
+from core.fastpath import appendLog
+from core.store import LogStore, openEngine
+
+
+@pytest.fixture
+def engine(tmpdir):
+    engine = openEngine(str(tmpdir.join('db')), {})
+    yield engine
+    engine.dispose()
+
+
+def freePages(engine):
+    connection = sqlite3.connect(engine.url.database)
+    try:
+        return connection.execute('PRAGMA freelist_count').fetchone()[0]
+    finally:
+        connection.close()
+
+
+def storedTypes(engine):
+    connection = sqlite3.connect(engine.url.database)
+    try:
+        return [row[0] for row in connection.execute(
+                    'SELECT typeof(message) FROM logs ORDER BY id')]
+    finally:
+        connection.close()
+
+
+@pytest.mark.parametrize('message, compressed', [
+    (u'short', False),
+    (u'x' * COMPRESS_THRESHOLD, False),
+    (u'x' * (COMPRESS_THRESHOLD + 1), True),
+    # 2 bytes per character once encoded
+    (u'\xe9' * (COMPRESS_THRESHOLD // 2 + 1), True),
+])
+def test_compression_round_trip(message, compressed):
+    value = compressMessage(message)
+    assert isinstance(value, type(message)) != compressed
+    assert decompressMessage(value) == message
+
+
+def test_large_messages_are_stored_compressed(engine):
+    large = u'needle ' + u'\xe9t\xe9 ' * COMPRESS_THRESHOLD
+    with LogStore(engine=engine) as store:
+        store.append(u'small needle', ['tag'])
+        store.append(large, ['tag'])
+        store.appendMany([{'message': large + u'!', 'tags': ['tag'],
+                           'date': None}])
+    assert appendLog(engine.url.database, large + u'?', ['tag'], {})
+    assert storedTypes(engine) == ['text', 'blob', 'blob', 'blob']
+
+    with LogStore(engine=engine) as store:
+        assert [record['message'] for record in store.query()] == [
+                   u'small needle', large, large + u'!', large + u'?']
+        assert len(list(store.query(keyword=u'needle'))) == 4
+
+
+def test_gc_frees_all_pages(engine):
+    with LogStore(engine=engine) as store:
+        store.appendMany({'message': 'x' * 1000 + str(i), 'tags': ['tag'],
+                          'date': None} for i in range(2000))
+    with LogStore(engine=engine) as store:
+        for record in list(store.query()):
+            store.delete(record['id'])
+    assert freePages(engine) > 100
+
+    with LogStore(engine=engine) as store:
+        result = store.collectGarbage()
+    assert freePages(engine) == 0
+    assert result['sizeAfter'] < result['sizeBefore'] / 10
+
+
+def test_concurrent_writers_get_distinct_ids(tmpdir):
+    path = str(tmpdir.join('db'))
+    pragmas = {'journal_mode': 'wal', 'busy_timeout': 10000}
+    openEngine(path, pragmas).dispose()
+    errors = []
+
+    def appendBatches():
+        try:
+            for batch in range(30):
+                with LogStore(path, pragmas) as store:
+                    store.appendMany({'message': 'batch %d %d' % (batch, i),
+                                      'tags': ['batch'], 'date': None}
+                                     for i in range(20))
+        except Exception as error:
+            errors.append(error)
+
+    def appendSingles():
+        try:
+            for i in range(100):
+                assert appendLog(path, 'single %d' % i, ['single'], pragmas)
+        except Exception as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=appendBatches),
+               threading.Thread(target=appendSingles)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    with LogStore(path, pragmas) as store:
+        assert len(list(store.query())) == 700
+
+
+@pytest.mark.parametrize('tagQuery, error', [
+    (u'n\xf6pe', UnknownTagError),
+    (u'a & (\xf6', ConfigError),
+])
+def test_non_ascii_tag_errors_have_a_message(engine, tagQuery, error):
+    with LogStore(engine=engine) as store:
+        store.append(u'log', [u'a'])
+        with pytest.raises(error) as raised:
+            list(store.query(tagQuery=tagQuery))
+    assert u'\xf6'.encode('utf-8') in str(raised.value)
+
+
+@pytest.mark.parametrize('tagQuery, messages', [
+    ('work & !draft', ['a', 'b']),
+    ('!draft & !ghost', ['a', 'b', 'c']),
+    ('work & !ghost', ['a', 'b']),
+    ('ops | ghost', ['c']),
+    ('(work & ghost) | ops', ['c']),
+    ('!ghost', ['a', 'b', 'c', 'd']),
+])
+def test_unknown_optional_tags_match_no_log(engine, tagQuery, messages):
+    with LogStore(engine=engine) as store:
+        store.append('a', ['work'])
+        store.append('b', ['work'])
+        store.append('c', ['ops'])
+        store.append('d', ['draft'])
+        assert [record['message'] for record
+                in store.query(tagQuery=tagQuery)] == messages
+
+
+@pytest.mark.parametrize('tagQuery', ['ghost', 'work & ghost',
+                                      '(work & ghost) | (ops & ghost)'])
+def test_unknown_required_tag_is_an_error(engine, tagQuery):
+    with LogStore(engine=engine) as store:
+        store.append('a', ['work', 'ops'])
+        with pytest.raises(UnknownTagError):
+            list(store.query(tagQuery=tagQuery))
+
+
+def messagesAndTags(store):
+    return [(record['message'], sorted(record['tags']))
+            for record in store.query()]
+
+
+def test_dedupe_adds_the_tags_to_the_existing_log(engine):
+    large = u'large ' * COMPRESS_THRESHOLD
+    with LogStore(engine=engine) as store:
+        first = store.append(u'disk full', ['ops'])
+        store.append(large, ['ops'])
+        assert store.append(u'disk full', ['oncall'], dedupe=True) == first
+        assert store.append(u'disk full', ['ops']) != first
+        assert store.appendMany([
+                   {'message': large, 'tags': ['big'], 'date': None},
+                   {'message': u'new', 'tags': ['a'], 'date': None},
+                   {'message': u'new', 'tags': ['b'], 'date': None}],
+                   ['import'], dedupe=True) == 1
+    assert appendLog(engine.url.database, u'new', ['c'], {}, dedupe=True)
+
+    with LogStore(engine=engine) as store:
+        assert messagesAndTags(store) == [
+            (u'disk full', [u'oncall', u'ops']),
+            (large, [u'big', u'import', u'ops']),
+            (u'disk full', [u'ops']),
+            (u'new', [u'a', u'b', u'c', u'import'])]
+
+
+def test_collapse_duplicates(engine):
+    large = u'large ' * COMPRESS_THRESHOLD
+    with LogStore(engine=engine) as store:
+        for (message, tags) in [(u'a', ['x']), (large, ['x']), (u'a', ['y']),
+                                (u'b', ['x']), (large, ['z']), (u'a', ['x'])]:
+            store.append(message, tags)
+    with LogStore(engine=engine) as store:
+        assert store.collapseDuplicates(dryRun=True) == (3, 2)
+        assert len(list(store.query())) == 6
+        assert store.collapseDuplicates() == (3, 2)
+        assert store.collapseDuplicates() == (0, 0)
+        assert messagesAndTags(store) == [(u'a', [u'x', u'y']),
+                                          (large, [u'x', u'z']),
+                                          (u'b', [u'x'])]
+
+
+def dropFullTextIndex(engine):
+    connection = sqlite3.connect(engine.url.database)
+    try:
+        for name in ('logs_fts_ai', 'logs_fts_ad', 'logs_fts_au'):
+            connection.execute('DROP TRIGGER %s' % name)
+        connection.execute('DROP TABLE logs_fts')
+    finally:
+        connection.close()
+
+
+@pytest.mark.parametrize('fullText', [True, False])
+@pytest.mark.parametrize('keyword, messages', [
+    ('err', ['Errors: 3', 'error_code=5']),
+    ('rror', []),
+    ('CODE', ['error_code=5']),
+    ('cafe', [u'Caf\xe9 closed']),
+    (u'caf\xe9 clo*', [u'Caf\xe9 closed']),
+    ('"disk fu" sda', ['Disk full on /dev/sda']),
+    ('"full disk"', []),
+    ('"dev disk"', []),
+    ('disk-full', ['Disk full on /dev/sda']),
+    ('disk err', []),
+])
+def test_keyword_search(engine, fullText, keyword, messages):
+    if not fullText:
+        dropFullTextIndex(engine)
+    with LogStore(engine=engine) as store:
+        for message in ['Disk full on /dev/sda', u'Caf\xe9 closed',
+                        'error_code=5', 'Errors: 3']:
+            store.append(message, ['tag'])
+        assert sorted(record['message'] for record
+                      in store.query(keyword=keyword)) == messages
+
+
+@pytest.mark.parametrize('fullText', [True, False])
+def test_keyword_without_words(engine, fullText):
+    if not fullText:
+        dropFullTextIndex(engine)
+    with LogStore(engine=engine) as store:
+        store.append('log', ['tag'])
+        with pytest.raises(ConfigError):
+            list(store.query(keyword='"" * !'))
@@ -0,0 +1,89 @@
+# This file is part of mlog
+#
+# mlog is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# mlog is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mlog.  If not, see <http://www.gnu.org/licenses/>.
+import datetime
+
+import pytest
+
+from core.errors import ConfigError
+from core.store import LogStore, openEngine
+from core.tagquery import parseTagQuery, requiredTagNames
+
+
+@pytest.fixture
+def engine(tmpdir):
+    engine = openEngine(str(tmpdir.join('db')), {})
+    yield engine
+    engine.dispose()
+
+
+@pytest.mark.parametrize('text, node', [
+    ('a', ('tag', 'a')),
+    ('a & b', ('and', [('tag', 'a'), ('tag', 'b')])),
+    ('a,b c', ('and', [('tag', 'a'), ('tag', 'b'), ('tag', 'c')])),
+    ('a | b & c', ('or', [('tag', 'a'),
+                          ('and', [('tag', 'b'), ('tag', 'c')])])),
+    ('a & b | c', ('or', [('and', [('tag', 'a'), ('tag', 'b')]),
+                          ('tag', 'c')])),
+    ('(a | b) & c', ('and', [('or', [('tag', 'a'), ('tag', 'b')]),
+                             ('tag', 'c')])),
+    ('!a & b', ('and', [('not', ('tag', 'a')), ('tag', 'b')])),
+    ('!(a | b)', ('not', ('or', [('tag', 'a'), ('tag', 'b')]))),
+    ('!!a', ('not', ('not', ('tag', 'a')))),
+    ('c++ & x-y', ('and', [('tag', 'c++'), ('tag', 'x-y')])),
+])
+def test_parse(text, node):
+    assert parseTagQuery(text) == node
+
+
+@pytest.mark.parametrize('text', ['', 'a &', '& a', 'a | | b', '(a', 'a)',
+                                  '()', 'a & !', '!)'])
+def test_parse_errors(text):
+    with pytest.raises(ConfigError):
+        parseTagQuery(text)
+
+
+@pytest.mark.parametrize('text, names', [
+    ('a & !b', set(['a'])),
+    ('a | b', set()),
+    ('(a & b) | (a & c)', set(['a'])),
+    ('!(a & b)', set()),
+])
+def test_required_tag_names(text, names):
+    assert requiredTagNames(parseTagQuery(text)) == names
+
+
+@pytest.mark.parametrize('afterDate', [None, datetime.datetime(2000, 1, 1)])
+@pytest.mark.parametrize('tagQuery, messages', [
+    ('work', ['a', 'b', 'c']),
+    ('work & ops', ['b']),
+    ('work ops | home', ['b', 'd']),
+    ('work & (ops | home)', ['b']),
+    ('work & !ops', ['a', 'c']),
+    ('!work', ['d', 'e']),
+    ('!(work | home)', ['e']),
+    ('!work & !home', ['e']),
+    ('(work | home) & !ops & !draft', ['a', 'd']),
+])
+def test_query(engine, afterDate, tagQuery, messages):
+    with LogStore(engine=engine) as store:
+        store.append('a', ['work'])
+        store.append('b', ['work', 'ops'])
+        store.append('c', ['work', 'draft'])
+        store.append('d', ['home'])
+        store.append('e', ['ops'])
+        # a date filter evaluates the query as a condition on the logs
+        # instead of a compound select of ids
+        records = store.query(tagQuery=tagQuery, afterDate=afterDate)
+        assert [record['message'] for record in records] == messages
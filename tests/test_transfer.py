@@ -0,0 +1,51 @@
+# This file is part of mlog
+#
+# mlog is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# mlog is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mlog.  If not, see <http://www.gnu.org/licenses/>.
+import pytest
+
+from core import transfer
+
+
+@pytest.fixture
+def opened(monkeypatch):
+    """Records the files opened by core.transfer"""
+    files = []
+
+    def recordingOpen(*arguments):
+        files.append(open(*arguments))
+        return files[-1]
+    monkeypatch.setattr(transfer, 'open', recordingOpen, raising=False)
+    return files
+
+
+@pytest.mark.parametrize('name, content', [
+    ('logs.ndjson', '{"message": "first"}\n{"message": "second"}\n'),
+    ('logs.csv', 'message,tags\nfirst,a\nsecond,b\n'),
+])
+def test_source_is_closed_once_read(tmpdir, opened, name, content):
+    source = tmpdir.join(name)
+    source.write(content)
+    records = list(transfer.readRecords(str(source)))
+    assert [record['message'] for record in records] == ['first', 'second']
+    assert len(opened) == 1 and opened[0].closed
+
+
+def test_source_is_closed_with_the_iterator(tmpdir, opened):
+    source = tmpdir.join('logs.ndjson')
+    source.write('{"message": "first"}\n{"message": "second"}\n')
+    records = transfer.readRecords(str(source))
+    next(records)
+    assert not opened[0].closed
+    records.close()
+    assert opened[0].closed